@@ -2,22 +2,138 @@
 Streamlit dashboard for Brand Perception Monitor.
 """
 
+import html
+import json
+import os
+import sys
 import streamlit as st
 import pandas as pd
 import random
 import plotly.express as px
 
-st.set_page_config(page_title="LeapScholar Brand Perception Monitor", layout="wide")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "modules"))
+import aggregates
+import brands
+import ingest
+import instrumentation
+import search_index
+import storage
+import timeseries
+import trending
 
-# Load data
-twitter_df = pd.read_csv(r"data/processed/twitter_sentiment.csv")
-news_df = pd.read_csv(r"data/processed/news_sentiment.csv")
-try:
-    keywords_df = pd.read_csv(r"data/processed/news_top_keywords.csv")
-except Exception:
+BRANDS = brands.load_brands()
+st.set_page_config(page_title=f"{brands.primary_brand(BRANDS).name} Brand Perception Monitor", layout="wide")
+
+PROCESSED_DIR = "data/processed"
+ALL_BRANDS = "All brands"
+METRICS_EXPORT_INTERVAL = 30
+
+
+def file_version(path):
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+
+# Cached per file mtime: reruns and other viewers reuse the parsed frame until the file changes
+@st.cache_data(show_spinner=False)
+def load_table(path, version):
+    if version is None:
+        return pd.DataFrame()
+    with instrumentation.span("dashboard_load", table=os.path.basename(path)):
+        return pd.read_csv(path)
+
+
+def read_table(name, directory=PROCESSED_DIR):
+    path = os.path.join(directory, name)
+    return load_table(path, file_version(path))
+
+
+@st.cache_data(show_spinner=False)
+def load_mentions(columns, platforms, start, end, version):
+    if version is None:
+        return pd.DataFrame(columns=list(columns))
+    with instrumentation.span("dashboard_load", table="mentions"):
+        return storage.read_mentions(columns=list(columns), platforms=list(platforms), start=start, end=end)
+
+
+@st.cache_data(show_spinner=False)
+def load_trending(path, version):
+    if version is None:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+@st.cache_data(show_spinner=False)
+def load_timeseries(start, end, platforms, resolution, version):
+    series, resolution = timeseries.load_series(start, end, platforms=list(platforms), resolution=resolution)
+    if series.empty:
+        return series, series, resolution
+    # Only downsampled points leave the server: the share chart and the volume chart split the budget
+    share = timeseries.downsample(timeseries.sentiment_share(series), "bucket", timeseries.SENTIMENTS,
+                                  timeseries.MAX_POINTS // len(timeseries.SENTIMENTS))
+    volume_columns = ["mentions", "like_count", "retweet_count", "reply_count"]
+    volume = timeseries.downsample(series, "bucket", volume_columns, timeseries.MAX_POINTS // len(volume_columns))
+    return share, volume, resolution
+
+
+# One connection per server process; the index serializes access across sessions
+@st.cache_resource(show_spinner=False)
+def open_search_index():
+    return search_index.SearchIndex()
+
+
+def highlight(snippet):
+    escaped = html.escape(snippet or "")
+    return escaped.replace(search_index.HIGHLIGHT_START, "<mark>").replace(search_index.HIGHLIGHT_END, "</mark>")
+
+
+# Each brand's partition mirrors the processed layout, so picking a brand only swaps the directory
+brand_names = [brand.name for brand in BRANDS]
+selected_brand = st.sidebar.selectbox("Brand", [ALL_BRANDS] + brand_names if len(BRANDS) > 1 else brand_names)
+if selected_brand == ALL_BRANDS:
+    brand_dir = PROCESSED_DIR
+else:
+    brand_dir = brands.brand_dir(BRANDS[brand_names.index(selected_brand)], PROCESSED_DIR)
+
+# Load data; a brand has no directory until the pipeline's brand_partitions stage first runs
+if os.path.isdir(brand_dir):
+    aggregates.refresh_aggregates(brand_dir)
+# The time-series tiers are rebuilt by the pipeline's timeseries stage and, while it runs,
+# by the ingest service; a render only reads them
+sentiment_counts = read_table(aggregates.SENTIMENT_COUNTS, brand_dir)
+engagement_totals = read_table(aggregates.ENGAGEMENT_TOTALS, brand_dir)
+feed_df = read_table(aggregates.FEED_SAMPLE, brand_dir)
+twitter_df = feed_df[feed_df["platform"] == "Twitter"] if not feed_df.empty else feed_df
+news_df = feed_df[feed_df["platform"] == "News"] if not feed_df.empty else feed_df
+reddit_df = feed_df[feed_df["platform"] == "Reddit"] if not feed_df.empty else feed_df
+keywords_df = read_table("news_top_keywords.csv")
+if keywords_df.empty:
     keywords_df = pd.DataFrame(columns=["keyword", "frequency"])
+trending_snapshot = load_trending(trending.SNAPSHOT_PATH, file_version(trending.SNAPSHOT_PATH))
+
+# Optional date range: answered from the Parquet store with column projection and partition pruning
+st.sidebar.header("Filters")
+date_range = None
+if st.sidebar.checkbox("Limit to date range", value=False):
+    today = pd.Timestamp.today().date()
+    picked = st.sidebar.date_input("Date range", value=(today - pd.Timedelta(days=30), today))
+    if isinstance(picked, (list, tuple)) and len(picked) == 2:
+        date_range = picked
+    if brand_dir != PROCESSED_DIR:
+        st.sidebar.caption("Date-range counts come from the mention store and cover all brands.")
+if date_range:
+    warehouse_version = storage.dataset_version()
+    ranged = load_mentions(("platform", "sentiment"), ("Twitter", "News"), date_range[0], date_range[1], warehouse_version)
+    sentiment_counts = ranged.groupby(["platform", "sentiment"], observed=True).size().reset_index(name="count")
+    engagement = load_mentions(("like_count", "retweet_count", "reply_count", "quote_count"), ("Twitter",),
+                               date_range[0], date_range[1], warehouse_version)
+    engagement_totals = engagement.sum().rename_axis("metric").reset_index(name="total")
+# Cached loads only record a span on a miss; the export is shared by every session of this server,
+# and every rerun of every session would otherwise rewrite it
+instrumentation.export("dashboard", min_interval=METRICS_EXPORT_INTERVAL)
 
-st.title("LeapScholar Brand Perception Monitor")
+title_brand = selected_brand if selected_brand != ALL_BRANDS else brands.primary_brand(BRANDS).name
+st.title(f"{title_brand} Brand Perception Monitor")
 st.markdown("""
 <style>
 .big-font {font-size:30px !important; font-weight:700;}
@@ -82,8 +198,11 @@ col1, col2 = st.columns([2, 3])
 
 with col1:
     # Combine Twitter and News sentiment data
-    all_sentiments = pd.concat([twitter_df['sentiment'], news_df['sentiment']], ignore_index=True)
-    combined_counts = all_sentiments.value_counts().reindex(['Positive','Negative','Neutral'], fill_value=0)
+    if sentiment_counts.empty:
+        combined_counts = pd.Series(0, index=['Positive','Negative','Neutral'])
+    else:
+        platform_counts = sentiment_counts[sentiment_counts['platform'].isin(['Twitter', 'News'])]
+        combined_counts = platform_counts.groupby('sentiment')['count'].sum().reindex(['Positive','Negative','Neutral'], fill_value=0)
     
     fig1 = px.pie(values=combined_counts.values, names=combined_counts.index, 
                   color=combined_counts.index,
@@ -136,25 +255,108 @@ with col2:
     
     with sub_col3:
         st.markdown("<div class='section-title'>🤖 Reddit Posts</div>", unsafe_allow_html=True)
-        # Sample Reddit posts (you can replace this with actual Reddit data)
-        sample_reddit = [
-            {"title": "Actually good credit cards for International Students? (Zolve vs Sable)", "sentiment": "Negative"},
-            {"title": "Has anyone used Leap for studying abroad? How was your experience?", "sentiment": "Neutral"},
-            {"title": "LeapScholar helped me get into my dream university!", "sentiment": "Positive"}
-        ]
-        
-        for post in sample_reddit[:3]:
+        if len(reddit_df) > 0:
+            for _, row in reddit_df.sample(n=min(3, len(reddit_df))).iterrows():
+                st.markdown(f"""
+                <div class='reddit-item'>
+                    <p style='font-size: 12px; margin-bottom: 6px; color: #1f2937;'>{row['title'][:70]}...</p>
+                    <div style='display: flex; justify-content: space-between; align-items: center;'>
+                        <span class='sentiment-{row['sentiment'].lower()[:3]}'>{row['sentiment']}</span>
+                    </div>
+                </div>
+                """, unsafe_allow_html=True)
+        else:
+            st.info("No Reddit posts available.")
+    
+    st.markdown("</div>", unsafe_allow_html=True)
+
+# --- Live Ingestion ---
+live_refresh = st.sidebar.checkbox("Live refresh", value=False,
+                                   help="Poll the store for mentions written by the ingestion service")
+
+
+@st.fragment(run_every=15 if live_refresh else None)
+def live_panel():
+    metrics = ingest.load_metrics()
+    if metrics is None:
+        return
+    st.header("⚡ Live Mentions")
+    lag = metrics.get("end_to_end_lag_seconds") or {}
+    written = sum(metrics.get("written", {}).values())
+    live_col1, live_col2, live_col3 = st.columns(3)
+    live_col1.metric("Mentions ingested", f"{written:,}")
+    live_col2.metric("Lag p50 / p95", f"{lag.get('p50', 0):.0f}s / {lag.get('p95', 0):.0f}s" if lag else "n/a")
+    live_col3.metric("Queue depth", metrics.get("queue_depth", 0))
+    today = pd.Timestamp.today().date()
+    live = load_mentions(("platform", "created_at", "text", "title", "sentiment"), ("Twitter", "News", "Reddit"),
+                         today, today, storage.dataset_version())
+    if live.empty:
+        st.info("No mentions ingested today yet.")
+        return
+    latest = live.sort_values("created_at", ascending=False, na_position="last").head(10)
+    for _, row in latest.iterrows():
+        text = row["title"] if isinstance(row["title"], str) and row["title"] else row["text"]
+        sentiment_label = row["sentiment"] if isinstance(row["sentiment"], str) else "Unscored"
+        st.markdown(
+            f"<span class='sentiment-{sentiment_label.lower()[:3]}'>{sentiment_label}</span> "
+            f"<span style='color: #6b7280; font-size: 12px;'>{row['platform']}</span> "
+            f"{html.escape(str(text)[:140])}",
+            unsafe_allow_html=True,
+        )
+
+
+live_panel()
+
+# --- Mention Search ---
+st.header("🔎 Search Mentions")
+search_col1, search_col2, search_col3 = st.columns([3, 2, 2])
+with search_col1:
+    query = st.text_input("Search tweets, news and Reddit", placeholder="e.g. refund, IELTS")
+with search_col2:
+    search_platforms = st.multiselect("Platform", ["Twitter", "News", "Reddit"])
+with search_col3:
+    search_sentiments = st.multiselect("Sentiment", ["Positive", "Negative", "Neutral"])
+
+search_filters = (query, tuple(search_platforms), tuple(search_sentiments), tuple(date_range or ()))
+if st.session_state.get("search_filters") != search_filters:
+    st.session_state["search_filters"] = search_filters
+    st.session_state["search_page"] = 0
+page = st.session_state.get("search_page", 0)
+
+if query or search_platforms or search_sentiments:
+    results, has_more = open_search_index().search(
+        query, platforms=search_platforms, sentiments=search_sentiments,
+        start=date_range[0] if date_range else None, end=date_range[1] if date_range else None,
+        page=page,
+    )
+    if results:
+        for row in results:
+            item_class = {"Twitter": "tweet-item", "News": "news-item"}.get(row["platform"], "reddit-item")
+            link = f"<a href='{html.escape(row['url'])}' target='_blank' style='font-size: 11px;'>Open</a>" if row["url"] else ""
+            sentiment_label = row["sentiment"] or "Unscored"
             st.markdown(f"""
-            <div class='reddit-item'>
-                <p style='font-size: 12px; margin-bottom: 6px; color: #1f2937;'>{post['title'][:70]}...</p>
-                <div style='display: flex; justify-content: space-between; align-items: center;'>
-                    <span class='sentiment-{post['sentiment'].lower()[:3]}'>{post['sentiment']}</span>
-                    <a href='#' target='_blank' style='font-size: 11px; color: #8b5cf6;'>View</a>
+            <div class='{item_class}'>
+                <p style='font-size: 12px; margin-bottom: 6px; color: #1f2937;'>{highlight(row['snippet'])}</p>
+                <div style='display: flex; justify-content: space-between; align-items: center; font-size: 11px; color: #6b7280;'>
+                    <span class='sentiment-{sentiment_label.lower()[:3]}'>{sentiment_label}</span>
+                    <span>{row['platform']} {row['kind']} · {row['date']}</span>
+                    {link}
                 </div>
             </div>
             """, unsafe_allow_html=True)
-    
-    st.markdown("</div>", unsafe_allow_html=True)
+    else:
+        st.info("No mentions match this search.")
+    prev_col, page_col, next_col = st.columns([1, 2, 1])
+    with prev_col:
+        if st.button("← Previous", disabled=page == 0):
+            st.session_state["search_page"] = page - 1
+            st.rerun()
+    with page_col:
+        st.markdown(f"<p style='text-align: center; color: #64748b;'>Page {page + 1}</p>", unsafe_allow_html=True)
+    with next_col:
+        if st.button("Next →", disabled=not has_more):
+            st.session_state["search_page"] = page + 1
+            st.rerun()
 
 # --- Bottom Row: Trending Keywords and Engagement Stats ---
 st.header("📈 Analytics Overview")
@@ -162,13 +364,22 @@ col3, col4 = st.columns([3, 2])
 
 with col3:
     st.subheader("🔍 Trending Keywords")
+    windows = {"Last 24 hours": "24h", "Last 7 days": "7d", "Last 30 days": "30d"}
+    window_label = st.radio("Window", list(windows), index=1, horizontal=True, label_visibility="collapsed")
+    window = trending_snapshot.get("windows", {}).get(windows[window_label], {})
+    chart_title = "Top Keywords by Frequency"
+    if window.get("top"):
+        keywords_df = pd.DataFrame(window["top"]).rename(columns={"count": "frequency"})
+        chart_title = f"Top Keywords, {window_label.lower()}"
+    elif trending_snapshot:
+        keywords_df = keywords_df.iloc[0:0]
     if not keywords_df.empty:
         # Create a more visually appealing chart
         fig3 = px.bar(keywords_df.head(8), x='frequency', y='keyword', 
                       orientation='h',
                       color='frequency', 
                       color_continuous_scale='viridis',
-                      title="Top Keywords by Frequency")
+                      title=chart_title)
         fig3.update_layout(
             height=400,
             yaxis={'tickfont': {'size': 14}, 'title': None},
@@ -182,14 +393,17 @@ with col3:
         st.plotly_chart(fig3, use_container_width=True)
     else:
         st.info("No keyword data available.")
+    if window.get("rising"):
+        rising = ", ".join(f"**{row['keyword']}** ({row['previous']} → {row['count']})" for row in window["rising"][:5])
+        st.markdown(f"📈 Rising vs previous window: {rising}")
 
 with col4:
     st.subheader("📊 Engagement Metrics")
     
     # Engagement stats in a more compact format
     eng_cols = ["like_count", "retweet_count", "reply_count"]
-    if all(col in twitter_df.columns for col in eng_cols):
-        eng_totals = twitter_df[eng_cols].sum()
+    eng_totals = engagement_totals.set_index('metric')['total'] if not engagement_totals.empty else pd.Series(dtype="int64")
+    if all(col in eng_totals.index for col in eng_cols):
         
         # Create two columns for metrics and pie chart
         metric_col1, metric_col2 = st.columns([1, 1])
@@ -220,4 +434,52 @@ with col4:
             
         st.markdown("<p style='text-align: center; color: #64748b; font-size: 0.9rem; margin-top: -10px;'>Engagement Distribution</p>", unsafe_allow_html=True)
     else:
-        st.info("No engagement data available.")
\ No newline at end of file
+        st.info("No engagement data available.")
+
+# --- Trends: pre-aggregated buckets, tier picked from the visible range, LTTB-downsampled ---
+st.header("⏱️ Trends Over Time")
+history = timeseries.history_range()
+if history is None:
+    st.info("No time series data available.")
+else:
+    first, last = (t.to_pydatetime() for t in history)
+    default_window = (max(first, last - pd.Timedelta(days=30).to_pytimedelta()), last)
+    if date_range:
+        # Follow the sidebar filter when it overlaps the history
+        picked = (max(first, pd.Timestamp(date_range[0]).to_pydatetime()),
+                  min(last, (pd.Timestamp(date_range[1]) + pd.Timedelta(days=1)).to_pydatetime()))
+        if picked[0] < picked[1]:
+            default_window = picked
+    trend_col1, trend_col2, trend_col3 = st.columns([3, 2, 1])
+    with trend_col1:
+        trend_window = st.slider("Time window", min_value=first, max_value=last, value=default_window,
+                           step=pd.Timedelta(hours=1).to_pytimedelta(), format="YYYY-MM-DD HH:mm")
+    with trend_col2:
+        trend_platforms = st.multiselect("Platforms", ["Twitter", "News", "Reddit"], default=["Twitter", "News", "Reddit"],
+                                         key="trend_platforms")
+    with trend_col3:
+        resolution_choice = st.selectbox("Resolution", ["Auto"] + list(timeseries.RESOLUTIONS))
+    share_df, volume_df, resolution = load_timeseries(
+        trend_window[0], trend_window[1], tuple(trend_platforms),
+        None if resolution_choice == "Auto" else resolution_choice,
+        file_version(timeseries.tier_path("day")),
+    )
+    if share_df.empty:
+        st.info("No mentions in this window.")
+    else:
+        trend_col4, trend_col5 = st.columns(2)
+        with trend_col4:
+            fig5 = px.line(share_df, x="bucket", y="value", color="series",
+                           color_discrete_map={"Positive": "#2ecc40", "Negative": "#e74c3c", "Neutral": "#888"},
+                           title=f"Sentiment Share ({resolution} buckets)")
+            fig5.update_layout(height=350, yaxis={'tickformat': '.0%', 'title': None}, xaxis={'title': None},
+                               legend_title_text=None, margin=dict(t=50, b=30, l=20, r=20))
+            st.plotly_chart(fig5, use_container_width=True)
+        with trend_col5:
+            fig6 = px.line(volume_df, x="bucket", y="value", color="series",
+                           labels={"series": "Metric"},
+                           title=f"Mentions & Engagement ({resolution} buckets)")
+            fig6.update_layout(height=350, yaxis={'title': None}, xaxis={'title': None},
+                               legend_title_text=None, margin=dict(t=50, b=30, l=20, r=20))
+            st.plotly_chart(fig6, use_container_width=True)
+        st.caption(f"{len(share_df) + len(volume_df):,} points plotted from {resolution} buckets")
@@ -0,0 +1,316 @@
+"""
+Benchmark harness for the pipeline stages.
+
+Each stage runs in a fresh spawned process against a synthetic corpus, so
+peak RSS is per stage and model loads are not shared between measurements.
+Per-item latency is each model call's duration divided by its batch size,
+recorded separately per kind of call (classifier, VADER, KeyBERT extraction,
+embedding); a stage's headline p50/p99 come from the call it spent the most
+time in. For the dashboard stage it is the time of one full aggregate load.
+Results go to a JSON file that `compare` diffs between commits.
+
+    python benchmarks/run.py run --sizes 1000,10000 --offline
+    python benchmarks/run.py compare benchmarks/results/base.json benchmarks/results/new.json
+"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+MODULES_DIR = os.path.join(ROOT_DIR, "modules")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+CORPUS_DIR = os.path.join(ROOT_DIR, "data", "cache", "benchmarks")
+STAGES = ["sentiment_twitter", "reddit_sentiment", "sentiment_news",
+          "extract_top_keywords", "extract_reddit_keywords", "dashboard_load"]
+DASHBOARD_REPEATS = 20
+# A stage that crashes without reporting (OOM kill, segfault) is noticed within this many seconds
+POLL_INTERVAL = 5
+STAGE_TIMEOUT = 3600
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.calls = []
+
+    def record(self, seconds, items):
+        if items:
+            self.calls.append((seconds / items, items))
+
+    @property
+    def seconds(self):
+        return sum(per_item * items for per_item, items in self.calls)
+
+    def percentiles(self):
+        if not self.calls:
+            return None, None
+        per_item = np.repeat([c[0] for c in self.calls], [c[1] for c in self.calls])
+        return float(np.percentile(per_item, 50) * 1000), float(np.percentile(per_item, 99) * 1000)
+
+
+def _count(inputs):
+    return 1 if isinstance(inputs, str) else len(inputs)
+
+
+class _TimedEmbedder:
+    def __init__(self, embedder, recorder):
+        self._embedder = embedder
+        self._recorder = recorder
+
+    def embed(self, texts, *args, **kwargs):
+        start = time.perf_counter()
+        result = self._embedder.embed(texts, *args, **kwargs)
+        self._recorder.record(time.perf_counter() - start, _count(texts))
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._embedder, name)
+
+
+class TimedModel:
+    """Wraps a registry model and records the latency of its inference calls, one recorder per call."""
+
+    def __init__(self, model, recorders):
+        self._model = model
+        self._recorders = recorders
+        if hasattr(model, "model") and hasattr(model.model, "embed"):
+            # extract_keywords embeds internally; with precomputed embeddings it only scores
+            # candidates, so the two calls are different work and are kept apart
+            self.model = _TimedEmbedder(model.model, recorders["embed"])
+
+    def _timed(self, call, fn, inputs, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(inputs, *args, **kwargs)
+        self._recorders[call].record(time.perf_counter() - start, _count(inputs))
+        return result
+
+    def __call__(self, inputs, *args, **kwargs):
+        return self._timed("classify", self._model, inputs, *args, **kwargs)
+
+    def polarity_scores(self, text):
+        return self._timed("polarity_scores", self._model.polarity_scores, text)
+
+    def extract_keywords(self, docs, *args, **kwargs):
+        return self._timed("extract_keywords", self._model.extract_keywords, docs, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+def _peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_stage(stage, corpus, work_dir):
+    import aggregates
+    import pandas as pd
+    import sentiment
+
+    processed = os.path.join(work_dir, "processed")
+    os.makedirs(processed, exist_ok=True)
+    out = lambda name: os.path.join(processed, name)
+    if stage == "sentiment_twitter":
+        sentiment.sentiment_twitter(corpus["tweets"], out("twitter_sentiment.csv"))
+    elif stage == "reddit_sentiment":
+        sentiment.reddit_sentiment(corpus["reddit"], out("reddit_sentiment.csv"), mode="tree",
+                                   nodes_csv=out("reddit_comment_sentiment.csv"))
+    elif stage == "sentiment_news":
+        sentiment.sentiment_news(corpus["news"], out("news_sentiment.csv"))
+    elif stage == "extract_top_keywords":
+        import topics
+        topics.extract_top_keywords(corpus["news"], out("news_top_keywords.csv"))
+    elif stage == "extract_reddit_keywords":
+        import topics
+        topics.extract_reddit_keywords(corpus["reddit"], out("reddit_top_keywords.csv"))
+    elif stage == "dashboard_load":
+        # What a dashboard session does: rebuild stale aggregates, then read the small tables
+        timings = []
+        aggregates.write_aggregates(processed, seed=0)
+        for _ in range(DASHBOARD_REPEATS):
+            start = time.perf_counter()
+            for name in aggregates.AGGREGATE_FILES + ["news_top_keywords.csv"]:
+                if os.path.exists(out(name)):
+                    pd.read_csv(out(name))
+            timings.append(time.perf_counter() - start)
+        return timings
+    return None
+
+
+def _stage_process(stage, corpus, work_dir, offline, results):
+    try:
+        os.chdir(work_dir)
+        sys.path.insert(0, MODULES_DIR)
+        sys.path.insert(0, BENCH_DIR)
+        import models
+        recorders = collections.defaultdict(LatencyRecorder)
+        if offline:
+            import stub_models
+            stub_models.install(models.registry)
+        for key, loader in list(models.registry.loaders.items()):
+            models.registry.register(key, lambda loader=loader: TimedModel(loader(), recorders))
+        start = time.perf_counter()
+        timings = _run_stage(stage, corpus, work_dir)
+        elapsed = time.perf_counter() - start
+        if timings:
+            recorders["load"].calls = [(t, 1) for t in timings]
+        latency = {call: dict(zip(("p50_ms", "p99_ms"), recorder.percentiles()),
+                              items=sum(items for _, items in recorder.calls))
+                   for call, recorder in recorders.items() if recorder.calls}
+        headline = max(latency, key=lambda call: recorders[call].seconds, default=None)
+        p50, p99 = (latency[headline]["p50_ms"], latency[headline]["p99_ms"]) if headline else (None, None)
+        results.put({"seconds": elapsed, "latency_call": headline, "latency_p50_ms": p50, "latency_p99_ms": p99,
+                     "latency_by_call": latency, "peak_rss_mb": _peak_rss_mb()})
+    except BaseException as e:
+        results.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def run_stage(stage, corpus, work_dir, offline, timeout=STAGE_TIMEOUT):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_stage_process, args=(stage, corpus, work_dir, offline, results))
+    process.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            result = results.get(timeout=POLL_INTERVAL)
+            break
+        except queue.Empty:
+            pass
+        if not process.is_alive():
+            # It may have reported just before exiting
+            try:
+                result = results.get(timeout=1)
+            except queue.Empty:
+                result = {"error": f"stage process exited with code {process.exitcode} without a result"}
+            break
+        if time.monotonic() > deadline:
+            process.terminate()
+            result = {"error": f"stage did not finish within {timeout}s"}
+            break
+    process.join()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes, stages=STAGES, offline=False, seed=0, output=None, timeout=STAGE_TIMEOUT):
+    from synthetic import generate_corpus
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "offline_models": offline,
+            "seed": seed,
+        },
+        "results": [],
+    }
+    for size in sizes:
+        corpus = generate_corpus(os.path.join(CORPUS_DIR, f"corpus-{size}-{seed}"), size, seed)
+        work_dir = os.path.join(CORPUS_DIR, f"work-{size}-{seed}")
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        for stage in stages:
+            result = run_stage(stage, corpus, work_dir, offline, timeout)
+            row = {"stage": stage, "size": size, **result}
+            if "seconds" in result:
+                row["throughput_per_sec"] = size / result["seconds"] if result["seconds"] else None
+                print(f"{stage:<24} {size:>8}  {row['throughput_per_sec']:>10.1f}/s  "
+                      f"p50 {_fmt(row['latency_p50_ms'])}  p99 {_fmt(row['latency_p99_ms'])}  "
+                      f"rss {row['peak_rss_mb']:.0f} MB  {row['latency_call'] or ''}")
+            else:
+                print(f"{stage:<24} {size:>8}  failed: {result['error']}")
+            report["results"].append(row)
+    output = output or os.path.join(RESULTS_DIR, f"{report['meta']['commit'] or 'results'}.json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to '{output}'")
+    return report
+
+
+def _fmt(ms):
+    return f"{ms:.3f}ms" if ms is not None else "n/a"
+
+
+def compare(base_path, new_path, threshold=0.1):
+    with open(base_path, encoding="utf-8") as f:
+        base = {(r["stage"], r["size"]): r for r in json.load(f)["results"]}
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)["results"]
+    regressions = 0
+    print(f"{'stage':<24} {'size':>8}  {'throughput':>12}  {'p99':>10}  {'peak rss':>10}")
+    for row in new:
+        old = base.get((row["stage"], row["size"]))
+        if not old or "seconds" not in old or "seconds" not in row:
+            continue
+        speed = row["throughput_per_sec"] / old["throughput_per_sec"] - 1
+        rss = row["peak_rss_mb"] - old["peak_rss_mb"]
+        # Latencies of different calls (say the cascade moving work from the classifier to VADER) don't compare
+        p99 = (row["latency_p99_ms"] / old["latency_p99_ms"] - 1
+               if row["latency_p99_ms"] and old["latency_p99_ms"]
+               and row.get("latency_call") == old.get("latency_call") else None)
+        flag = ""
+        if speed < -threshold:
+            flag = "  << slower"
+            regressions += 1
+        print(f"{row['stage']:<24} {row['size']:>8}  {speed:>+11.1%}  "
+              f"{(f'{p99:+.1%}' if p99 is not None else 'n/a'):>10}  {rss:>+8.0f}MB{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on a synthetic corpus")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run")
+    run.add_argument("--sizes", default="1000,10000", help="comma-separated records per platform (1000 to 1000000)")
+    run.add_argument("--stages", default=",".join(STAGES))
+    run.add_argument("--offline", action="store_true", help="use tiny local stand-in models")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--output")
+    run.add_argument("--timeout", type=float, default=STAGE_TIMEOUT, help="seconds before a stage is killed")
+    cmp = sub.add_parser("compare")
+    cmp.add_argument("base")
+    cmp.add_argument("new")
+    cmp.add_argument("--threshold", type=float, default=0.1, help="throughput drop that counts as a regression")
+    gen = sub.add_parser("generate")
+    gen.add_argument("size", type=int)
+    gen.add_argument("out_dir")
+    gen.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        run_benchmarks([int(s) for s in args.sizes.split(",")], args.stages.split(","),
+                       offline=args.offline, seed=args.seed, output=args.output, timeout=args.timeout)
+        return 0
+    if args.command == "generate":
+        from synthetic import generate_corpus
+        print(generate_corpus(args.out_dir, args.size, args.seed))
+        return 0
+    return 1 if compare(args.base, args.new, args.threshold) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Tiny offline stand-ins for the registry models.
+
+They keep the call signatures the pipeline relies on (pipeline-style
+classifiers with a tokenizer, VADER's polarity_scores, KeyBERT's
+extract_keywords and model.embed) and do a small, deterministic amount of
+real work, so benchmarks run without downloads and still exercise batching,
+caching and I/O.
+"""
+
+import re
+import zlib
+
+import numpy as np
+
+TOKEN = re.compile(r"\w+|[^\w\s]")
+POSITIVE = {"great", "helpful", "amazing", "recommend", "smooth", "thank", "excellent", "supportive", "good"}
+NEGATIVE = {"terrible", "scam", "delay", "rude", "waste", "disappointed", "pushy", "unresponsive", "bad"}
+EMBEDDING_DIM = 64
+
+
+def _tokens(text):
+    return TOKEN.findall((text or "").lower())
+
+
+def _polarity(text):
+    tokens = _tokens(text)
+    return sum(t in POSITIVE for t in tokens) - sum(t in NEGATIVE for t in tokens)
+
+
+class StubTokenizer:
+    model_max_length = 512
+
+    def __call__(self, texts, truncation=True, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        ids = [[zlib.crc32(t.encode("utf-8")) % 30000 for t in _tokens(text)][:self.model_max_length]
+               for text in texts]
+        return {"input_ids": ids}
+
+
+class StubClassifier:
+    def __init__(self, labels):
+        # labels: (negative, neutral or None, positive) in the real model's raw label names
+        self.negative, self.neutral, self.positive = labels
+        self.tokenizer = StubTokenizer()
+        self.nbytes = 0
+
+    def _label(self, text):
+        score = _polarity(text)
+        if score > 0:
+            return self.positive
+        if score < 0 or self.neutral is None:
+            return self.negative
+        return self.neutral
+
+    def __call__(self, texts, batch_size=None, truncation=True):
+        if isinstance(texts, str):
+            texts = [texts]
+        self.tokenizer(texts)
+        return [{"label": self._label(text), "score": 0.9} for text in texts]
+
+
+class StubVader:
+    def polarity_scores(self, text):
+        score = _polarity(text)
+        compound = max(-1.0, min(1.0, score / 2))
+        return {"neg": float(score < 0), "neu": float(score == 0), "pos": float(score > 0), "compound": compound}
+
+
+class StubEmbedder:
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for token in _tokens(text):
+                h = zlib.crc32(token.encode("utf-8"))
+                vectors[i, h % EMBEDDING_DIM] += 1.0 if h & 1 << 20 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+class StubKeyBERT:
+    def __init__(self):
+        self.model = StubEmbedder()
+        self.nbytes = 0
+
+    def extract_keywords(self, docs, top_n=5, vectorizer=None, doc_embeddings=None, word_embeddings=None):
+        single = isinstance(docs, str)
+        docs = [docs] if single else docs
+        vocab = {word: i for i, word in enumerate(vectorizer.get_feature_names_out())}
+        analyzer = vectorizer.build_analyzer()
+        results = []
+        for i, doc in enumerate(docs):
+            candidates = sorted({w for w in analyzer(doc) if w in vocab})
+            if not candidates:
+                results.append([])
+                continue
+            scores = word_embeddings[[vocab[w] for w in candidates]] @ doc_embeddings[i]
+            order = np.argsort(-scores)[:top_n]
+            results.append([(candidates[j], round(float(scores[j]), 4)) for j in order])
+        return results[0] if single else results
+
+
+STUB_LOADERS = {
+    "twitter": lambda: StubClassifier(("LABEL_0", "LABEL_2", "LABEL_1")),
+    "reddit": lambda: StubClassifier(("NEGATIVE", None, "POSITIVE")),
+    "keybert": StubKeyBERT,
+    "vader": StubVader,
+}
+
+
+def install(registry):
+    for key, loader in STUB_LOADERS.items():
+        registry.register(key, loader)
@@ -0,0 +1,149 @@
+"""
+Deterministic synthetic corpus in the shapes the scrapers write.
+
+The same size and seed always produce byte-identical files: a tweets CSV
+(scrape_twitter), a news CSV (scrape_news) and a nested Reddit JSON array
+(fetch_reddit_leapscholar_posts_comments_json). A share of records repeats
+earlier text, as retweets and syndicated headlines do in the real feeds.
+Files are streamed to disk, so 1M-record corpora need little memory.
+"""
+
+import csv
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+TWEET_FIELDS = ["query", "author_id", "created_at", "text",
+                "like_count", "retweet_count", "reply_count", "quote_count"]
+NEWS_FIELDS = ["source_name", "title", "url"]
+
+BRANDS = ["LeapScholar", "Leap Scholar", "@LeapScholar", "Leap Finance", "Leap"]
+TOPICS = ["IELTS", "study abroad", "scholarship", "student visa", "education loan", "refund",
+          "counsellor", "university shortlist", "Canada", "UK", "Germany", "Australia", "GRE", "SOP"]
+POSITIVE = ["great", "helpful", "amazing", "recommend", "smooth", "thank you", "excellent", "supportive"]
+NEGATIVE = ["terrible", "scam", "delay", "rude", "waste of money", "disappointed", "pushy", "unresponsive"]
+FILLER = ["the", "my", "was", "for", "with", "about", "really", "team", "process", "application", "session",
+          "mentor", "today", "after", "weeks", "calls", "admit", "course", "fees", "experience", "anyone",
+          "should", "I", "got", "their", "class", "update", "finally", "still", "waiting", "help"]
+SOURCES = ["The Economic Times", "Entrackr", "YourStory", "Inc42", "Hindustan Times", "Mint", "The Hindu"]
+QUERIES = ['"LeapScholar" lang:en -is:retweet', '"Leap Scholar" lang:en -is:retweet', "#LeapScholar"]
+START = datetime(2025, 1, 1)
+DUPLICATE_RATE = 0.1
+
+
+def sentence(rng, min_words=8, max_words=30):
+    words = [rng.choice(FILLER) for _ in range(rng.randint(min_words, max_words))]
+    words.insert(rng.randint(0, len(words)), rng.choice(BRANDS))
+    words.insert(rng.randint(0, len(words)), rng.choice(TOPICS))
+    mood = rng.random()
+    if mood < 0.35:
+        words.insert(rng.randint(0, len(words)), rng.choice(POSITIVE))
+    elif mood < 0.6:
+        words.insert(rng.randint(0, len(words)), rng.choice(NEGATIVE))
+    return " ".join(words)
+
+
+def _reuse(rng, recent, make):
+    # Repeat a recent text now and then so dedup and caches see realistic overlap
+    if recent and rng.random() < DUPLICATE_RATE:
+        return rng.choice(recent)
+    text = make()
+    recent.append(text)
+    if len(recent) > 1000:
+        recent.pop(0)
+    return text
+
+
+def write_tweets(path, n, seed=0):
+    rng = random.Random(f"tweets-{seed}")
+    recent = []
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=TWEET_FIELDS)
+        writer.writeheader()
+        for i in range(n):
+            text = _reuse(rng, recent, lambda: sentence(rng, 6, 40))
+            if rng.random() < 0.3:
+                text += f" https://t.co/{rng.getrandbits(40):x}"
+            writer.writerow({
+                "query": rng.choice(QUERIES),
+                "author_id": str(10 ** 17 + rng.getrandbits(56)),
+                "created_at": (START + timedelta(seconds=i * 30)).strftime("%Y-%m-%d %H:%M:%S"),
+                "text": text,
+                "like_count": int(rng.paretovariate(1.5)) - 1,
+                "retweet_count": int(rng.paretovariate(2.0)) - 1,
+                "reply_count": int(rng.paretovariate(2.5)) - 1,
+                "quote_count": int(rng.paretovariate(3.0)) - 1,
+            })
+
+
+def write_news(path, n, seed=0):
+    rng = random.Random(f"news-{seed}")
+    recent = []
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=NEWS_FIELDS)
+        writer.writeheader()
+        for i in range(n):
+            source = rng.choice(SOURCES)
+            headline = _reuse(rng, recent, lambda: sentence(rng, 5, 14).capitalize())
+            writer.writerow({
+                "source_name": source,
+                "title": f"{headline} - {source}",
+                "url": f"https://news.google.com/rss/articles/{seed:x}{i:010x}",
+            })
+
+
+def _comment(rng, post_index, path, depth, max_depth, created):
+    comment = {
+        "comment_id": f"c{post_index:x}_{path}",
+        "comment_text": sentence(rng, 3, 60),
+        "comment_author": f"user{rng.randrange(100000)}",
+        "created_utc": created + rng.randint(60, 86400),
+        "score": int(rng.paretovariate(1.2)) - rng.randint(0, 3),
+        "replies": [],
+    }
+    if depth < max_depth:
+        for j in range(rng.choice([0, 0, 0, 1, 1, 2])):
+            comment["replies"].append(_comment(rng, post_index, f"{path}_{j}", depth + 1, max_depth, created))
+    return comment
+
+
+def write_reddit(path, n, seed=0, max_comments=6, max_depth=3):
+    rng = random.Random(f"reddit-{seed}")
+    recent = []
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i in range(n):
+            created = int((START + timedelta(seconds=i * 120)).timestamp())
+            comments = [_comment(rng, i, str(j), 1, max_depth, created)
+                        for j in range(rng.randint(0, max_comments))]
+            post = {
+                "post_id": f"p{seed:x}{i:07x}",
+                "post_title": _reuse(rng, recent, lambda: sentence(rng, 4, 14)),
+                "post_text": sentence(rng, 0, 120) if rng.random() < 0.8 else "",
+                "post_url": f"https://www.reddit.com/r/studyAbroad/comments/p{i:07x}",
+                "post_score": int(rng.paretovariate(1.3)),
+                "post_num_comments": len(comments),
+                "created_utc": created,
+                "author": f"user{rng.randrange(100000)}",
+                "comments": comments,
+            }
+            f.write(("," if i else "") + "\n" + json.dumps(post, ensure_ascii=False))
+        f.write("\n]\n")
+
+
+def generate_corpus(out_dir, n, seed=0):
+    """Writes (or reuses) a corpus of n records per platform and returns its file paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {
+        "tweets": os.path.join(out_dir, "tweets.csv"),
+        "news": os.path.join(out_dir, "news.csv"),
+        "reddit": os.path.join(out_dir, "reddit.json"),
+    }
+    writers = {"tweets": write_tweets, "news": write_news, "reddit": write_reddit}
+    for name, path in paths.items():
+        if not os.path.exists(path):
+            tmp_path = path + ".tmp"
+            writers[name](tmp_path, n, seed)
+            os.replace(tmp_path, path)
+    return paths
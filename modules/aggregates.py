@@ -0,0 +1,107 @@
+"""
+Precomputed aggregate tables for the dashboard.
+
+Written next to the processed sentiment files at the end of each pipeline run so
+the dashboard never has to scan the full CSVs.
+"""
+
+import os
+import threading
+import uuid
+
+import pandas as pd
+
+PROCESSED_DIR = "data/processed"
+SOURCES = {
+    "Twitter": "twitter_sentiment.csv",
+    "News": "news_sentiment.csv",
+    "Reddit": "reddit_sentiment.csv",
+}
+ENGAGEMENT_COLUMNS = ["like_count", "retweet_count", "reply_count", "quote_count"]
+FEED_COLUMNS = ["platform", "text", "title", "url", "sentiment", "like_count", "retweet_count", "reply_count"]
+FEED_SAMPLE_SIZE = 20
+
+SENTIMENT_COUNTS = "sentiment_counts.csv"
+ENGAGEMENT_TOTALS = "engagement_totals.csv"
+FEED_SAMPLE = "feed_sample.csv"
+AGGREGATE_FILES = [SENTIMENT_COUNTS, ENGAGEMENT_TOTALS, FEED_SAMPLE]
+# Dashboard sessions are threads of one process; one of them rebuilds while the others wait
+_refresh_lock = threading.Lock()
+
+
+def source_paths(processed_dir=PROCESSED_DIR):
+    return {platform: os.path.join(processed_dir, name) for platform, name in SOURCES.items()}
+
+
+def aggregate_paths(processed_dir=PROCESSED_DIR):
+    return [os.path.join(processed_dir, name) for name in AGGREGATE_FILES]
+
+
+def aggregates_stale(processed_dir=PROCESSED_DIR):
+    outputs = aggregate_paths(processed_dir)
+    if not all(os.path.exists(p) for p in outputs):
+        return True
+    newest_source = max(
+        (os.path.getmtime(p) for p in source_paths(processed_dir).values() if os.path.exists(p)),
+        default=0,
+    )
+    return min(os.path.getmtime(p) for p in outputs) < newest_source
+
+
+def _read_columns(path, wanted):
+    header = pd.read_csv(path, nrows=0).columns
+    return pd.read_csv(path, usecols=[c for c in wanted if c in header])
+
+
+def _write_csv(df, path):
+    # The pipeline and dashboard sessions may rebuild at once, so each writer gets its own tmp file
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_aggregates(processed_dir=PROCESSED_DIR, sample_size=FEED_SAMPLE_SIZE, seed=None):
+    counts = []
+    samples = []
+    engagement = pd.Series(0, index=ENGAGEMENT_COLUMNS, dtype="int64")
+    for platform, path in source_paths(processed_dir).items():
+        if not os.path.exists(path):
+            continue
+        df = _read_columns(path, FEED_COLUMNS + ENGAGEMENT_COLUMNS)
+        df["platform"] = platform
+        platform_counts = df["sentiment"].value_counts().rename_axis("sentiment").reset_index(name="count")
+        platform_counts.insert(0, "platform", platform)
+        counts.append(platform_counts)
+        if platform == "Twitter":
+            present = [c for c in ENGAGEMENT_COLUMNS if c in df.columns]
+            engagement[present] += df[present].fillna(0).astype("int64").sum()
+        samples.append(df.sample(n=min(sample_size, len(df)), random_state=seed).reindex(columns=FEED_COLUMNS))
+
+    sentiment_counts = pd.concat(counts, ignore_index=True) if counts else pd.DataFrame(columns=["platform", "sentiment", "count"])
+    _write_csv(sentiment_counts, os.path.join(processed_dir, SENTIMENT_COUNTS))
+    _write_csv(engagement.rename_axis("metric").reset_index(name="total"),
+               os.path.join(processed_dir, ENGAGEMENT_TOTALS))
+    feed = pd.concat(samples, ignore_index=True) if samples else pd.DataFrame(columns=FEED_COLUMNS)
+    for column in ["like_count", "retweet_count", "reply_count"]:
+        feed[column] = feed[column].fillna(0).astype("int64")
+    _write_csv(feed, os.path.join(processed_dir, FEED_SAMPLE))
+
+
+def refresh_aggregates(processed_dir=PROCESSED_DIR):
+    """Rebuilds the aggregates if their sources changed; returns True if it did."""
+    with _refresh_lock:
+        # Another session may have rebuilt them while this one waited
+        if not aggregates_stale(processed_dir):
+            return False
+        write_aggregates(processed_dir)
+        return True
+
+
+if __name__ == "__main__":
+    write_aggregates()
+    print(f"Aggregates saved to {PROCESSED_DIR}")
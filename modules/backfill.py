@@ -0,0 +1,174 @@
+"""
+Multi-process sharded sentiment backfill.
+
+The input file is split into shards that a process pool scores in parallel.
+Each worker loads its model once and pins its torch thread count; finished
+shards are checkpointed on disk so an interrupted backfill resumes where it
+stopped, and results are merged back in input order.
+"""
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from reddit_stream import iter_posts
+
+SHARD_SIZE = 5000
+WORK_DIR = "data/cache/backfill"
+MODEL_KEYS = {"twitter": "twitter", "reddit": "reddit", "news": "vader"}
+
+_worker_cache = None
+
+
+def input_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def split_csv(input_csv, work_dir, shard_size):
+    shards = []
+    with open(input_csv, encoding="utf-8", newline="") as infile:
+        reader = csv.DictReader(infile)
+        for i in itertools.count():
+            rows = list(itertools.islice(reader, shard_size))
+            if not rows:
+                break
+            shard = os.path.join(work_dir, f"shard-{i:05d}.csv")
+            with open(shard, "w", encoding="utf-8", newline="") as out:
+                writer = csv.DictWriter(out, fieldnames=reader.fieldnames)
+                writer.writeheader()
+                writer.writerows(rows)
+            shards.append(shard)
+    return shards
+
+
+def split_reddit(input_json, work_dir, shard_size):
+    shards = []
+    posts = iter_posts(input_json)
+    for i in itertools.count():
+        chunk = list(itertools.islice(posts, shard_size))
+        if not chunk:
+            break
+        shard = os.path.join(work_dir, f"shard-{i:05d}.jsonl")
+        with open(shard, "w", encoding="utf-8") as out:
+            for post in chunk:
+                out.write(json.dumps(post, ensure_ascii=False) + "\n")
+        shards.append(shard)
+    return shards
+
+
+def prepare_shards(kind, input_path, work_dir, shard_size):
+    os.makedirs(work_dir, exist_ok=True)
+    manifest_path = os.path.join(work_dir, "manifest.json")
+    digest = input_digest(input_path)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["input_digest"] == digest and manifest["shard_size"] == shard_size:
+            return manifest["shards"]
+        # Input changed since the checkpoint was taken; start over
+        for name in os.listdir(work_dir):
+            os.remove(os.path.join(work_dir, name))
+    split = split_reddit if kind == "reddit" else split_csv
+    shards = split(input_path, work_dir, shard_size)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"kind": kind, "input": input_path, "input_digest": digest,
+                   "shard_size": shard_size, "shards": shards}, f, indent=2)
+    return shards
+
+
+def shard_output(shard):
+    return os.path.splitext(shard)[0] + ".out.csv"
+
+
+def _init_worker(kind, threads, use_cache):
+    global _worker_cache
+    # Pin intra-op threads before torch is imported so workers don't oversubscribe cores
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    from models import get_model
+    get_model(MODEL_KEYS[kind])
+    if kind != "news":
+        import torch
+        torch.set_num_threads(threads)
+    if use_cache:
+        from sentiment_cache import SentimentCache
+        _worker_cache = SentimentCache()
+
+
+def _process_shard(kind, shard):
+    import sentiment
+    output = shard_output(shard)
+    tmp_output = output + ".tmp"
+    if kind == "twitter":
+        sentiment.sentiment_twitter(shard, tmp_output, cache=_worker_cache)
+    elif kind == "news":
+        sentiment.sentiment_news(shard, tmp_output, cache=_worker_cache)
+    else:
+        sentiment.reddit_sentiment(shard, tmp_output, cache=_worker_cache, mode="tree")
+    # The rename is the checkpoint: a shard counts as done only once its output is complete
+    os.replace(tmp_output, output)
+    return shard
+
+
+def merge_outputs(shards, output_csv):
+    with open(output_csv, "w", encoding="utf-8", newline="") as out:
+        for i, shard in enumerate(shards):
+            with open(shard_output(shard), encoding="utf-8", newline="") as part:
+                header = part.readline()
+                if i == 0:
+                    out.write(header)
+                for line in part:
+                    out.write(line)
+
+
+def backfill(kind, input_path, output_csv, workers=None, threads_per_worker=1,
+             shard_size=SHARD_SIZE, work_dir=None, use_cache=True):
+    if kind not in MODEL_KEYS:
+        raise ValueError(f"Unknown backfill kind '{kind}'")
+    work_dir = work_dir or os.path.join(WORK_DIR, kind)
+    workers = workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+    shards = prepare_shards(kind, input_path, work_dir, shard_size)
+    todo = [shard for shard in shards if not os.path.exists(shard_output(shard))]
+    print(f"Backfill {kind}: {len(shards)} shards, {len(shards) - len(todo)} already done, "
+          f"{workers} workers x {threads_per_worker} threads")
+    if todo:
+        # spawn keeps torch/tokenizer thread pools out of forked children
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(kind, threads_per_worker, use_cache)) as pool:
+            futures = [pool.submit(_process_shard, kind, shard) for shard in todo]
+            for done, future in enumerate(as_completed(futures), 1):
+                print(f"  finished {os.path.basename(future.result())} ({done}/{len(todo)})")
+    if shards:
+        merge_outputs(shards, output_csv)
+    print(f"Backfill {kind} saved to '{output_csv}'")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded multi-process sentiment backfill")
+    parser.add_argument("kind", choices=sorted(MODEL_KEYS))
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args(argv)
+    backfill(args.kind, args.input, args.output, workers=args.workers,
+             threads_per_worker=args.threads_per_worker, shard_size=args.shard_size,
+             use_cache=not args.no_cache)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""
+Brand configuration and mention routing.
+
+Each brand lists its aliases and its search queries per platform. Scrapers
+fetch the union of every brand's queries with duplicates collapsed, so API
+calls grow with unique queries rather than brands x queries. Fetched items are
+routed to brands afterwards in a single pass: an Aho-Corasick automaton over
+all aliases finds every brand a text mentions, however many brands there are.
+Sentiment is scored once per item, and processed outputs are then split into
+one directory per brand.
+"""
+
+import csv
+import json
+import os
+import re
+import sys
+from collections import deque
+
+BRANDS_PATH = os.getenv("BRANDS_CONFIG", "config/brands.json")
+PROCESSED_DIR = "data/processed"
+BRANDS_DIR = "brands"
+PLATFORMS = ("news", "twitter", "reddit")
+
+# Used when no config file exists: the brand this deployment was built for
+DEFAULT_BRANDS = [{
+    "name": "LeapScholar",
+    "aliases": ["LeapScholar", "Leap Scholar", "Leap Finance"],
+    "news_queries": ["LeapScholar", "LeapScholar+IELTS", "LeapScholar+study+abroad", "LeapScholar+review",
+                     "LeapScholar+refund"],
+    "twitter_queries": [
+        '"LeapScholar" lang:en -is:retweet',
+        '"LeapScholar" "IELTS" lang:en -is:retweet',
+        '"LeapScholar" "study abroad" lang:en -is:retweet',
+        '"LeapScholar" "review" lang:en -is:retweet',
+        '"LeapScholar" refund lang:en -is:retweet',
+    ],
+    "reddit_queries": ["leapscholar"],
+}]
+
+
+class Brand:
+    def __init__(self, name, aliases=(), news_queries=(), twitter_queries=(), reddit_queries=(), competitor=False):
+        self.name = name
+        # The name itself always counts as an alias
+        self.aliases = list(dict.fromkeys([name] + list(aliases)))
+        self.queries = {
+            "news": list(news_queries),
+            "twitter": list(twitter_queries),
+            "reddit": list(reddit_queries),
+        }
+        self.competitor = competitor
+
+    @property
+    def slug(self):
+        return re.sub(r"[^a-z0-9]+", "-", self.name.lower()).strip("-")
+
+
+def load_brands(path=BRANDS_PATH):
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)["brands"]
+    else:
+        config = DEFAULT_BRANDS
+    brands = [Brand(**entry) for entry in config]
+    names = [brand.name for brand in brands]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate brand names in {path}")
+    return brands
+
+
+def primary_brand(brands):
+    # The first non-competitor brand names the deployment
+    return next((brand for brand in brands if not brand.competitor), brands[0])
+
+
+def normalize_query(query):
+    # Google News URLs spell spaces as '+'; case and spacing don't change results
+    return " ".join(query.replace("+", " ").lower().split())
+
+
+def unique_queries(brands, platform):
+    """Maps each distinct query for `platform` (first spelling wins) to the brands that asked for it."""
+    owners = {}
+    spelling = {}
+    for brand in brands:
+        for query in brand.queries[platform]:
+            key = normalize_query(query)
+            spelling.setdefault(key, query)
+            owners.setdefault(spelling[key], [])
+            if brand.name not in owners[spelling[key]]:
+                owners[spelling[key]].append(brand.name)
+    return owners
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", (text or "").lower())
+
+
+class AliasMatcher:
+    """Aho-Corasick automaton over brand aliases, matched case-insensitively on word boundaries."""
+
+    def __init__(self, brands):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for brand in brands:
+            for alias in brand.aliases:
+                self._add(normalize_text(alias).strip(), brand.name)
+        self._link()
+
+    def _add(self, alias, name):
+        if not alias:
+            return
+        state = 0
+        for ch in alias:
+            if ch not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][ch] = len(self.goto) - 1
+            state = self.goto[state][ch]
+        self.output[state].append((len(alias), name))
+
+    def _link(self):
+        # Breadth-first, so every failure target is finished before it is used
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, child in self.goto[state].items():
+                queue.append(child)
+                if state:
+                    target = self.fail[state]
+                    while target and ch not in self.goto[target]:
+                        target = self.fail[target]
+                    self.fail[child] = self.goto[target].get(ch, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def match(self, text):
+        """Names of every brand whose alias occurs in text, in order of first mention."""
+        text = normalize_text(text)
+        found = {}
+        state = 0
+        for end, ch in enumerate(text):
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            for length, name in self.output[state]:
+                start = end - length + 1
+                # "leap" must not match inside "leaps" or "sleep"
+                if (start == 0 or not text[start - 1].isalnum()) and \
+                        (end + 1 == len(text) or not text[end + 1].isalnum()):
+                    found.setdefault(name, None)
+        return list(found)
+
+
+class BrandRouter:
+    def __init__(self, brands=None):
+        self.brands = brands if brands is not None else load_brands()
+        self.matcher = AliasMatcher(self.brands)
+        self.owners = {platform: unique_queries(self.brands, platform) for platform in PLATFORMS}
+
+    def route(self, text, platform=None, query=None):
+        """Brands an item belongs to: those it names, else the brands whose queries fetched it.
+
+        `query` is the item's "query" column: every query that returned it, ';'-joined.
+        """
+        names = self.matcher.match(text)
+        if not names and platform and query:
+            # Search engines also match on text we never see (article bodies, link cards)
+            for fetched_by in split_queries(query):
+                for name in self.owners[platform].get(fetched_by, []):
+                    if name not in names:
+                        names.append(name)
+        return names
+
+    def tag(self, text, platform=None, query=None):
+        # The ';'-joined form stored in the processed CSVs' "brands" column
+        return join_brands(self.route(text, platform, query))
+
+
+def join_brands(names):
+    return ";".join(names)
+
+
+def split_brands(value):
+    return [name for name in (value or "").split(";") if name]
+
+
+def join_queries(queries):
+    # The "query" column of raw items found by several queries lists them all, first finder first
+    return ";".join(dict.fromkeys(query for query in queries if query))
+
+
+def split_queries(value):
+    return [query for query in (value or "").split(";") if query]
+
+
+def add_query(value, query):
+    return join_queries(split_queries(value) + [query])
+
+
+def brand_dir(brand, processed_dir=PROCESSED_DIR):
+    return os.path.join(processed_dir, BRANDS_DIR, brand.slug)
+
+
+def partition_by_brand(csv_path, brands, processed_dir=PROCESSED_DIR):
+    """Streams a processed CSV once and writes each row into the directory of every brand it names."""
+    name = os.path.basename(csv_path)
+    writers = {}
+    files = []
+    counts = {brand.name: 0 for brand in brands}
+    by_name = {brand.name: brand for brand in brands}
+    try:
+        with open(csv_path, encoding="utf-8", newline="") as infile:
+            reader = csv.DictReader(infile)
+            for brand in brands:
+                out_dir = brand_dir(brand, processed_dir)
+                os.makedirs(out_dir, exist_ok=True)
+                f = open(os.path.join(out_dir, name), "w", encoding="utf-8", newline="")
+                files.append(f)
+                writers[brand.name] = csv.DictWriter(f, fieldnames=reader.fieldnames)
+                writers[brand.name].writeheader()
+            for row in reader:
+                for brand_name in split_brands(row.get("brands")):
+                    if brand_name in by_name:
+                        writers[brand_name].writerow(row)
+                        counts[brand_name] += 1
+    finally:
+        for f in files:
+            f.close()
+    return counts
+
+
+def write_brand_partitions(processed_dir=PROCESSED_DIR, brands=None):
+    import aggregates
+    brands = brands if brands is not None else load_brands()
+    for name in aggregates.SOURCES.values():
+        path = os.path.join(processed_dir, name)
+        if os.path.exists(path):
+            counts = partition_by_brand(path, brands, processed_dir)
+            print(f"Brand partitions for {name}: " + ", ".join(f"{b} {n}" for b, n in counts.items()))
+    # Each brand directory mirrors the processed layout, so the dashboard aggregates work unchanged
+    for brand in brands:
+        aggregates.write_aggregates(brand_dir(brand, processed_dir))
+
+
+if __name__ == "__main__":
+    # Usage: python modules/brands.py [text]  — prints the fetch plan, or the brands a text is routed to
+    router = BrandRouter()
+    if len(sys.argv) > 1:
+        print(router.route(" ".join(sys.argv[1:])))
+    else:
+        for platform in PLATFORMS:
+            requested = sum(len(brand.queries[platform]) for brand in router.brands)
+            print(f"{platform}: {len(router.owners[platform])} unique queries for {requested} brand queries")
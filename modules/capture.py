@@ -0,0 +1,205 @@
+"""
+Content-addressed archive of raw scraper payloads.
+
+Every RSS body, Twitter search page and Reddit post tree is appended to
+zstd-compressed JSONL segments, one frame per payload, so `zstd -dc` on a
+segment prints plain JSONL. A SQLite index maps each payload's SHA-256 to its
+frame; identical payloads are stored once, and every capture (source, key,
+time) is logged separately so replays see the full fetch history. Replays
+feed archived payloads back through the scrapers' own parsers with no network.
+
+Each writer appends to segments of its own and never reopens them, so the
+pipeline and the ingest service can capture at the same time.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+import pyarrow as pa
+
+from instrumentation import inc
+
+ARCHIVE_DIR = "data/archive"
+SEGMENT_BYTES = 64 * 1024 * 1024
+COMPRESSION_LEVEL = 9
+# Set CAPTURE_RAW=0 to scrape without archiving payloads
+CAPTURE_ENABLED = os.getenv("CAPTURE_RAW", "1") != "0"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    size INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    key TEXT NOT NULL,
+    captured_at REAL NOT NULL,
+    hash TEXT NOT NULL,
+    meta TEXT
+);
+CREATE INDEX IF NOT EXISTS captures_source ON captures (source, key, captured_at);
+"""
+
+
+def payload_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def encode_payload(payload):
+    # Canonical JSON, so the same payload always hashes the same regardless of key order
+    return json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+class CaptureArchive:
+    def __init__(self, root=ARCHIVE_DIR, segment_bytes=SEGMENT_BYTES):
+        self.root = root
+        self.segment_dir = os.path.join(root, "segments")
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.codec = pa.Codec("zstd", compression_level=COMPRESSION_LEVEL)
+        self.conn = sqlite3.connect(os.path.join(root, "index.sqlite"), timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self._lock = threading.Lock()
+        self._segment = None
+        self._file = None
+        self.stored = 0
+        self.duplicates = 0
+
+    def _writer(self):
+        if self._file is None or self._file.tell() >= self.segment_bytes:
+            if self._file is not None:
+                self._file.close()
+            self._segment = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl.zst"
+            self._file = open(os.path.join(self.segment_dir, self._segment), "ab")
+        return self._file
+
+    def put(self, source, key, payload, meta=None, captured_at=None):
+        """Archives one raw payload and logs the capture; returns the payload's hash."""
+        data = encode_payload(payload)
+        digest = payload_hash(data)
+        with self._lock:
+            known = self.conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if known:
+                self.duplicates += 1
+                inc("capture_duplicates_total", source=source)
+            else:
+                # Splice in the already-encoded payload instead of serialising it twice
+                header = json.dumps({"hash": digest, "source": source}, separators=(",", ":"))[:-1]
+                record = header.encode("utf-8") + b',"payload":' + data + b"}\n"
+                frame = self.codec.compress(record, asbytes=True)
+                f = self._writer()
+                offset = f.tell()
+                f.write(frame)
+                f.flush()
+                self.conn.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?, ?)",
+                                  (digest, self._segment, offset, len(frame), len(record)))
+                self.stored += 1
+                inc("capture_stored_bytes_total", len(frame), source=source)
+            self.conn.execute(
+                "INSERT INTO captures (source, key, captured_at, hash, meta) VALUES (?, ?, ?, ?, ?)",
+                (source, key, captured_at or time.time(), digest, json.dumps(meta) if meta else None),
+            )
+            self.conn.commit()
+        return digest
+
+    def get(self, digest):
+        with self._lock:
+            row = self.conn.execute("SELECT segment, offset, length, size FROM blobs WHERE hash = ?",
+                                    (digest,)).fetchone()
+        if row is None:
+            raise KeyError(f"Payload {digest} is not in the archive")
+        segment, offset, length, size = row
+        with open(os.path.join(self.segment_dir, segment), "rb") as f:
+            f.seek(offset)
+            frame = f.read(length)
+        return json.loads(self.codec.decompress(frame, decompressed_size=size, asbytes=True))["payload"]
+
+    def captures(self, source, keys=None, since=None, until=None, latest=False):
+        """Captures of one source in capture order; `latest` keeps only the newest per key."""
+        where, params = ["source = ?"], [source]
+        if keys:
+            where.append(f"key IN ({','.join('?' * len(keys))})")
+            params.extend(keys)
+        if since is not None:
+            where.append("captured_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("captured_at <= ?")
+            params.append(until)
+        sql = f"SELECT key, captured_at, hash, meta FROM captures WHERE {' AND '.join(where)}"
+        if latest:
+            sql = ("SELECT key, captured_at, hash, meta FROM ("
+                   "SELECT *, row_number() OVER (PARTITION BY key ORDER BY captured_at DESC, id DESC) AS rn "
+                   f"FROM captures WHERE {' AND '.join(where)}) WHERE rn = 1")
+        with self._lock:
+            rows = self.conn.execute(sql + " ORDER BY captured_at", params).fetchall()
+        for key, captured_at, digest, meta in rows:
+            yield {"key": key, "captured_at": captured_at, "hash": digest, "meta": json.loads(meta) if meta else {}}
+
+    def replay(self, source, **filters):
+        """Yields (capture, payload) pairs for a source without touching the network."""
+        for capture in self.captures(source, **filters):
+            yield capture, self.get(capture["hash"])
+
+    def stats(self):
+        with self._lock:
+            sources = self.conn.execute(
+                "SELECT source, count(*), count(DISTINCT hash) FROM captures GROUP BY source"
+            ).fetchall()
+            blobs, size, stored = self.conn.execute(
+                "SELECT count(*), coalesce(sum(size), 0), coalesce(sum(length), 0) FROM blobs"
+            ).fetchone()
+        return {
+            "sources": {source: {"captures": n, "unique_payloads": unique} for source, n, unique in sources},
+            "payloads": blobs,
+            "raw_bytes": size,
+            "stored_bytes": stored,
+            "compression_ratio": size / stored if stored else None,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.conn.close()
+
+
+def open_archive(root=ARCHIVE_DIR):
+    # Scrapers call this when no archive is passed in; None turns capturing off
+    return CaptureArchive(root) if CAPTURE_ENABLED else None
+
+
+if __name__ == "__main__":
+    # Usage: python modules/capture.py stats | replay [news|twitter|reddit ...]
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "stats":
+        archive = CaptureArchive()
+        print(json.dumps(archive.stats(), indent=2))
+        archive.close()
+    elif command == "replay":
+        import scrape_news
+        import scrape_reddit
+        import scrape_twitter
+        replayers = {
+            "news": lambda: scrape_news.scrape_news(replay=True),
+            "twitter": lambda: scrape_twitter.scrape_twitter(replay=True),
+            "reddit": lambda: scrape_reddit.fetch_reddit_leapscholar_posts_comments_json(
+                "data/raw/reddit_leapscholar.json", replay=True),
+        }
+        for name in sys.argv[2:] or list(replayers):
+            replayers[name]()
+    else:
+        print("Usage: python modules/capture.py stats | replay [news|twitter|reddit ...]")
@@ -0,0 +1,92 @@
+"""
+VADER-first cascade for the transformer sentiment models.
+
+VADER scores every text; texts whose compound score is clearly outside the
+confidence band are labelled straight away and only the ambiguous middle is
+sent to the transformer.
+"""
+
+import argparse
+import json
+import os
+from collections import Counter
+
+from models import get_model
+
+CASCADE_BAND = 0.5
+
+
+def cascade_labels(texts, transformer_fn, band=CASCADE_BAND, positive="Positive", negative="Negative"):
+    analyzer = get_model("vader")
+    labels = [None] * len(texts)
+    tiers = ["transformer"] * len(texts)
+    uncertain = []
+    for i, text in enumerate(texts):
+        compound = analyzer.polarity_scores(text)["compound"]
+        if compound >= band:
+            labels[i], tiers[i] = positive, "vader"
+        elif compound <= -band:
+            labels[i], tiers[i] = negative, "vader"
+        else:
+            uncertain.append(i)
+    if uncertain:
+        for i, label in zip(uncertain, transformer_fn([texts[i] for i in uncertain])):
+            labels[i] = label
+    return labels, tiers
+
+
+def tier_fractions(tiers):
+    counts = Counter(tiers)
+    total = len(tiers)
+    return {tier: counts.get(tier, 0) / total if total else 0.0 for tier in ("vader", "transformer")}
+
+
+def cascade_report(key, texts, band=CASCADE_BAND, batch_size=32, output_json=None):
+    from sentiment import TWITTER_LABEL_MAP, predict_labels, score_label
+    clf = get_model(key)
+    if key == "twitter":
+        transformer_fn = lambda batch: [TWITTER_LABEL_MAP.get(l, l) for l in predict_labels(clf, batch, batch_size)]
+        positive, negative, normalise = "Positive", "Negative", lambda l: l
+    else:
+        transformer_fn = lambda batch: predict_labels(clf, batch, batch_size)
+        positive, negative, normalise = "POSITIVE", "NEGATIVE", score_label
+    reference = transformer_fn(texts)
+    labels, tiers = cascade_labels(texts, transformer_fn, band=band, positive=positive, negative=negative)
+
+    agree = [normalise(a) == normalise(b) for a, b in zip(labels, reference)]
+    vader_agree = [ok for ok, tier in zip(agree, tiers) if tier == "vader"]
+    report = {
+        "model": key,
+        "band": band,
+        "sample_size": len(texts),
+        "tier_fractions": tier_fractions(tiers),
+        "agreement_with_transformer_only": sum(agree) / len(agree) if agree else 1.0,
+        "vader_tier_agreement": sum(vader_agree) / len(vader_agree) if vader_agree else None,
+        "transformer_call_reduction": len(texts) / max(1, tiers.count("transformer")),
+    }
+    if output_json:
+        if os.path.dirname(output_json):
+            os.makedirs(os.path.dirname(output_json), exist_ok=True)
+        with open(output_json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the VADER cascade with transformer-only scoring")
+    parser.add_argument("model", choices=["twitter", "reddit"])
+    parser.add_argument("--band", type=float, default=CASCADE_BAND)
+    parser.add_argument("--sample", type=int, default=500)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    from onnx_backend import load_sample
+    report = cascade_report(args.model, load_sample(args.model, args.sample), band=args.band, output_json=args.output)
+    fractions = report["tier_fractions"]
+    print(f"Cascade band ±{args.band}: {fractions['vader']:.1%} decided by VADER, "
+          f"{fractions['transformer']:.1%} by the transformer; "
+          f"{report['agreement_with_transformer_only']:.1%} agreement with transformer-only run")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Near-duplicate detection with MinHash signatures and an LSH index.
+
+Texts are normalised, shingled and grouped into clusters of near-duplicates so
+sentiment and keyword extraction run once per cluster representative. The index
+persists in SQLite so new batches are matched against history incrementally.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+
+DEFAULT_INDEX_DIR = "data/cache/dedup"
+NUM_PERM = 128
+BANDS = 16
+SHINGLE_SIZE = 5
+THRESHOLD = 0.7
+# A prime just above 2**32 keeps a * h + b inside uint64 for 32-bit shingle hashes
+PRIME = np.uint64(4294967311)
+# Google News titles end in " - Publisher"; syndicated copies differ only there
+SOURCE_SUFFIX = re.compile(r"\s+-\s+[^-]{1,60}$")
+INDEX_OPTIONS = {"news": {"strip_source": True}}
+
+_rng = np.random.RandomState(1)
+PERM_A = _rng.randint(1, 2 ** 32 - 1, size=NUM_PERM, dtype=np.uint64)
+PERM_B = _rng.randint(0, 2 ** 32 - 1, size=NUM_PERM, dtype=np.uint64)
+
+
+def normalize_text(text, strip_source=False):
+    text = text or ""
+    if strip_source:
+        text = SOURCE_SUFFIX.sub("", text)
+    text = text.lower()
+    text = re.sub(r"http\S+|www\.\S+|<url>", " ", text)
+    text = re.sub(r"@\w+", " ", text)
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def shingles(normalized, k=SHINGLE_SIZE):
+    if len(normalized) <= k:
+        return {normalized}
+    return {normalized[i:i + k] for i in range(len(normalized) - k + 1)}
+
+
+def minhash(normalized):
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(normalized)), dtype=np.uint64)
+    return ((PERM_A[:, None] * hashes[None, :] + PERM_B[:, None]) % PRIME).min(axis=1)
+
+
+def band_keys(signature, bands=BANDS):
+    rows = len(signature) // bands
+    return [hashlib.blake2b(signature[b * rows:(b + 1) * rows].tobytes(), digest_size=8).hexdigest()
+            for b in range(bands)]
+
+
+def estimated_jaccard(a, b):
+    return float(np.mean(a == b))
+
+
+class DedupIndex:
+    def __init__(self, path, threshold=THRESHOLD, strip_source=False):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.threshold = threshold
+        self.strip_source = strip_source
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS docs (doc_key TEXT PRIMARY KEY, cluster_id INTEGER NOT NULL, signature BLOB NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, bucket TEXT NOT NULL, doc_key TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS bands_lookup ON bands (band, bucket);"
+            "CREATE TABLE IF NOT EXISTS clusters (cluster_id INTEGER PRIMARY KEY, representative TEXT NOT NULL);"
+        )
+        self.conn.commit()
+        self._lock = threading.Lock()
+        self.matched = 0
+        self.created = 0
+
+    def _find_cluster(self, signature, keys):
+        candidates = set()
+        for band, bucket in enumerate(keys):
+            rows = self.conn.execute("SELECT doc_key FROM bands WHERE band = ? AND bucket = ?", (band, bucket))
+            candidates.update(row[0] for row in rows)
+        best_cluster, best_score = None, self.threshold
+        for doc_key in candidates:
+            cluster_id, blob = self.conn.execute(
+                "SELECT cluster_id, signature FROM docs WHERE doc_key = ?", (doc_key,)
+            ).fetchone()
+            score = estimated_jaccard(signature, np.frombuffer(blob, dtype=np.uint64))
+            if score >= best_score:
+                best_cluster, best_score = cluster_id, score
+        return best_cluster
+
+    def assign(self, texts):
+        # Returns (cluster_id, representative_text) per input text
+        results = []
+        with self._lock:
+            for text in texts:
+                normalized = normalize_text(text, self.strip_source)
+                doc_key = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+                row = self.conn.execute("SELECT cluster_id FROM docs WHERE doc_key = ?", (doc_key,)).fetchone()
+                if row:
+                    cluster_id = row[0]
+                    self.matched += 1
+                else:
+                    signature = minhash(normalized)
+                    keys = band_keys(signature)
+                    cluster_id = self._find_cluster(signature, keys)
+                    if cluster_id is None:
+                        cluster_id = self.conn.execute(
+                            "INSERT INTO clusters (representative) VALUES (?)", (text,)
+                        ).lastrowid
+                        self.created += 1
+                    else:
+                        self.matched += 1
+                    self.conn.execute("INSERT INTO docs VALUES (?, ?, ?)", (doc_key, cluster_id, signature.tobytes()))
+                    self.conn.executemany("INSERT INTO bands VALUES (?, ?, ?)",
+                                          [(band, bucket, doc_key) for band, bucket in enumerate(keys)])
+                representative = self.conn.execute(
+                    "SELECT representative FROM clusters WHERE cluster_id = ?", (cluster_id,)
+                ).fetchone()[0]
+                results.append((cluster_id, representative))
+            self.conn.commit()
+        return results
+
+    def close(self):
+        self.conn.close()
+
+
+def open_index(name, root=DEFAULT_INDEX_DIR):
+    return DedupIndex(os.path.join(root, f"{name}.sqlite"), **INDEX_OPTIONS.get(name, {}))
+
+
+def group_by_cluster(dedup, texts):
+    # Returns each text's cluster ID, the distinct representatives in first-seen
+    # order, and for each text the position of its representative in that list
+    positions = {}
+    representatives = []
+    cluster_ids = []
+    members = []
+    for cluster_id, representative in dedup.assign(texts):
+        if cluster_id not in positions:
+            positions[cluster_id] = len(representatives)
+            representatives.append(representative)
+        cluster_ids.append(cluster_id)
+        members.append(positions[cluster_id])
+    return cluster_ids, representatives, members
@@ -0,0 +1,188 @@
+"""
+Persistent embedding cache for KeyBERT documents and candidate phrases.
+
+Vectors live in a memory-mapped NumPy array per model, with a JSON index from
+text hash to row, so repeated runs and overlapping corpora skip re-embedding.
+Stages that run at the same time share one instance per model through
+`open_cache`, and processes coordinate through a lock file in the cache directory.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows: callers in one process still share an instance and its lock
+    fcntl = None
+
+DEFAULT_CACHE_DIR = "data/cache/embeddings"
+INITIAL_CAPACITY = 4096
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def embedding_key(text):
+    return hashlib.blake2b((text or "").encode("utf-8"), digest_size=16).hexdigest()
+
+
+class EmbeddingCache:
+    """Vectors for one model; use `open_cache` so every caller in a process shares one instance.
+
+    Concurrent pipeline stages, and other processes such as ingest, append to the same
+    files. New rows are therefore allocated under a file lock, after merging whatever
+    the others appended, and the index is rewritten before the lock is released.
+    """
+
+    def __init__(self, model_name, root=DEFAULT_CACHE_DIR):
+        self.model_name = model_name
+        self.dir = os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+        os.makedirs(self.dir, exist_ok=True)
+        self.index_path = os.path.join(self.dir, "index.json")
+        self.vectors_path = os.path.join(self.dir, "vectors.npy")
+        self.lock_path = os.path.join(self.dir, "cache.lock")
+        self.rows = {}
+        self.count = 0
+        self.vectors = None
+        self.hits = 0
+        self.misses = 0
+        self._index_stamp = None
+        self._lock = threading.Lock()
+        self._reload()
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        with self._lock, open(self.lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _reload(self):
+        # Picks up rows other processes appended since this one last read the index
+        stamp = self._stamp()
+        if stamp is None or stamp == self._index_stamp or not os.path.exists(self.vectors_path):
+            return
+        with open(self.index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        # The vectors file may have been grown and replaced, so map it again
+        self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+        self.rows = index["rows"]
+        self.count = index["count"]
+        self._index_stamp = stamp
+
+    def _ensure_capacity(self, needed, dim):
+        if self.vectors is not None and self.vectors.shape[0] >= needed:
+            return
+        capacity = max(INITIAL_CAPACITY, needed, 2 * (self.vectors.shape[0] if self.vectors is not None else 0))
+        tmp_path = self.vectors_path + ".tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(capacity, dim))
+        if self.vectors is not None and self.count:
+            grown[:self.count] = self.vectors[:self.count]
+        grown.flush()
+        del grown
+        self.vectors = None
+        os.replace(tmp_path, self.vectors_path)
+        self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+
+    def _write_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "count": self.count, "rows": self.rows}, f)
+        os.replace(tmp_path, self.index_path)
+        self._index_stamp = self._stamp()
+
+    def _append(self, new):
+        with self._file_lock():
+            self._reload()
+            # Another stage or process may have embedded some of these meanwhile
+            new = {key: vector for key, vector in new.items() if key not in self.rows}
+            if not new:
+                return
+            self._ensure_capacity(self.count + len(new), len(next(iter(new.values()))))
+            self.vectors[self.count:self.count + len(new)] = np.stack(list(new.values()))
+            self.vectors.flush()
+            for offset, key in enumerate(new):
+                self.rows[key] = self.count + offset
+            self.count += len(new)
+            self._write_index()
+
+    def lookup(self, texts, embed_fn):
+        """Vectors for texts, in order, and how many of the distinct texts had to be embedded."""
+        keys = [embedding_key(t) for t in texts]
+        with self._lock:
+            self._reload()
+            missing = {}
+            for text, key in zip(texts, keys):
+                if key not in self.rows and key not in missing:
+                    missing[key] = text
+        # The model runs outside the locks, so other callers keep reading meanwhile
+        if missing:
+            new_vectors = np.asarray(embed_fn(list(missing.values())), dtype=np.float32)
+            self._append(dict(zip(missing, new_vectors)))
+        with self._lock:
+            return np.array(self.vectors[[self.rows[key] for key in keys]]), len(missing)
+
+    def embed(self, texts, embed_fn):
+        vectors, missed = self.lookup(texts, embed_fn)
+        self.misses += missed
+        self.hits += len(texts) - missed
+        return vectors
+
+    def save(self):
+        # Rows and index are written through on every append; this only flushes the mapping
+        with self._lock:
+            if self.vectors is not None:
+                self.vectors.flush()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class CacheSession:
+    """One caller's hit and miss counts over the process-wide cache for a model."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def embed(self, texts, embed_fn):
+        vectors, missed = self.cache.lookup(texts, embed_fn)
+        self.misses += missed
+        self.hits += len(texts) - missed
+        return vectors
+
+    def save(self):
+        self.cache.save()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def open_cache(model_name, root=DEFAULT_CACHE_DIR):
+    """A session over the one EmbeddingCache this process keeps for `model_name`."""
+    key = (model_name, os.path.abspath(root))
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(model_name, root)
+        return CacheSession(_caches[key])
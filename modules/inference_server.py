@@ -0,0 +1,328 @@
+"""
+Local inference server shared by the pipeline, ingest and dashboard processes.
+
+One process holds the roberta and distilbert classifiers and the KeyBERT
+embedding model, so their weights are in RAM once however many jobs run. Each
+model has a queue drained by a single worker that merges concurrent requests
+from every client into one batch. A batch closes when it holds
+`max_batch_size` texts or when its first request has waited `max_wait`
+seconds. Each request gets back only its own slice of the results.
+
+Clients set INFERENCE_SERVER_URL and the model registry hands out thin remote
+stand-ins with the same call signatures, so sentiment.py, topics.py and ingest
+need no changes. Queue depth, batch sizes and queue waits are exported through
+the instrumentation module and served at /metrics.
+"""
+
+import argparse
+import base64
+import json
+import queue
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from instrumentation import SIZE_BUCKETS, export, gauge, inc, metrics, observe, set_buckets, span
+
+HOST = "127.0.0.1"
+PORT = 8765
+MAX_BATCH_SIZE = 64
+MAX_WAIT = 0.01
+REQUEST_TIMEOUT = 300
+EXPORT_INTERVAL = 15
+CLASSIFIERS = ("twitter", "reddit")
+EMBEDDERS = ("keybert",)
+
+set_buckets("inference_batch_size", SIZE_BUCKETS)
+set_buckets("inference_batch_requests", SIZE_BUCKETS)
+
+
+class DynamicBatcher:
+    """Merges concurrent requests for one model into batches run by a single worker thread."""
+
+    def __init__(self, key, run_batch, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT):
+        self.key = key
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"batcher-{key}", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts):
+        """Queues texts and returns a Future for their results, in order."""
+        future = Future()
+        if not texts:
+            future.set_result([])
+            return future
+        self.queue.put((texts, future, time.perf_counter()))
+        gauge("inference_queue_depth", self.queue.qsize(), model=self.key)
+        return future
+
+    def _collect(self):
+        requests = [self.queue.get()]
+        size = len(requests[0][0])
+        deadline = time.monotonic() + self.max_wait
+        # A request larger than the cap runs alone; the model splits it into batches itself
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            gauge("inference_queue_depth", self.queue.qsize(), model=self.key)
+            started = time.perf_counter()
+            texts = [text for request in requests for text in request[0]]
+            for _, _, queued_at in requests:
+                observe("inference_queue_wait_seconds", started - queued_at, model=self.key)
+            observe("inference_batch_size", len(texts), model=self.key)
+            observe("inference_batch_requests", len(requests), model=self.key)
+            try:
+                with span("inference_batch", items=len(texts), model=self.key):
+                    results = self.run_batch(texts)
+            except Exception as e:
+                for _, future, _ in requests:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for request_texts, future, _ in requests:
+                future.set_result(results[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+
+def classify_batch(key, max_batch_size):
+    from models import get_model
+    from sentiment import predict_labels
+
+    # Length bucketing and per-text fallback on errors, exactly as a local run would do
+    return lambda texts: predict_labels(get_model(key), texts, batch_size=max_batch_size, model_key=key)
+
+
+def embed_batch(key):
+    from models import get_model
+    return lambda texts: np.asarray(get_model(key).model.embed(texts), dtype=np.float32)
+
+
+def encode_array(array):
+    # Raw float32 bytes are about a third of the size of the same embeddings as JSON numbers
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {"shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def decode_array(payload):
+    return np.frombuffer(base64.b64decode(payload["data"]), dtype=np.float32).reshape(payload["shape"])
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    def _reply(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, self.server.app.health())
+        elif self.path == "/metrics":
+            self._reply(200, metrics.prometheus(), content_type="text/plain; version=0.0.4")
+        else:
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] not in ("classify", "embed"):
+            return self._reply(404, {"error": f"Unknown path {self.path}"})
+        kind, key = parts
+        batcher = self.server.app.batchers.get((kind, key))
+        if batcher is None:
+            return self._reply(404, {"error": f"Model '{key}' is not served for {kind}"})
+        try:
+            texts = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))["texts"]
+        except (ValueError, KeyError) as e:
+            return self._reply(400, {"error": f"Expected a JSON body with 'texts': {e}"})
+        inc("inference_requests_total", model=key)
+        try:
+            results = batcher.submit([str(text) for text in texts]).result(timeout=REQUEST_TIMEOUT)
+        except Exception as e:
+            inc("inference_request_errors_total", model=key)
+            return self._reply(500, {"error": str(e)})
+        if kind == "classify":
+            self._reply(200, {"labels": results})
+        else:
+            self._reply(200, {"embeddings": encode_array(results)})
+
+    def log_message(self, format, *args):
+        # One line per request would drown the batch summaries
+        pass
+
+
+class InferenceServer:
+    def __init__(self, host=HOST, port=PORT, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT,
+                 classifiers=CLASSIFIERS, embedders=EMBEDDERS):
+        self.batchers = {}
+        for key in classifiers:
+            self.batchers[("classify", key)] = DynamicBatcher(key, classify_batch(key, max_batch_size),
+                                                              max_batch_size, max_wait)
+        for key in embedders:
+            self.batchers[("embed", key)] = DynamicBatcher(key, embed_batch(key), max_batch_size, max_wait)
+        self.httpd = ThreadingHTTPServer((host, port), InferenceHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.app = self
+        self.started_at = time.time()
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def health(self):
+        from models import BACKEND, model_version, registry
+        return {
+            "backend": BACKEND,
+            "revisions": {key: model_version(key)[1] for _, key in self.batchers},
+            "loaded": registry.loaded(),
+            "served": sorted({key for _, key in self.batchers}),
+            "queue_depth": {f"{kind}/{key}": b.queue.qsize() for (kind, key), b in self.batchers.items()},
+            "uptime_seconds": time.time() - self.started_at,
+        }
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="inference-http", daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class InferenceClient:
+    def __init__(self, url, timeout=REQUEST_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, path, payload=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(self.url + path, data=data,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            detail = e.read().decode("utf-8", errors="replace")
+            raise RuntimeError(f"Inference server {self.url}{path} failed ({e.code}): {detail}") from None
+
+    def health(self):
+        return self._request("/health")
+
+    def classify(self, key, texts):
+        with span("remote_inference", items=len(texts), model=key):
+            return self._request(f"/classify/{key}", {"texts": list(texts)})["labels"]
+
+    def embed(self, key, texts):
+        with span("remote_inference", items=len(texts), model=key):
+            return decode_array(self._request(f"/embed/{key}", {"texts": list(texts)})["embeddings"])
+
+
+def check_backend(client, key):
+    from models import BACKEND, model_version
+    # Cached labels are keyed by backend and model commit, so a client must not mix in another model's labels
+    health = client.health()
+    if health["backend"] != BACKEND:
+        raise RuntimeError(f"Inference server at {client.url} runs the '{health['backend']}' backend but this "
+                           f"process expects '{BACKEND}'; set SENTIMENT_BACKEND to match")
+    served, expected = health["revisions"].get(key), model_version(key)[1]
+    if served != expected:
+        raise RuntimeError(f"Inference server at {client.url} serves {key} at revision '{served}' but this "
+                           f"process resolved '{expected}'; restart the server to pick up the new model")
+
+
+class RemoteClassifier:
+    """Pipeline-style classifier whose forward passes run on the inference server."""
+
+    # Tokenization happens on the server, so there is no local tokenizer
+    tokenizer = None
+    nbytes = 0
+
+    def __init__(self, key, url):
+        self.key = key
+        self.client = InferenceClient(url)
+        check_backend(self.client, key)
+
+    def __call__(self, texts, batch_size=None, truncation=True):
+        if isinstance(texts, str):
+            texts = [texts]
+        return [{"label": label} for label in self.client.classify(self.key, texts)]
+
+
+def remote_keybert(url, key="keybert"):
+    from keybert import KeyBERT
+    from keybert.backend import BaseEmbedder
+
+    client = InferenceClient(url)
+    check_backend(client, key)
+
+    class RemoteEmbedder(BaseEmbedder):
+        def embed(self, documents, verbose=False):
+            return client.embed(key, documents)
+
+    # Candidate scoring stays local; only the embedding forward passes go to the server
+    kw_model = KeyBERT(model=RemoteEmbedder())
+    kw_model.nbytes = 0
+    return kw_model
+
+
+def main(argv=None):
+    import models
+    parser = argparse.ArgumentParser(description="Serve the sentiment and KeyBERT models to local clients")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT,
+                        help="seconds a request waits for others to join its batch")
+    parser.add_argument("--backend", choices=models.BACKENDS, default=models.BACKEND)
+    parser.add_argument("--no-warm-up", action="store_true", help="load models on first request instead")
+    args = parser.parse_args(argv)
+
+    # The server is where the weights live, even if this shell points clients at it
+    models.set_inference_server(None)
+    models.set_backend(args.backend)
+    if not args.no_warm_up:
+        models.warm_up(list(CLASSIFIERS + EMBEDDERS))
+    server = InferenceServer(args.host, args.port, args.max_batch_size, args.max_wait)
+    server.start()
+    print(f"[inference] serving {', '.join(server.health()['served'])} at {server.url}; "
+          f"set INFERENCE_SERVER_URL={server.url} in clients; Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(EXPORT_INTERVAL)
+            export("inference_server")
+    except KeyboardInterrupt:
+        print("[inference] stopping...")
+    finally:
+        server.shutdown()
+        export("inference_server")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
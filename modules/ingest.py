@@ -0,0 +1,501 @@
+"""
+Long-running ingestion service.
+
+Source adapters poll (or stream) new mentions into a bounded in-process queue;
+a full queue blocks the producers, so slow scoring applies backpressure instead
+of growing memory. One consumer scores micro-batches, flushing when a batch is
+full or its oldest mention has waited long enough, and appends the results to
+the live Parquet dataset and the search index. Between flushes the consumer
+periodically compacts the live dataset and, at most once a minute, rebuilds the
+dashboard's time-series tiers if anything was written. Lag metrics are written
+after every flush for the dashboard.
+
+Adapters only need a `platform`, an `interval` and a `poll()` returning new
+records, so local fake producers can stand in for the network sources.
+"""
+
+import argparse
+import collections
+import csv
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import search_index
+import storage
+import timeseries
+from brands import BrandRouter, add_query
+from instrumentation import export, inc, span
+
+QUEUE_SIZE = 1000
+BATCH_SIZE = 64
+MAX_WAIT = 5.0
+METRICS_PATH = "data/cache/ingest_metrics.json"
+SEEN_LIMIT = 50000
+COMPACT_INTERVAL = 300
+# Rebuilding reads the whole mention history, so it is throttled rather than run per flush
+TIMESERIES_INTERVAL = 60
+
+
+def make_record(platform, row, created_ts=None):
+    return {"platform": platform, "row": row, "created_ts": created_ts, "observed_at": time.time()}
+
+
+class SeenSet:
+    # Bounded memory of recently emitted keys; the oldest are forgotten first
+    def __init__(self, limit=SEEN_LIMIT):
+        self.limit = limit
+        self._keys = collections.OrderedDict()
+
+    def add(self, key):
+        if key in self._keys:
+            return False
+        self._keys[key] = None
+        if len(self._keys) > self.limit:
+            self._keys.popitem(last=False)
+        return True
+
+
+class RssSource:
+    platform = "News"
+
+    def __init__(self, queries=None, interval=60, skip_existing=True, archive=None):
+        import scrape_news
+        self.scrape_news = scrape_news
+        queries = queries or scrape_news.BRAND_QUERIES
+        self.urls = {scrape_news.build_rss_url(q): q for q in queries}
+        self.interval = interval
+        self.limiter = scrape_news.HostLimiter()
+        self.feeds = {}
+        self.seen = SeenSet()
+        self.primed = not skip_existing
+        self.archive = archive
+
+    def poll(self):
+        fresh = {}
+        for url, query in self.urls.items():
+            try:
+                result = self.scrape_news.fetch_feed(url, self.feeds.get(url, {}), self.limiter,
+                                                     archive=self.archive)
+            except Exception as e:
+                # One failing feed must not hold back the others
+                inc("scrape_errors_total", source="news")
+                print(f"[ingest] News feed {url} failed → {e}")
+                continue
+            if result["status"] == 304:
+                continue
+            self.feeds[url] = result
+            for article in result["articles"]:
+                key = article.get("url") or article.get("title")
+                if key in fresh:
+                    # Returned by several feeds this poll: one mention that lists every query
+                    fresh[key]["query"] = add_query(fresh[key]["query"], query)
+                elif self.seen.add(key) and self.primed:
+                    fresh[key] = dict(article, query=query)
+        self.primed = True
+        return [make_record(self.platform, article) for article in fresh.values()]
+
+
+class TwitterSearchSource:
+    platform = "Twitter"
+
+    def __init__(self, client=None, queries=None, interval=30, skip_existing=True, archive=None):
+        import scrape_twitter
+        self.scrape_twitter = scrape_twitter
+        self.client = client or scrape_twitter.make_client()
+        self.queries = queries or scrape_twitter.QUERIES
+        self.interval = interval
+        self.scheduler = scrape_twitter.RateLimitScheduler()
+        self.since = {}
+        # Queries whose backlog has been skipped; a query stays unprimed until a tweet gives it a since_id
+        self.primed = set()
+        self.seen = SeenSet()
+        self.skip_existing = skip_existing
+        self.archive = archive
+
+    def poll(self):
+        fresh = {}
+        for query in self.queries:
+            priming = self.skip_existing and query not in self.primed
+            tweets, newest_id = self.scrape_twitter.fetch_query(
+                self.client, query, self.scheduler, since_id=self.since.get(query),
+                per_page=10 if priming else self.scrape_twitter.TWEETS_PER_PAGE,
+                max_pages=1 if priming else self.scrape_twitter.MAX_PAGES_PER_QUERY,
+                archive=self.archive,
+            )
+            if newest_id:
+                self.since[query] = newest_id
+                self.primed.add(query)
+            if priming:
+                continue
+            for tweet in tweets:
+                # Overlapping queries return the same tweet: one mention that lists every query
+                if tweet["id"] in fresh:
+                    fresh[tweet["id"]]["query"] = add_query(fresh[tweet["id"]]["query"], query)
+                elif self.seen.add(tweet["id"]):
+                    fresh[tweet["id"]] = tweet
+        return [make_record(self.platform, tweet, pd.Timestamp(tweet["created_at"], tz="UTC").timestamp())
+                for tweet in fresh.values()]
+
+
+class RedditStreamSource:
+    platform = "Reddit"
+
+    def __init__(self, reddit_factory=None, subreddits="all", router=None, interval=5):
+        import scrape_reddit
+        self.reddit = (reddit_factory or scrape_reddit.make_reddit)()
+        self.subreddits = subreddits
+        # One alias scan per submission keeps the stream's cost flat however many brands are configured
+        self.router = router or BrandRouter()
+        self.interval = interval
+        self._stream = None
+
+    def poll(self):
+        if self._stream is None:
+            # pause_after=0 makes the stream yield None once it has caught up instead of blocking
+            self._stream = self.reddit.subreddit(self.subreddits).stream.submissions(pause_after=0, skip_existing=True)
+        records = []
+        for post in self._stream:
+            if post is None:
+                break
+            if not self.router.route(f"{post.title}\n{post.selftext}"):
+                continue
+            row = {"post_id": post.id, "title": post.title, "body": post.selftext, "created_utc": post.created_utc}
+            records.append(make_record(self.platform, row, post.created_utc))
+        return records
+
+
+class ReplaySource:
+    """Replays rows from a local file as if they were new mentions, for testing without the network."""
+
+    def __init__(self, platform, rows, per_poll=10, interval=1.0):
+        self.platform = platform
+        self.rows = list(rows)
+        self.per_poll = per_poll
+        self.interval = interval
+        self.position = 0
+
+    @classmethod
+    def from_file(cls, platform, path, **options):
+        if platform == "Reddit":
+            from reddit_stream import iter_posts
+            rows = ({"post_id": p.get("post_id"), "title": p.get("post_title", ""),
+                     "body": p.get("post_text", ""), "created_utc": p.get("created_utc")} for p in iter_posts(path))
+        else:
+            with open(path, encoding="utf-8") as f:
+                rows = list(csv.DictReader(f))
+        return cls(platform, rows, **options)
+
+    def poll(self):
+        chunk = self.rows[self.position:self.position + self.per_poll]
+        self.position += len(chunk)
+        now = time.time()
+        return [make_record(self.platform, dict(row), now) for row in chunk]
+
+
+class IngestMetrics:
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.received = collections.Counter()
+        self.written = collections.Counter()
+        self.batches = 0
+        self.errors = 0
+        self.blocked_seconds = 0.0
+        # Mention creation to store, and first sighting to store
+        self.end_to_end = collections.deque(maxlen=window)
+        self.pipeline = collections.deque(maxlen=window)
+        self.last_flush_at = None
+
+    def snapshot(self, queue_depth):
+        def summary(values):
+            if not values:
+                return None
+            arr = np.fromiter(values, dtype=float)
+            return {"p50": float(np.percentile(arr, 50)), "p95": float(np.percentile(arr, 95)),
+                    "max": float(arr.max())}
+
+        with self.lock:
+            return {
+                "updated_at": time.time(),
+                "uptime_seconds": time.time() - self.started_at,
+                "queue_depth": queue_depth,
+                "received": dict(self.received),
+                "written": dict(self.written),
+                "batches": self.batches,
+                "errors": self.errors,
+                "producer_blocked_seconds": self.blocked_seconds,
+                "end_to_end_lag_seconds": summary(self.end_to_end),
+                "pipeline_lag_seconds": summary(self.pipeline),
+                "last_flush_at": self.last_flush_at,
+            }
+
+
+def load_metrics(path=METRICS_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def score_rows(platform, rows, cache=None):
+    import sentiment
+    from models import get_model
+    if platform == "Twitter":
+        texts = [sentiment.preprocess_tweet(row.get("text", "")) for row in rows]
+        labels = sentiment.cached_labels(
+            "twitter", texts,
+            lambda batch: sentiment.predict_labels(get_model("twitter"), batch, model_key="twitter"), cache,
+        )
+        for row, label in zip(rows, labels):
+            row["sentiment"] = sentiment.TWITTER_LABEL_MAP.get(label, label)
+    elif platform == "News":
+        titles = [row.get("title", "") for row in rows]
+        labels = sentiment.cached_labels("vader", titles, sentiment.vader_labels, cache)
+        for row, label in zip(rows, labels):
+            row["sentiment"] = label
+    else:
+        texts = [f"{row.get('title', '')}\n{row.get('body', '')}" for row in rows]
+        labels = sentiment.cached_labels(
+            "reddit", texts,
+            lambda batch: sentiment.predict_labels(get_model("reddit"), batch, model_key="reddit"), cache,
+        )
+        for row, label in zip(rows, labels):
+            # Fresh posts have no comments yet; weigh the post the same way the batch job does
+            post_score = sentiment.score_label(label)
+            row.update({"post_score": post_score, "avg_comment_score": 0.0, "overall_score": 0.7 * post_score,
+                        "sentiment": sentiment.get_sentiment_label(0.7 * post_score), "n_comments_scored": 0})
+    for row in rows:
+        row["platform"] = platform
+    return rows
+
+
+SEARCH_DOCS = {
+    "Twitter": search_index.tweet_doc,
+    "News": search_index.news_doc,
+    "Reddit": search_index.reddit_post_doc,
+}
+
+
+class IngestService:
+    def __init__(self, sources, batch_size=BATCH_SIZE, max_wait=MAX_WAIT, queue_size=QUEUE_SIZE,
+                 score_fn=score_rows, cache=None, warehouse_root=storage.WAREHOUSE_DIR,
+                 search_path=search_index.SEARCH_INDEX_PATH, metrics_path=METRICS_PATH,
+                 compact_interval=COMPACT_INTERVAL, timeseries_root=timeseries.TIMESERIES_DIR,
+                 timeseries_interval=TIMESERIES_INTERVAL):
+        self.sources = list(sources)
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.score_fn = score_fn
+        self.cache = cache
+        self.warehouse_root = warehouse_root
+        self.search = search_index.SearchIndex(search_path) if search_path else None
+        self.metrics_path = metrics_path
+        self.compact_interval = compact_interval
+        self._compacted_at = time.monotonic()
+        self.timeseries_root = timeseries_root
+        self.timeseries_interval = timeseries_interval
+        self._timeseries_at = time.monotonic()
+        self._timeseries_dirty = False
+        self.metrics = IngestMetrics()
+        self._stop = threading.Event()
+        self._producers_done = threading.Event()
+        self._threads = []
+
+    def _put(self, record):
+        start = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.queue.put(record, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        with self.metrics.lock:
+            self.metrics.blocked_seconds += time.monotonic() - start
+
+    def _produce(self, source):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                records = source.poll()
+            except Exception as e:
+                print(f"[ingest] {source.platform} source failed → {e}")
+                records = []
+            for record in records:
+                with self.metrics.lock:
+                    self.metrics.received[record["platform"]] += 1
+                self._put(record)
+            self._stop.wait(max(0.0, source.interval - (time.monotonic() - started)))
+
+    def flush(self, batch):
+        inc("items_processed_total", len(batch), stage="ingest")
+        by_platform = collections.defaultdict(list)
+        for record in batch:
+            by_platform[record["platform"]].append(record)
+        for platform, records in by_platform.items():
+            try:
+                with span("score", items=len(records), platform=platform):
+                    rows = self.score_fn(platform, [dict(r["row"]) for r in records], self.cache)
+                # The batch pipeline replaces its own dataset; ingest appends to the live one
+                storage.write_mentions(pd.DataFrame(rows), platform, root=self.warehouse_root, mode="append",
+                                       name=storage.LIVE_MENTIONS)
+                self._timeseries_dirty = True
+                if self.search:
+                    self.search.add_docs([SEARCH_DOCS[platform](row) for row in rows])
+            except Exception as e:
+                inc("ingest_errors_total", platform=platform)
+                print(f"[ingest] failed to write {len(records)} {platform} mentions → {e}")
+                with self.metrics.lock:
+                    self.metrics.errors += 1
+                continue
+            now = time.time()
+            with self.metrics.lock:
+                self.metrics.written[platform] += len(records)
+                for record in records:
+                    if record["created_ts"]:
+                        self.metrics.end_to_end.append(now - record["created_ts"])
+                    self.metrics.pipeline.append(now - record["observed_at"])
+        with self.metrics.lock:
+            self.metrics.batches += 1
+            self.metrics.last_flush_at = time.time()
+        self.write_metrics()
+
+    def compact(self):
+        self._compacted_at = time.monotonic()
+        try:
+            with span("compact", stage="ingest"):
+                before, after = storage.compact_mentions(root=self.warehouse_root)
+        except Exception as e:
+            inc("ingest_errors_total", platform="compaction")
+            print(f"[ingest] compaction failed → {e}")
+            return
+        if before != after:
+            print(f"[ingest] compacted live mentions: {before - after} already in the batch store dropped")
+
+    def refresh_timeseries(self):
+        self._timeseries_at = time.monotonic()
+        if not self.timeseries_root or not self._timeseries_dirty:
+            return
+        self._timeseries_dirty = False
+        try:
+            timeseries.build_timeseries(self.timeseries_root, self.warehouse_root)
+        except Exception as e:
+            inc("ingest_errors_total", platform="timeseries")
+            print(f"[ingest] time series rebuild failed → {e}")
+
+    def write_metrics(self):
+        if not self.metrics_path:
+            return
+        if os.path.dirname(self.metrics_path):
+            os.makedirs(os.path.dirname(self.metrics_path), exist_ok=True)
+        tmp_path = self.metrics_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.metrics.snapshot(self.queue.qsize()), f, indent=2)
+        os.replace(tmp_path, self.metrics_path)
+        export("ingest")
+
+    def _consume(self):
+        batch = []
+        deadline = None
+        while not (self._producers_done.is_set() and self.queue.empty()):
+            timeout = 0.5 if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+                if len(batch) == 1:
+                    deadline = time.monotonic() + self.max_wait
+            except queue.Empty:
+                pass
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self.flush(batch)
+                batch = []
+            # Runs on the consumer thread, the only writer of the live dataset
+            if not batch and time.monotonic() - self._compacted_at >= self.compact_interval:
+                self.compact()
+            if not batch and time.monotonic() - self._timeseries_at >= self.timeseries_interval:
+                self.refresh_timeseries()
+        if batch:
+            self.flush(batch)
+        self.compact()
+        self.refresh_timeseries()
+
+    def start(self):
+        for source in self.sources:
+            thread = threading.Thread(target=self._produce, args=(source,), daemon=True,
+                                      name=f"ingest-{source.platform.lower()}")
+            thread.start()
+            self._threads.append(thread)
+        self._consumer = threading.Thread(target=self._consume, daemon=True, name="ingest-consumer")
+        self._consumer.start()
+
+    def stop(self):
+        # Producers stop first; the consumer drains what is already queued
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._producers_done.set()
+        self._consumer.join()
+        if self.search:
+            self.search.close()
+
+    def run(self, duration=None):
+        self.start()
+        try:
+            deadline = time.monotonic() + duration if duration else None
+            while deadline is None or time.monotonic() < deadline:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("[ingest] stopping...")
+        finally:
+            self.stop()
+        return self.metrics.snapshot(self.queue.qsize())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the near-real-time ingestion service")
+    parser.add_argument("--sources", default="rss,twitter,reddit",
+                        help="comma-separated network sources (rss, twitter, reddit)")
+    parser.add_argument("--replay", action="append", default=[], metavar="PLATFORM=PATH",
+                        help="replay a local raw file as a fake producer, e.g. Twitter=data/raw/leapscholar_tweets.csv")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT, help="seconds before a partial batch is flushed")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    args = parser.parse_args(argv)
+
+    from capture import open_archive
+    archive = None if args.replay else open_archive()
+    factories = {
+        "rss": lambda: RssSource(archive=archive),
+        "twitter": lambda: TwitterSearchSource(archive=archive),
+        "reddit": RedditStreamSource,
+    }
+    sources = []
+    for replay in args.replay:
+        platform, path = replay.split("=", 1)
+        sources.append(ReplaySource.from_file(platform, path))
+    if not args.replay:
+        sources.extend(factories[name]() for name in args.sources.split(",") if name)
+
+    from sentiment_cache import SentimentCache
+    cache = SentimentCache()
+    service = IngestService(sources, batch_size=args.batch_size, max_wait=args.max_wait,
+                            queue_size=args.queue_size, cache=cache)
+    print(f"[ingest] running {len(sources)} sources; Ctrl+C to stop")
+    metrics = service.run(args.duration)
+    cache.close()
+    if archive is not None:
+        archive.close()
+    lag = metrics["end_to_end_lag_seconds"]
+    print(f"[ingest] wrote {sum(metrics['written'].values())} mentions in {metrics['batches']} batches"
+          + (f"; end-to-end lag p50 {lag['p50']:.1f}s, p95 {lag['p95']:.1f}s" if lag else ""))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,333 @@
+"""
+Lightweight in-process instrumentation.
+
+Spans time network fetches, tokenization, model forward passes and file I/O,
+counters track items, cache hits and errors, gauges hold current levels such as
+queue depth, and histograms record per-item latency. `export` writes everything as JSON and in the Prometheus text format
+(for a node_exporter textfile collector). `profile` optionally wraps a block in
+cProfile or a low-overhead sampling profiler and saves the profile.
+"""
+
+import bisect
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+METRICS_DIR = "data/cache/metrics"
+PROFILE_DIR = "data/cache/profiles"
+PREFIX = "brand_monitor_"
+# Upper bounds in seconds; per-item model latency sits at the low end, fetches and stages at the high end
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           30.0, 60.0, 300.0)
+# For histograms of counts rather than seconds, e.g. batch sizes
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+PROFILERS = ("cprofile", "sample")
+SAMPLE_INTERVAL = 0.005
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value, n=1):
+        self.counts[bisect.bisect_left(self.buckets, value)] += n
+        self.count += n
+        self.sum += value * n
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = collections.defaultdict(float)
+        self.gauges = {}
+        self.histograms = {}
+        self.buckets = {}
+        self._lock = threading.Lock()
+        self._exported_at = {}
+        self.started_at = time.time()
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self.counters[(name, _labels_key(labels))] += value
+
+    def gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, _labels_key(labels))] = value
+
+    def set_buckets(self, name, buckets):
+        # Applies to histograms of `name` created after this call
+        with self._lock:
+            self.buckets[name] = tuple(buckets)
+
+    def observe(self, name, value, n=1, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.buckets.get(name, BUCKETS))
+            self.histograms[key].observe(value, n)
+
+    @contextlib.contextmanager
+    def span(self, name, items=None, **labels):
+        """Times a block into `<name>_seconds`; with `items`, also records per-item latency."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc(f"{name}_errors_total", **labels)
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+            raise
+        elapsed = time.perf_counter() - start
+        self.observe(f"{name}_seconds", elapsed, **labels)
+        if items:
+            self.observe(f"{name}_item_seconds", elapsed / items, n=items, **labels)
+            self.inc(f"{name}_items_total", items, **labels)
+
+    def timed(self, name, **labels):
+        def decorator(fn):
+            def wrapper(*args, **kwargs):
+                with self.span(name, **labels):
+                    return fn(*args, **kwargs)
+            wrapper.__name__ = fn.__name__
+            wrapper.__doc__ = fn.__doc__
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "updated_at": time.time(),
+                "uptime_seconds": time.time() - self.started_at,
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                           for (name, labels), value in sorted(self.gauges.items())],
+                "histograms": [{"name": name, "labels": dict(labels), **hist.summary()}
+                               for (name, labels), hist in sorted(self.histograms.items())],
+            }
+
+    def prometheus(self):
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = PREFIX + re.sub(r"\W", "_", name)
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric}{fmt(labels)} {value:g}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                metric = PREFIX + re.sub(r"\W", "_", name)
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric}{fmt(labels)} {value:g}")
+            for (name, labels), hist in sorted(self.histograms.items()):
+                metric = PREFIX + re.sub(r"\W", "_", name)
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, n in zip([f"{b:g}" for b in hist.buckets] + ["+Inf"], hist.counts):
+                    cumulative += n
+                    lines.append(f"{metric}_bucket{fmt(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{metric}_sum{fmt(labels)} {hist.sum:.6f}")
+                lines.append(f"{metric}_count{fmt(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, name, root=METRICS_DIR, min_interval=0):
+        """Writes `<root>/<name>.json` and `<root>/<name>.prom` and returns their paths.
+
+        With `min_interval`, an export of the same name within that many seconds of the
+        last one is skipped and returns None.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._exported_at.get(name, float("-inf")) < min_interval:
+                return None
+            self._exported_at[name] = now
+        os.makedirs(root, exist_ok=True)
+        paths = (os.path.join(root, f"{name}.json"), os.path.join(root, f"{name}.prom"))
+        for path, content in zip(paths, (json.dumps(self.snapshot(), indent=2), self.prometheus())):
+            # Scrapers and dashboards read these while we write, so swap them in atomically; the
+            # tmp name is unique because several threads or processes may export the same name
+            fd, tmp_path = tempfile.mkstemp(dir=root, prefix=os.path.basename(path) + ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        return paths
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+            self.started_at = time.time()
+
+
+metrics = Metrics()
+inc = metrics.inc
+gauge = metrics.gauge
+set_buckets = metrics.set_buckets
+observe = metrics.observe
+span = metrics.span
+timed = metrics.timed
+export = metrics.export
+
+
+_profilers = []
+_profilers_lock = threading.Lock()
+_thread_start = threading.Thread.start
+
+
+def _tracked_start(thread):
+    # Runs in the parent, so a thread started by a profiled thread is profiled too
+    parent = threading.get_ident()
+    _thread_start(thread)
+    with _profilers_lock:
+        for profiler in _profilers:
+            if parent in profiler.threads:
+                profiler.threads.add(thread.ident)
+
+
+class SamplingProfiler:
+    """Samples one thread's stack, and those of the threads it starts, at a fixed interval.
+
+    Stages run concurrently in the pipeline's pool, so sampling every thread would mix
+    other stages into the profile. The stacks are written collapsed (flamegraph.pl/speedscope).
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, thread_id=None):
+        self.interval = interval
+        self.threads = {thread_id or threading.get_ident()}
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in self.threads:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        with _profilers_lock:
+            _profilers.append(self)
+            threading.Thread.start = _tracked_start
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        _thread_start(self._thread)
+
+    def stop(self):
+        with _profilers_lock:
+            _profilers.remove(self)
+            if not _profilers:
+                threading.Thread.start = _thread_start
+        self._stop.set()
+        self._thread.join()
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextlib.contextmanager
+def profile(name, mode=None, root=PROFILE_DIR):
+    """Profiles the block with `mode` ("cprofile" or "sample"); a no-op when mode is None."""
+    if mode is None:
+        yield
+        return
+    if mode not in PROFILERS:
+        raise ValueError(f"Unknown profiler '{mode}', expected one of {', '.join(PROFILERS)}")
+    os.makedirs(root, exist_ok=True)
+    stem = os.path.join(root, f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', name)}-{time.strftime('%Y%m%d-%H%M%S')}")
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            path = stem + ".prof"
+            profiler.dump_stats(path)
+            print(f"[profile] {name}: saved cProfile stats to '{path}' (view with snakeviz or pstats)")
+    else:
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            path = stem + ".folded"
+            profiler.save(path)
+            print(f"[profile] {name}: saved {sum(profiler.stacks.values())} samples to '{path}'")
+
+
+if __name__ == "__main__":
+    # Usage: python modules/instrumentation.py [name]  — prints the latest exported metrics summary
+    name = sys.argv[1] if len(sys.argv) > 1 else "pipeline"
+    with open(os.path.join(METRICS_DIR, f"{name}.json"), encoding="utf-8") as f:
+        snapshot = json.load(f)
+    for counter in snapshot["counters"]:
+        print(f"{counter['name']:<40} {json.dumps(counter['labels']):<40} {counter['value']:g}")
+    for level in snapshot.get("gauges", []):
+        print(f"{level['name']:<40} {json.dumps(level['labels']):<40} {level['value']:g}")
+    for hist in snapshot["histograms"]:
+        print(f"{hist['name']:<40} {json.dumps(hist['labels']):<40} n={hist['count']} "
+              f"p50={hist['p50'] or 0:.4f}s p99={hist['p99'] or 0:.4f}s max={hist['max']:.4f}s")
@@ -0,0 +1,262 @@
+"""
+Process-wide model registry shared by sentiment.py and topics.py.
+
+Models are loaded on first use and kept in an LRU cache bounded by an estimated
+memory budget, so one run loads each model at most once. With
+INFERENCE_SERVER_URL set, the transformer classifiers and the KeyBERT embedder
+are thin clients of a running inference_server.py instead, so concurrent jobs
+share one copy of the weights.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from instrumentation import inc, span
+
+# Floating refs are resolved to a commit SHA before loading (see resolve_revision);
+# put a SHA here to pin a model outright
+MODEL_REVISIONS = {
+    "cardiffnlp/twitter-roberta-base-sentiment": "main",
+    "distilbert-base-uncased-finetuned-sst-2-english": "main",
+    "all-MiniLM-L6-v2": "main",
+    "vader": "3.3.2",
+}
+# Hub repositories for names that libraries expand themselves
+HUB_REPOS = {"all-MiniLM-L6-v2": "sentence-transformers/all-MiniLM-L6-v2"}
+NOT_ON_HUB = ("vader",)
+_resolved = {}
+_resolve_lock = threading.Lock()
+
+MAX_MODEL_BYTES = int(os.getenv("MODEL_CACHE_MB", "4096")) * 1024 * 1024
+
+# Inference backend for the transformer classifiers: torch, onnx or onnx-int8
+BACKENDS = ("torch", "onnx", "onnx-int8")
+BACKEND = os.getenv("SENTIMENT_BACKEND", "torch")
+TRANSFORMER_KEYS = ("twitter", "reddit")
+# e.g. http://127.0.0.1:8765; unset loads the weights in this process
+INFERENCE_SERVER_URL = os.getenv("INFERENCE_SERVER_URL")
+REMOTE_KEYS = TRANSFORMER_KEYS + ("keybert",)
+
+
+def _lookup_commit(model_name, revision):
+    repo = HUB_REPOS.get(model_name, model_name)
+    try:
+        from huggingface_hub import HfApi
+        return HfApi().model_info(repo, revision=revision).sha
+    except Exception:
+        pass
+    # Offline: the hub cache records the commit each ref last resolved to
+    try:
+        from huggingface_hub.constants import HF_HUB_CACHE
+        ref_path = os.path.join(HF_HUB_CACHE, "models--" + repo.replace("/", "--"), "refs", revision)
+        with open(ref_path, encoding="utf-8") as f:
+            return f.read().strip()
+    except Exception:
+        print(f"Warning: could not resolve {model_name}@{revision} to a commit; cached results use the ref name")
+        return revision
+
+
+def resolve_revision(model_name):
+    """Commit SHA the configured revision points at, looked up once per process.
+
+    Models are loaded at this SHA and caches are keyed by it, so a model updated
+    on the hub invalidates its cached results on the next run.
+    """
+    revision = MODEL_REVISIONS[model_name]
+    if model_name in NOT_ON_HUB or re.fullmatch(r"[0-9a-f]{40}", revision):
+        return revision
+    with _resolve_lock:
+        if model_name not in _resolved:
+            _resolved[model_name] = _lookup_commit(model_name, revision)
+        return _resolved[model_name]
+
+
+def load_torch_pipeline(key):
+    from transformers import AutoTokenizer, pipeline
+    model_name = MODEL_NAMES[key]
+    revision = resolve_revision(model_name)
+    tokenizer = AutoTokenizer.from_pretrained(model_name, revision=revision)
+    return pipeline("sentiment-analysis", model=model_name, tokenizer=tokenizer, revision=revision)
+
+
+def _load_classifier(key):
+    if INFERENCE_SERVER_URL:
+        from inference_server import RemoteClassifier
+        return RemoteClassifier(key, INFERENCE_SERVER_URL)
+    if BACKEND == "torch":
+        return load_torch_pipeline(key)
+    from onnx_backend import load_onnx_classifier
+    model_name = MODEL_NAMES[key]
+    return load_onnx_classifier(model_name, resolve_revision(model_name), quantize=BACKEND == "onnx-int8")
+
+
+def _load_twitter():
+    return _load_classifier("twitter")
+
+
+def _load_reddit():
+    return _load_classifier("reddit")
+
+
+def _load_keybert():
+    if INFERENCE_SERVER_URL:
+        from inference_server import remote_keybert
+        return remote_keybert(INFERENCE_SERVER_URL)
+    from keybert import KeyBERT
+    from sentence_transformers import SentenceTransformer
+    model_name = MODEL_NAMES["keybert"]
+    return KeyBERT(model=SentenceTransformer(HUB_REPOS[model_name], revision=resolve_revision(model_name)))
+
+
+def _load_vader():
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    return SentimentIntensityAnalyzer()
+
+
+LOADERS = {
+    "twitter": _load_twitter,
+    "reddit": _load_reddit,
+    "keybert": _load_keybert,
+    "vader": _load_vader,
+}
+
+MODEL_NAMES = {
+    "twitter": "cardiffnlp/twitter-roberta-base-sentiment",
+    "reddit": "distilbert-base-uncased-finetuned-sst-2-english",
+    "keybert": "all-MiniLM-L6-v2",
+    "vader": "vader",
+}
+
+
+def _estimate_bytes(model):
+    if hasattr(model, "nbytes"):
+        return model.nbytes
+    # Pipelines keep the torch module on .model, KeyBERT on .model.embedding_model
+    candidates = [model, getattr(model, "model", None)]
+    candidates.append(getattr(candidates[1], "embedding_model", None))
+    for candidate in candidates:
+        if candidate is not None and hasattr(candidate, "parameters"):
+            return sum(p.numel() * p.element_size() for p in candidate.parameters())
+    return 0
+
+
+class ModelRegistry:
+    def __init__(self, max_bytes=MAX_MODEL_BYTES):
+        self.max_bytes = max_bytes
+        self.loaders = dict(LOADERS)
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+        # One lock per key, so a slow load never blocks lookups of other models
+        self._load_locks = {}
+        # Bumped on evict, so a load that raced an eviction is not cached
+        self._generations = {}
+        self.load_count = {}
+
+    def register(self, key, loader):
+        with self._lock:
+            self.loaders[key] = loader
+            self.evict(key)
+
+    def _cached(self, key):
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            if key not in self.loaders:
+                raise KeyError(f"Unknown model '{key}'")
+            return None
+
+    def get(self, key):
+        model = self._cached(key)
+        if model is not None:
+            return model
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        # Threads asking for the same model wait for one load; the registry lock is free meanwhile
+        with load_lock:
+            model = self._cached(key)
+            if model is not None:
+                return model
+            with self._lock:
+                loader = self.loaders[key]
+                generation = self._generations.get(key, 0)
+            with span("model_load", model=key):
+                model = loader()
+            with self._lock:
+                self.load_count[key] = self.load_count.get(key, 0) + 1
+                if self._generations.get(key, 0) != generation:
+                    # The loader or backend changed while loading; hand this caller the model, cache nothing
+                    return model
+                self._models[key] = model
+                self._sizes[key] = _estimate_bytes(model)
+                self._enforce_budget(keep=key)
+            return model
+
+    def _enforce_budget(self, keep):
+        while sum(self._sizes.values()) > self.max_bytes and len(self._models) > 1:
+            oldest = next(iter(self._models))
+            if oldest == keep:
+                break
+            self.evict(oldest)
+
+    def evict(self, key):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            if self._models.pop(key, None) is not None:
+                inc("model_evictions_total", model=key)
+            self._sizes.pop(key, None)
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models)
+
+    def warm_up(self, keys=None):
+        keys = keys or list(self.loaders)
+        for key in keys:
+            model = self.get(key)
+            # Run one tiny input so lazy kernels/tokenizer caches are initialised
+            if key in ("twitter", "reddit"):
+                model("warm up")
+            elif key == "keybert":
+                model.extract_keywords("warm up", top_n=1)
+            elif key == "vader":
+                model.polarity_scores("warm up")
+
+
+registry = ModelRegistry()
+
+
+def get_model(key):
+    return registry.get(key)
+
+
+def warm_up(keys=None):
+    registry.warm_up(keys)
+
+
+def set_backend(backend):
+    global BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {', '.join(BACKENDS)}")
+    BACKEND = backend
+    for key in TRANSFORMER_KEYS:
+        registry.evict(key)
+
+
+def set_inference_server(url):
+    global INFERENCE_SERVER_URL
+    INFERENCE_SERVER_URL = url
+    for key in REMOTE_KEYS:
+        registry.evict(key)
+
+
+def model_version(key):
+    model_name = MODEL_NAMES[key]
+    revision = resolve_revision(model_name)
+    # Backends can disagree on borderline texts, so cached labels are kept per backend
+    if key in TRANSFORMER_KEYS and BACKEND != "torch":
+        revision = f"{revision}+{BACKEND}"
+    return model_name, revision
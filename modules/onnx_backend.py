@@ -0,0 +1,243 @@
+"""
+ONNX Runtime inference backend for the Twitter and Reddit sentiment models.
+
+Models are exported once to ONNX (optionally with dynamic int8 quantization)
+and served through a small classifier with the same call signature and raw
+labels as the transformers pipeline, so label_map/score_label apply unchanged.
+A parity report compares labels against the PyTorch backend on a held-out sample.
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import random
+import re
+import shutil
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows: the completeness re-check below still guards the cleanup
+    fcntl = None
+
+ONNX_DIR = "data/cache/onnx"
+
+
+def model_dir(model_name, revision, root=ONNX_DIR):
+    return os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{model_name}@{revision}"))
+
+
+def export_complete(out_dir):
+    # config.json is written last, so a directory without it is a crashed export
+    return os.path.exists(os.path.join(out_dir, "config.json"))
+
+
+@contextlib.contextmanager
+def export_lock(out_dir):
+    # Next to the export rather than in it, so the lock outlives the directory being replaced
+    os.makedirs(os.path.dirname(out_dir) or ".", exist_ok=True)
+    with open(out_dir + ".lock", "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def export_model(model_name, revision, quantize=False, root=ONNX_DIR):
+    out_dir = model_dir(model_name, revision, root)
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    int8_path = os.path.join(out_dir, "model_int8.onnx")
+    if not export_complete(out_dir):
+        # One worker exports while the others wait, then find the finished export
+        with export_lock(out_dir):
+            if not export_complete(out_dir):
+                _export_fp32(model_name, revision, out_dir)
+    if quantize and not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        tmp_path = os.path.join(out_dir, f"model_int8-{uuid.uuid4().hex}.tmp.onnx")
+        try:
+            quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, int8_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return int8_path if quantize else fp32_path
+
+
+def _export_fp32(model_name, revision, out_dir):
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+    # Re-checked right before the move: another worker may have finished while the imports ran
+    if os.path.isdir(out_dir) and not export_complete(out_dir):
+        # Left behind by an export that died before this was atomic; move it aside first
+        stale = f"{out_dir}.stale-{uuid.uuid4().hex}"
+        try:
+            os.rename(out_dir, stale)
+            shutil.rmtree(stale, ignore_errors=True)
+        except OSError:
+            pass
+    # Export into a private directory and rename it into place, so concurrent
+    # backfill workers never load a half-written model
+    tmp_dir = f"{out_dir}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp_dir)
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(model_name, revision=revision)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name, revision=revision).eval()
+        dummy = tokenizer(["warm up export"], return_tensors="pt")
+        with torch.no_grad():
+            torch.onnx.export(
+                model, (dummy["input_ids"], dummy["attention_mask"]), os.path.join(tmp_dir, "model.onnx"),
+                input_names=["input_ids", "attention_mask"], output_names=["logits"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "logits": {0: "batch"},
+                },
+                opset_version=17, dynamo=False,
+            )
+        tokenizer.save_pretrained(tmp_dir)
+        model.config.save_pretrained(tmp_dir)
+        try:
+            os.rename(tmp_dir, out_dir)
+        except OSError:
+            # Another worker finished first; its export is identical
+            if not export_complete(out_dir):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class OnnxClassifier:
+    def __init__(self, onnx_path, threads=None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        directory = os.path.dirname(onnx_path)
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+        with open(os.path.join(directory, "config.json"), encoding="utf-8") as f:
+            self.id2label = {int(k): v for k, v in json.load(f)["id2label"].items()}
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.nbytes = os.path.getsize(onnx_path)
+        # Some hub tokenizers leave model_max_length unset; positions stop at 512
+        self.max_length = min(self.tokenizer.model_max_length, 512)
+
+    def __call__(self, texts, batch_size=None, truncation=True):
+        if isinstance(texts, str):
+            texts = [texts]
+        batch_size = batch_size or len(texts)
+        results = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            encoded = self.tokenizer(batch, padding=True, truncation=truncation,
+                                     max_length=self.max_length, return_tensors="np")
+            logits = self.session.run(["logits"], {
+                "input_ids": encoded["input_ids"].astype(np.int64),
+                "attention_mask": encoded["attention_mask"].astype(np.int64),
+            })[0]
+            exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+            probs = exp / exp.sum(axis=1, keepdims=True)
+            for row in probs:
+                idx = int(row.argmax())
+                results.append({"label": self.id2label[idx], "score": float(row[idx])})
+        return results
+
+
+def load_onnx_classifier(model_name, revision, quantize=False, threads=None):
+    return OnnxClassifier(export_model(model_name, revision, quantize=quantize), threads=threads)
+
+
+def load_sample(key, size=500, seed=13):
+    from reddit_stream import iter_records
+    from sentiment import preprocess_tweet
+    if key == "twitter":
+        with open("data/raw/leapscholar_tweets.csv", encoding="utf-8") as f:
+            texts = [preprocess_tweet(row.get("text", "")) for row in csv.DictReader(f)]
+    else:
+        texts = [r["text"] for r in iter_records("data/raw/reddit_leapscholar.json") if r["text"].strip()]
+    rng = random.Random(seed)
+    return rng.sample(texts, min(size, len(texts)))
+
+
+def parity_report(key, texts, quantize=True, batch_size=32, output_json=None):
+    from models import MODEL_NAMES, load_torch_pipeline, resolve_revision
+    from sentiment import TWITTER_LABEL_MAP, predict_labels, score_label
+    model_name = MODEL_NAMES[key]
+    # Compare final labels, after the same mapping the sentiment functions apply
+    mapping = (lambda l: TWITTER_LABEL_MAP.get(l, l)) if key == "twitter" else score_label
+
+    timings = {}
+    labels = {}
+    backends = {
+        "torch": lambda: load_torch_pipeline(key),
+        "onnx": lambda: load_onnx_classifier(model_name, resolve_revision(model_name), quantize=quantize),
+    }
+    for backend, loader in backends.items():
+        clf = loader()
+        predict_labels(clf, texts[:batch_size], batch_size=batch_size)  # warm up
+        start = time.perf_counter()
+        labels[backend] = [mapping(l) for l in predict_labels(clf, texts, batch_size=batch_size)]
+        timings[backend] = time.perf_counter() - start
+
+    confusion = defaultdict(Counter)
+    disagreements = []
+    for text, ref, got in zip(texts, labels["torch"], labels["onnx"]):
+        confusion[str(ref)][str(got)] += 1
+        if ref != got and len(disagreements) < 20:
+            disagreements.append({"text": text, "torch": ref, "onnx": got})
+    agreement = sum(1 for a, b in zip(labels["torch"], labels["onnx"]) if a == b) / len(texts) if texts else 1.0
+    report = {
+        "model": model_name,
+        "backend": "onnx-int8" if quantize else "onnx",
+        "sample_size": len(texts),
+        "label_agreement": agreement,
+        "confusion": {ref: dict(row) for ref, row in confusion.items()},
+        "torch_texts_per_sec": len(texts) / timings["torch"] if timings["torch"] else None,
+        "onnx_texts_per_sec": len(texts) / timings["onnx"] if timings["onnx"] else None,
+        "speedup": timings["torch"] / timings["onnx"] if timings["onnx"] else None,
+        "disagreements": disagreements,
+    }
+    if output_json:
+        if os.path.dirname(output_json):
+            os.makedirs(os.path.dirname(output_json), exist_ok=True)
+        with open(output_json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export models to ONNX and check parity with PyTorch")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("model", choices=["twitter", "reddit"])
+    parser.add_argument("--quantize", action="store_true", help="use dynamic int8 quantization")
+    parser.add_argument("--sample", type=int, default=500)
+    parser.add_argument("--output", help="where to write the parity report JSON")
+    args = parser.parse_args(argv)
+
+    from models import MODEL_NAMES, resolve_revision
+    model_name = MODEL_NAMES[args.model]
+    if args.command == "export":
+        path = export_model(model_name, resolve_revision(model_name), quantize=args.quantize)
+        print(f"Exported {model_name} to '{path}'")
+        return
+    output = args.output or f"data/cache/onnx/parity_{args.model}{'_int8' if args.quantize else ''}.json"
+    report = parity_report(args.model, load_sample(args.model, args.sample), quantize=args.quantize, output_json=output)
+    print(f"{report['backend']} vs torch on {report['sample_size']} texts: "
+          f"{report['label_agreement']:.1%} label agreement, {report['speedup']:.2f}x speedup")
+    print(f"Parity report saved to '{output}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Single-process pipeline orchestrator.
+
+Stages form a DAG with declared inputs and outputs. Independent branches run
+concurrently, and a stage is skipped when its input content hashes, code and
+model versions match the last successful run. Everything runs in one process
+so models loaded through the registry are shared between stages.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import aggregates
+import brands
+import cascade
+import dedup
+import instrumentation
+import models
+import scrape_news
+import scrape_reddit
+import scrape_twitter
+import search_index
+import sentiment
+import storage
+import timeseries
+import topics
+import trending
+from sentiment_cache import SentimentCache
+
+STATE_PATH = "data/cache/pipeline_state.json"
+
+RAW_NEWS_LEAP = "data/raw/leapscholar_news_leap.csv"
+RAW_NEWS_KEYWORDS = "data/raw/leapscholar_news_keywords.csv"
+RAW_TWEETS = "data/raw/leapscholar_tweets.csv"
+RAW_REDDIT = "data/raw/reddit_leapscholar.json"
+PROCESSED_DIR = "data/processed"
+
+
+class Stage:
+    def __init__(self, name, func, inputs=(), outputs=(), deps=(), code=(), models=(), params=None, source=False):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.code = list(code)
+        self.models = list(models)
+        self.params = params or {}
+        # Source stages pull from the network and always run unless scraping is disabled
+        self.source = source
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stage_fingerprint(stage):
+    parts = {
+        "inputs": {p: file_digest(p) if os.path.exists(p) else None for p in stage.inputs},
+        "code": {m.__name__: file_digest(m.__file__) for m in stage.code},
+        "models": {key: models.model_version(key) for key in stage.models},
+        "params": stage.params,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_state(path=STATE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state, path=STATE_PATH):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def build_stages(cache, cascade_band=None, dedup_indexes=None, replay=False):
+    # One shared index per corpus: stages reading the same corpus must not race on new clusters
+    dedup_indexes = dedup_indexes or {}
+    router = brands.BrandRouter()
+    # Editing the brand config re-routes mentions, so it invalidates every stage that tags or splits them
+    brand_params = {brand.name: [brand.aliases, brand.queries] for brand in router.brands}
+
+    def reddit_stage():
+        sentiment.reddit_sentiment(
+            RAW_REDDIT, f"{PROCESSED_DIR}/reddit_sentiment.csv", cache=cache,
+            mode="tree", nodes_csv=f"{PROCESSED_DIR}/reddit_comment_sentiment.csv",
+            cascade_band=cascade_band, router=router,
+        )
+        storage.import_csv(f"{PROCESSED_DIR}/reddit_sentiment.csv", "Reddit")
+
+    def twitter_stage():
+        sentiment.sentiment_twitter(RAW_TWEETS, f"{PROCESSED_DIR}/twitter_sentiment.csv", cache=cache,
+                                    cascade_band=cascade_band, dedup=dedup_indexes.get("twitter"), router=router)
+        storage.import_csv(f"{PROCESSED_DIR}/twitter_sentiment.csv", "Twitter")
+
+    def news_stage():
+        sentiment.sentiment_news(RAW_NEWS_LEAP, f"{PROCESSED_DIR}/news_sentiment.csv", cache=cache,
+                                 dedup=dedup_indexes.get("news"), router=router)
+        storage.import_csv(f"{PROCESSED_DIR}/news_sentiment.csv", "News")
+
+    sentiment_outputs = [f"{PROCESSED_DIR}/{name}" for name in aggregates.SOURCES.values()]
+    searchable = [f"{PROCESSED_DIR}/{name}" for name in search_index.SOURCES]
+    return [
+        # With replay the source stages rebuild the raw files from the capture archive, offline
+        Stage("scrape_news", lambda: scrape_news.scrape_news(replay=replay),
+              outputs=[RAW_NEWS_LEAP, RAW_NEWS_KEYWORDS], source=True),
+        Stage("scrape_twitter", lambda: scrape_twitter.scrape_twitter(replay=replay), outputs=[RAW_TWEETS], source=True),
+        Stage("scrape_reddit",
+              lambda: scrape_reddit.fetch_reddit_leapscholar_posts_comments_json(RAW_REDDIT, replay=replay),
+              outputs=[RAW_REDDIT], source=True),
+        Stage("sentiment_reddit", reddit_stage,
+              inputs=[RAW_REDDIT], deps=["scrape_reddit"],
+              outputs=[f"{PROCESSED_DIR}/reddit_sentiment.csv", f"{PROCESSED_DIR}/reddit_comment_sentiment.csv"],
+              code=[sentiment, storage, cascade, brands], models=["reddit", "vader"],
+              params={"cascade_band": cascade_band, "brands": brand_params}),
+        Stage("sentiment_twitter", twitter_stage,
+              inputs=[RAW_TWEETS], deps=["scrape_twitter"],
+              outputs=[f"{PROCESSED_DIR}/twitter_sentiment.csv"],
+              code=[sentiment, storage, cascade, dedup, brands], models=["twitter", "vader"],
+              params={"cascade_band": cascade_band, "brands": brand_params}),
+        Stage("sentiment_news", news_stage,
+              inputs=[RAW_NEWS_LEAP], deps=["scrape_news"],
+              outputs=[f"{PROCESSED_DIR}/news_sentiment.csv"],
+              code=[sentiment, storage, dedup, brands], models=["vader"],
+              params={"brands": brand_params}),
+        Stage("keywords_news",
+              lambda: topics.extract_top_keywords(RAW_NEWS_KEYWORDS, f"{PROCESSED_DIR}/news_top_keywords.csv",
+                                                  dedup=dedup_indexes.get("news")),
+              inputs=[RAW_NEWS_KEYWORDS], deps=["scrape_news"],
+              outputs=[f"{PROCESSED_DIR}/news_top_keywords.csv"],
+              code=[topics, dedup], models=["keybert"]),
+        Stage("keywords_reddit",
+              lambda: topics.extract_reddit_keywords(RAW_REDDIT, f"{PROCESSED_DIR}/reddit_top_keywords.csv"),
+              inputs=[RAW_REDDIT], deps=["scrape_reddit"],
+              outputs=[f"{PROCESSED_DIR}/reddit_top_keywords.csv"],
+              code=[topics], models=["keybert"]),
+        Stage("trending",
+              lambda: trending.update_trending(RAW_TWEETS, [RAW_NEWS_LEAP, RAW_NEWS_KEYWORDS], RAW_REDDIT),
+              inputs=[RAW_TWEETS, RAW_NEWS_LEAP, RAW_NEWS_KEYWORDS, RAW_REDDIT],
+              deps=["scrape_twitter", "scrape_news", "scrape_reddit"],
+              outputs=[trending.SNAPSHOT_PATH],
+              code=[trending, topics], models=["keybert"],
+              # Windows slide with the clock, so refresh the snapshot at least hourly
+              params={"hour": int(time.time() // 3600)}),
+        Stage("aggregates", lambda: aggregates.write_aggregates(PROCESSED_DIR),
+              inputs=sentiment_outputs, deps=["sentiment_reddit", "sentiment_twitter", "sentiment_news"],
+              outputs=aggregates.aggregate_paths(PROCESSED_DIR),
+              code=[aggregates]),
+        Stage("brand_partitions", lambda: brands.write_brand_partitions(PROCESSED_DIR, router.brands),
+              inputs=sentiment_outputs, deps=["sentiment_reddit", "sentiment_twitter", "sentiment_news"],
+              outputs=[path for brand in router.brands
+                       for path in aggregates.aggregate_paths(brands.brand_dir(brand, PROCESSED_DIR))],
+              code=[brands, aggregates], params={"brands": brand_params}),
+        Stage("timeseries", timeseries.build_timeseries,
+              inputs=sentiment_outputs, deps=["sentiment_reddit", "sentiment_twitter", "sentiment_news"],
+              outputs=[timeseries.tier_path(resolution) for resolution in timeseries.RESOLUTIONS],
+              code=[timeseries, storage]),
+        Stage("search_index", lambda: search_index.update_index(PROCESSED_DIR),
+              inputs=searchable, deps=["sentiment_reddit", "sentiment_twitter", "sentiment_news"],
+              outputs=[search_index.SEARCH_INDEX_PATH],
+              code=[search_index]),
+    ]
+
+
+def select_stages(stages, only=None, scrape=True):
+    by_name = {stage.name: stage for stage in stages}
+    selected = set(by_name) if not only else set(only)
+    if not scrape:
+        selected = {name for name in selected if not by_name[name].source}
+    unknown = selected - set(by_name)
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+    return [stage for stage in stages if stage.name in selected]
+
+
+def run_pipeline(stages, state_path=STATE_PATH, force=False, max_workers=4, profiler=None, profile_stages=None):
+    state = load_state(state_path)
+    names = {stage.name for stage in stages}
+    # Dependencies outside the selection are treated as already satisfied
+    remaining = {stage.name: stage for stage in stages}
+    pending_deps = {stage.name: {d for d in stage.deps if d in names} for stage in stages}
+    results = {}
+
+    def execute(stage):
+        fingerprint = None if stage.source else stage_fingerprint(stage)
+        up_to_date = (
+            not force and fingerprint is not None
+            and state.get(stage.name, {}).get("fingerprint") == fingerprint
+            and all(os.path.exists(p) for p in stage.outputs)
+        )
+        if up_to_date:
+            return "skipped", 0.0, fingerprint
+        profile_mode = profiler if not profile_stages or stage.name in profile_stages else None
+        start = time.perf_counter()
+        with instrumentation.profile(stage.name, profile_mode), instrumentation.span("stage", stage=stage.name):
+            stage.func()
+        return "ran", time.perf_counter() - start, fingerprint
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        running = {}
+        while remaining or running:
+            ready = [name for name in remaining if not pending_deps[name]]
+            for name in ready:
+                stage = remaining.pop(name)
+                print(f"[pipeline] starting {name}")
+                running[pool.submit(execute, stage)] = stage
+            if not running:
+                # Everything left depends on a failed stage
+                for name in remaining:
+                    results[name] = "blocked"
+                    print(f"[pipeline] {name}: blocked by a failed dependency")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    status, elapsed, fingerprint = future.result()
+                except Exception as e:
+                    results[stage.name] = "failed"
+                    instrumentation.inc("stage_runs_total", stage=stage.name, status="failed")
+                    print(f"[pipeline] {stage.name}: failed → {e}")
+                    continue
+                results[stage.name] = status
+                instrumentation.inc("stage_runs_total", stage=stage.name, status=status)
+                print(f"[pipeline] {stage.name}: {status}" + (f" in {elapsed:.1f}s" if status == "ran" else ""))
+                if status == "ran" and fingerprint is not None:
+                    state[stage.name] = {"fingerprint": fingerprint, "finished_at": time.time()}
+                    save_state(state, state_path)
+                for name in pending_deps:
+                    pending_deps[name].discard(stage.name)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the brand monitor pipeline")
+    parser.add_argument("--force", action="store_true", help="run every stage even if up to date")
+    parser.add_argument("--no-scrape", action="store_true", help="skip the network scraping stages")
+    parser.add_argument("--replay", action="store_true",
+                        help="rebuild raw data from the capture archive instead of scraping")
+    parser.add_argument("--stages", help="comma-separated subset of stages to run")
+    parser.add_argument("--workers", type=int, default=4, help="maximum stages running at once")
+    parser.add_argument("--cascade-band", type=float,
+                        help="let VADER decide Twitter/Reddit texts whose |compound| is at least this value")
+    parser.add_argument("--profile", choices=instrumentation.PROFILERS,
+                        help=f"profile each stage that runs and save it under {instrumentation.PROFILE_DIR}")
+    parser.add_argument("--profile-stages", help="comma-separated stages to profile (default: all)")
+    args = parser.parse_args(argv)
+
+    cache = SentimentCache()
+    dedup_indexes = {"twitter": dedup.open_index("twitter"), "news": dedup.open_index("news")}
+    stages = select_stages(
+        build_stages(cache, cascade_band=args.cascade_band, dedup_indexes=dedup_indexes, replay=args.replay),
+        only=args.stages.split(",") if args.stages else None,
+        scrape=not args.no_scrape,
+    )
+    start = time.perf_counter()
+    results = run_pipeline(stages, force=args.force, max_workers=args.workers, profiler=args.profile,
+                           profile_stages=args.profile_stages.split(",") if args.profile_stages else None)
+    stats = cache.stats()
+    cache.close()
+    for index in dedup_indexes.values():
+        index.close()
+    print(f"[pipeline] finished in {time.perf_counter() - start:.1f}s; "
+          f"sentiment cache hit rate {stats['hit_rate']:.1%}; models loaded: {models.registry.load_count}")
+    json_path, _ = instrumentation.export("pipeline")
+    print(f"[pipeline] metrics saved to '{json_path}' (Prometheus text format alongside)")
+    return 0 if all(status in ("ran", "skipped") for status in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
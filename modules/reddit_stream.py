@@ -0,0 +1,114 @@
+"""
+Streaming readers for Reddit crawl files.
+
+Posts are yielded lazily from either the JSON array written by
+fetch_reddit_leapscholar_posts_comments_json or the JSONL file written by
+crawl_reddit, so consumers run with bounded memory.
+"""
+
+import json
+
+CHUNK_SIZE = 1 << 16
+
+
+def _iter_json_array(f, chunk_size=CHUNK_SIZE):
+    decoder = json.JSONDecoder()
+    buf = f.read(chunk_size).lstrip()
+    if not buf.startswith("["):
+        raise ValueError("Expected a JSON array of posts")
+    pos = 1
+    while True:
+        # Skip separators, reading more input when the buffer runs dry
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf):
+                break
+            more = f.read(chunk_size)
+            if not more:
+                return
+            buf, pos = more, 0
+        if buf[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            more = f.read(max(chunk_size, len(buf)))
+            if not more:
+                raise
+            buf, pos = buf[pos:] + more, 0
+            continue
+        yield obj
+        pos = end
+        if pos > chunk_size:
+            buf, pos = buf[pos:], 0
+
+
+def _iter_jsonl(path, latest_only=True):
+    if not latest_only:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    # Refreshed posts are appended again; keep only the last record per post_id
+    last_line = {}
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if line.strip():
+                last_line[json.loads(line).get("post_id")] = i
+    keep = set(last_line.values())
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if i in keep:
+                yield json.loads(line)
+
+
+def iter_posts(path, latest_only=True):
+    with open(path, encoding="utf-8") as f:
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        if head == "[":
+            f.seek(0)
+            yield from _iter_json_array(f)
+            return
+    yield from _iter_jsonl(path, latest_only=latest_only)
+
+
+def comment_text(comment):
+    if isinstance(comment, str):
+        return comment
+    return comment.get("comment_text") or comment.get("body") or ""
+
+
+def iter_comments(comments, post_id=None, parent_id=None, depth=1):
+    for comment in comments or []:
+        if isinstance(comment, str):
+            yield {"post_id": post_id, "comment_id": None, "parent_id": parent_id,
+                   "depth": depth, "text": comment, "score": 0, "created_utc": None}
+            continue
+        yield {
+            "post_id": post_id,
+            "comment_id": comment.get("comment_id"),
+            "parent_id": parent_id,
+            "depth": depth,
+            "text": comment_text(comment),
+            "score": comment.get("score", 0) or 0,
+            "created_utc": comment.get("created_utc"),
+        }
+        yield from iter_comments(comment.get("replies"), post_id, comment.get("comment_id"), depth + 1)
+
+
+def iter_records(path):
+    for post in iter_posts(path):
+        post_id = post.get("post_id", "")
+        yield {
+            "type": "post",
+            "post_id": post_id,
+            "text": f"{post.get('post_title', '') or ''}\n{post.get('post_text', '') or ''}".strip(),
+            "score": post.get("post_score", 0) or 0,
+            "created_utc": post.get("created_utc"),
+        }
+        for comment in iter_comments(post.get("comments"), post_id):
+            yield dict(comment, type="comment")
@@ -1,13 +1,20 @@
 import csv
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
 import feedparser
 
-LEAP_QUERIES = [
-    'LeapScholar',
-    'LeapScholar+IELTS',
-    'LeapScholar+study+abroad',
-    'LeapScholar+review',
-    'LeapScholar+refund',
-]
+from brands import add_query, load_brands, unique_queries
+from capture import CaptureArchive, open_archive
+from instrumentation import export, inc, span
+
+# Every configured brand's news queries, each fetched once however many brands share it
+BRAND_QUERIES = list(unique_queries(load_brands(), "news"))
 
 KEYWORD_QUERIES = [
     'study+abroad',
@@ -16,55 +23,203 @@ KEYWORD_QUERIES = [
     'scholarship',
 ]
 
+RSS_BASE_URL = "https://news.google.com/rss/search"
+FEED_STATE_PATH = "data/cache/news_feed_state.json"
+MAX_WORKERS = 16
+PER_HOST_LIMIT = 4
+FIELDNAMES = ["source_name", "title", "url", "query"]
 
-leap_articles = []
-keyword_articles = []
 
-# Scrape for LEAP_QUERIES (for sentiment analysis)
-for query in LEAP_QUERIES:
-    print(f"Searching Google News RSS for LEAP query: {query}")
-    rss_url = f"https://news.google.com/rss/search?q={query}&hl=en-IN&gl=IN&ceid=IN:en"
-    feed = feedparser.parse(rss_url)
-    print(f"  Found {len(feed.entries)} articles for '{query}'")
-    for entry in feed.entries:
-        article_info = {
-            "source_name": entry.get("source", {}).get("title") if entry.get("source") else "Google News",
-            "title": entry.get("title"),
-            "url": entry.get("link"),
-        }
-        leap_articles.append(article_info)
-
-# Scrape for KEYWORD_QUERIES (for keyword extraction)
-for query in KEYWORD_QUERIES:
-    print(f"Searching Google News RSS for KEYWORD query: {query}")
-    rss_url = f"https://news.google.com/rss/search?q={query}&hl=en-IN&gl=IN&ceid=IN:en"
-    feed = feedparser.parse(rss_url)
-    print(f"  Found {len(feed.entries)} articles for '{query}'")
+def build_rss_url(query, base_url=RSS_BASE_URL):
+    return f"{base_url}?q={query}&hl=en-IN&gl=IN&ceid=IN:en"
+
+
+def load_feed_state(path=FEED_STATE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_feed_state(state, path=FEED_STATE_PATH):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def parse_articles(content):
+    feed = feedparser.parse(content)
+    articles = []
     for entry in feed.entries:
-        article_info = {
+        articles.append({
             "source_name": entry.get("source", {}).get("title") if entry.get("source") else "Google News",
             "title": entry.get("title"),
             "url": entry.get("link"),
-        }
-        keyword_articles.append(article_info)
-
-# Save LEAP articles for sentiment analysis
-leap_filename = "data/raw/leapscholar_news_leap.csv"
-with open(leap_filename, mode="w", encoding="utf-8", newline="") as csv_file:
-    fieldnames = ["source_name", "title", "url"]
-    writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-    writer.writeheader()
-    for article in leap_articles:
-        writer.writerow(article)
-print(f"Saved {len(leap_articles)} LEAP news articles to '{leap_filename}'")
-
-# Save KEYWORD articles for keyword extraction
-keyword_filename = "data/raw/leapscholar_news_keywords.csv"
-with open(keyword_filename, mode="w", encoding="utf-8", newline="") as csv_file:
-    fieldnames = ["source_name", "title", "url"]
-    writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-    writer.writeheader()
-    for article in keyword_articles:
-        writer.writerow(article)
-print(f"Saved {len(keyword_articles)} KEYWORD news articles to '{keyword_filename}'")
+        })
+    return articles
+
+
+class HostLimiter:
+    def __init__(self, per_host_limit=PER_HOST_LIMIT):
+        self.per_host_limit = per_host_limit
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._semaphores[host]
+
+
+def fetch_feed(url, cached, limiter, timeout=30, archive=None):
+    headers = {"User-Agent": "LeapBrandMonitor/1.0"}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("modified"):
+        headers["If-Modified-Since"] = cached["modified"]
+    request = urllib.request.Request(url, headers=headers)
+    with limiter(url), span("fetch", source="news"):
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                content = response.read()
+                etag = response.headers.get("ETag")
+                modified = response.headers.get("Last-Modified")
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                # Unchanged since the last run: reuse the stored articles without parsing
+                inc("fetch_responses_total", source="news", status=304)
+                return dict(cached, status=304)
+            raise
+    inc("fetch_responses_total", source="news", status=200)
+    inc("fetch_bytes_total", len(content), source="news")
+    if archive is not None:
+        archive.put("news", url, content.decode("utf-8", errors="replace"),
+                    meta={"etag": etag, "modified": modified})
+    with span("parse", source="news"):
+        articles = parse_articles(content)
+    return {
+        "etag": etag,
+        "modified": modified,
+        "articles": articles,
+        "status": 200,
+    }
+
+
+def fetch_all(urls, state, max_workers=MAX_WORKERS, per_host_limit=PER_HOST_LIMIT, archive=None):
+    limiter = HostLimiter(per_host_limit)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(fetch_feed, url, state.get(url, {}), limiter, archive=archive): url for url in urls}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                results[url] = future.result()
+            except Exception as e:
+                inc("scrape_errors_total", source="news")
+                print(f"Error fetching {url} → {e}")
+                results[url] = dict(state.get(url, {"articles": []}), status=None)
+    return results
+
+
+def replay_all(urls, archive, since=None, until=None):
+    # Every archived capture of each feed goes back through parse_articles, so a
+    # replay sees the union of what the feeds returned over time
+    results = {url: {"articles": [], "status": None} for url in urls}
+    for capture, content in archive.replay("news", keys=list(urls), since=since, until=until):
+        result = results[capture["key"]]
+        result["articles"].extend(parse_articles(content))
+        result["status"] = 200
+    return results
+
+
+def dedupe_articles(articles):
+    # An article several queries returned is kept once, listing every query for brand routing
+    unique = {}
+    for article in articles:
+        key = article.get("url") or article.get("title")
+        if key in unique:
+            unique[key]["query"] = add_query(unique[key].get("query"), article.get("query"))
+            continue
+        unique[key] = dict(article)
+    return list(unique.values())
+
+
+def collect_articles(label, queries, results, base_url=RSS_BASE_URL):
+    articles = []
+    for query in queries:
+        result = results[build_rss_url(query, base_url)]
+        status = "not modified" if result.get("status") == 304 else "found"
+        print(f"  {label} query '{query}': {status} {len(result.get('articles', []))} articles")
+        # The query lets brand routing fall back to whoever asked for it
+        articles.extend(dict(article, query=query) for article in result.get("articles", []))
+    return dedupe_articles(articles)
+
+
+def save_articles(articles, filename):
+    with span("file_write", items=len(articles), stage="scrape_news"), \
+            open(filename, mode="w", encoding="utf-8", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for article in articles:
+            writer.writerow(article)
+
+
+def scrape_news(
+    leap_filename="data/raw/leapscholar_news_leap.csv",
+    keyword_filename="data/raw/leapscholar_news_keywords.csv",
+    base_url=RSS_BASE_URL,
+    state_path=FEED_STATE_PATH,
+    max_workers=MAX_WORKERS,
+    per_host_limit=PER_HOST_LIMIT,
+    archive=None,
+    replay=False,
+):
+    state = load_feed_state(state_path)
+    urls = list(dict.fromkeys(build_rss_url(q, base_url) for q in BRAND_QUERIES + KEYWORD_QUERIES))
+    own_archive = archive is None
+    if own_archive:
+        archive = CaptureArchive() if replay else open_archive()
+    try:
+        if replay:
+            print(f"Replaying {len(urls)} Google News RSS feeds from the capture archive...")
+            results = replay_all(urls, archive)
+        else:
+            print(f"Fetching {len(urls)} Google News RSS feeds...")
+            results = fetch_all(urls, state, max_workers=max_workers, per_host_limit=per_host_limit,
+                                archive=archive)
+    finally:
+        if own_archive and archive is not None:
+            archive.close()
+
+    # Save brand articles for sentiment analysis
+    leap_articles = collect_articles("BRAND", BRAND_QUERIES, results, base_url)
+    save_articles(leap_articles, leap_filename)
+    print(f"Saved {len(leap_articles)} brand news articles to '{leap_filename}'")
+
+    # Save KEYWORD articles for keyword extraction
+    keyword_articles = collect_articles("KEYWORD", KEYWORD_QUERIES, results, base_url)
+    save_articles(keyword_articles, keyword_filename)
+    print(f"Saved {len(keyword_articles)} KEYWORD news articles to '{keyword_filename}'")
+
+    if replay:
+        # Conditional-request state only tracks what the live feeds last returned
+        return leap_articles, keyword_articles
+    for url, result in results.items():
+        if result.get("status") is not None:
+            state[url] = {
+                "etag": result.get("etag"),
+                "modified": result.get("modified"),
+                "articles": result.get("articles", []),
+            }
+    save_feed_state(state, state_path)
+    return leap_articles, keyword_articles
+
 
+if __name__ == "__main__":
+    scrape_news()
+    export("scrape_news")
@@ -1,21 +1,36 @@
 import praw
 import os
+import sys
+import time
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
+from brands import add_query, load_brands, split_queries, unique_queries
+from capture import CaptureArchive, open_archive
+from instrumentation import export, inc, span
 load_dotenv()
 
-reddit = praw.Reddit(
-    client_id = os.getenv("REDDIT_CLIENT_ID"),
-    client_secret = os.getenv("REDDIT_SECRET"),
-    password = os.getenv("REDDIT_PASSWORD"),
-    user_agent = os.getenv("REDDIT_USER_AGENT"),
-    username  = os.getenv("REDDIT_USERNAME"),
-)
 
-reddit.read_only = True
+def make_reddit():
+    reddit = praw.Reddit(
+        client_id = os.getenv("REDDIT_CLIENT_ID"),
+        client_secret = os.getenv("REDDIT_SECRET"),
+        password = os.getenv("REDDIT_PASSWORD"),
+        user_agent = os.getenv("REDDIT_USER_AGENT"),
+        username  = os.getenv("REDDIT_USERNAME"),
+    )
+    reddit.read_only = True
+    return reddit
 
 
 import json
 
+CRAWL_JSONL = "data/raw/reddit_leapscholar.jsonl"
+CRAWL_STATE_PATH = "data/cache/reddit_crawl_state.json"
+STATE_SAVE_EVERY = 50
+# Every configured brand's queries, each searched once however many brands share it
+QUERIES = list(unique_queries(load_brands(), "reddit"))
+
 def get_comment_tree(comment, max_depth=3, cur_depth=1):
     if cur_depth > max_depth:
         return None
@@ -34,33 +49,202 @@ def get_comment_tree(comment, max_depth=3, cur_depth=1):
                 comment_data['replies'].append(child)
     return comment_data
 
-def fetch_reddit_leapscholar_posts_comments_json(output_json, max_posts=50, max_comments=20, max_depth=3):
-    query = "leapscholar"
-    posts = reddit.subreddit("all").search(query, sort="new", limit=max_posts)
-    data = []
-    for post in posts:
-        post_dict = {
-            'post_id': post.id,
-            'post_title': post.title,
-            'post_text': post.selftext,
-            'post_url': post.url,
-            'post_score': post.score,
-            'post_num_comments': post.num_comments,
-            'created_utc': post.created_utc,
-            'author': str(post.author),
-            'comments': []
-        }
+def get_post_dict(post, query=None):
+    return {
+        'post_id': post.id,
+        'query': query,
+        'post_title': post.title,
+        'post_text': post.selftext,
+        'post_url': post.url,
+        'post_score': post.score,
+        'post_num_comments': post.num_comments,
+        'created_utc': post.created_utc,
+        'author': str(post.author),
+        'comments': []
+    }
+
+
+def get_comment_forest(post, max_comments=20, max_depth=3):
+    # PRAW fetches the comment listing lazily, so the span covers the network round trips
+    with span('fetch', source='reddit_comments'):
         post.comments.replace_more(limit=0)
+        trees = []
         for i, comment in enumerate(post.comments):
             if i >= max_comments:
                 break
             comment_tree = get_comment_tree(comment, max_depth=max_depth)
             if comment_tree:
-                post_dict['comments'].append(comment_tree)
-        data.append(post_dict)
-    with open(output_json, 'w', encoding='utf-8') as f:
+                trees.append(comment_tree)
+    inc('items_processed_total', len(trees), stage='scrape_reddit')
+    return trees
+
+
+class PrawSource:
+    # PRAW instances are not thread-safe, so each worker thread gets its own client
+    def __init__(self, reddit_factory=make_reddit):
+        self.reddit_factory = reddit_factory
+        self._local = threading.local()
+
+    def _reddit(self):
+        if not hasattr(self._local, "reddit"):
+            self._local.reddit = self.reddit_factory()
+        return self._local.reddit
+
+    def search(self, query, limit):
+        return self._reddit().subreddit("all").search(query, sort="new", limit=limit)
+
+    def comments(self, post_id, max_comments, max_depth):
+        submission = self._reddit().submission(id=post_id)
+        return get_comment_forest(submission, max_comments=max_comments, max_depth=max_depth)
+
+
+def replay_posts(archive, since=None, until=None):
+    # PRAW hides the raw listings, so the archive keeps each post tree as built above;
+    # the newest capture of a post wins, ordered newest first like a sort="new" search
+    posts = [post for _, post in archive.replay('reddit', since=since, until=until, latest=True)]
+    return sorted(posts, key=lambda post: post['created_utc'], reverse=True)
+
+
+def fetch_reddit_leapscholar_posts_comments_json(output_json, max_posts=50, max_comments=20, max_depth=3,
+                                                 archive=None, replay=False):
+    own_archive = archive is None
+    if own_archive:
+        archive = CaptureArchive() if replay else open_archive()
+    try:
+        if replay:
+            data = replay_posts(archive)
+            print(f"Replayed {len(data)} Reddit posts from the capture archive")
+        else:
+            reddit = make_reddit()
+            posts = {}
+            for query in QUERIES:
+                for post in reddit.subreddit("all").search(query, sort="new", limit=max_posts):
+                    # A post matching several queries is crawled once, listing every query for brand routing
+                    found_by, _ = posts.get(post.id, (None, post))
+                    posts[post.id] = (add_query(found_by, query), post)
+            data = []
+            for query, post in posts.values():
+                post_dict = get_post_dict(post, query)
+                post_dict['comments'] = get_comment_forest(post, max_comments=max_comments, max_depth=max_depth)
+                if archive is not None:
+                    archive.put('reddit', post_dict['post_id'], post_dict)
+                data.append(post_dict)
+    finally:
+        if own_archive and archive is not None:
+            archive.close()
+    with span('file_write', items=len(data), stage='scrape_reddit'), open(output_json, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 
+def load_crawl_state(path=CRAWL_STATE_PATH):
+    if not os.path.exists(path):
+        return {'newest_by_query': {}, 'posts': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_crawl_state(state, path=CRAWL_STATE_PATH):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def crawl_reddit(output_jsonl=CRAWL_JSONL, state_path=CRAWL_STATE_PATH, source=None, queries=QUERIES,
+                 max_posts=1000, max_comments=20, max_depth=3, max_workers=8, archive=None):
+    source = source or PrawSource()
+    own_archive = archive is None
+    if own_archive:
+        archive = open_archive()
+    state = load_crawl_state(state_path)
+    seen = state['posts']
+    # Watermarks are per query, so a query added for a new brand is crawled back to its start
+    newest = state.setdefault('newest_by_query', {})
+
+    def crawl_post(post_dict):
+        post_dict['comments'] = source.comments(post_dict['post_id'], max_comments, max_depth)
+        post_dict['crawled_at'] = time.time()
+        return post_dict
+
+    written = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool, \
+            open(output_jsonl, 'a', encoding='utf-8') as out:
+        in_flight = set()
+        failed = set()
+        unsaved = 0
+
+        def drain(return_when):
+            nonlocal in_flight, written, unsaved
+            done, in_flight = wait(in_flight, return_when=return_when)
+            for future in done:
+                try:
+                    post_dict = future.result()
+                except Exception as e:
+                    inc('scrape_errors_total', source='reddit')
+                    print(f"Error crawling comments → {e}")
+                    # Every query that found the post keeps its watermark
+                    failed.update(future.queries)
+                    continue
+                if archive is not None:
+                    # crawled_at changes every crawl; keep it out so unchanged trees dedupe
+                    archive.put('reddit', post_dict['post_id'],
+                                {k: v for k, v in post_dict.items() if k != 'crawled_at'},
+                                captured_at=post_dict['crawled_at'])
+                # One record per finished post, flushed so a crash loses at most in-flight posts
+                out.write(json.dumps(post_dict, ensure_ascii=False) + '\n')
+                out.flush()
+                seen[post_dict['post_id']] = post_dict['post_num_comments']
+                written += 1
+                unsaved += 1
+                # Losing these on a crash only means recrawling a few posts, so save in batches
+                if unsaved >= STATE_SAVE_EVERY:
+                    save_crawl_state(state, state_path)
+                    unsaved = 0
+
+        # Every query is searched before crawling, so a post several queries return is crawled
+        # once and its record lists them all for brand routing
+        to_crawl = {}
+        newest_found = {}
+        for query in queries:
+            watermark = newest.get(query, 0)
+            newest_found[query] = watermark
+            for post in source.search(query, max_posts):
+                newest_found[query] = max(newest_found[query], post.created_utc)
+                if post.id in to_crawl:
+                    to_crawl[post.id]['query'] = add_query(to_crawl[post.id]['query'], query)
+                    continue
+                known = seen.get(post.id)
+                if known is None and post.created_utc <= watermark:
+                    continue
+                if known is not None and known == post.num_comments:
+                    continue
+                to_crawl[post.id] = get_post_dict(post, query)
+        for post_dict in to_crawl.values():
+            future = pool.submit(crawl_post, post_dict)
+            future.queries = split_queries(post_dict['query'])
+            in_flight.add(future)
+            # Keep a bounded number of posts in memory
+            if len(in_flight) >= max_workers * 2:
+                drain(FIRST_COMPLETED)
+        while in_flight:
+            drain(FIRST_COMPLETED)
+        # sort="new" finishes the newest posts first, so a watermark may only move once every
+        # older post is written; a failed post keeps its queries' watermarks where they were
+        for query, found in newest_found.items():
+            if query not in failed:
+                newest[query] = found
+        save_crawl_state(state, state_path)
+    if own_archive and archive is not None:
+        archive.close()
+    print(f"Crawled {written} new or updated Reddit posts into '{output_jsonl}'")
+    return written
+
+
 if __name__ == "__main__":
-    fetch_reddit_leapscholar_posts_comments_json("data/raw/reddit_leapscholar.json")
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "crawl":
+        crawl_reddit()
+    else:
+        fetch_reddit_leapscholar_posts_comments_json("data/raw/reddit_leapscholar.json")
+    export("scrape_reddit")
\ No newline at end of file
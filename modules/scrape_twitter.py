@@ -1,76 +1,288 @@
 import tweepy
+import requests
 import time
 import os
 import csv
+import json
 from datetime import datetime
 from dotenv import load_dotenv
+from brands import add_query, load_brands, unique_queries
+from capture import CaptureArchive, open_archive
+from instrumentation import export, inc, span
 
 load_dotenv()
 
 # ====== CONFIG ======
 BEARER_TOKEN = os.getenv("X_BEARER_TOKEN")
 
-client = tweepy.Client(bearer_token=BEARER_TOKEN)
+# Every configured brand's queries, in priority order, each searched once however many brands share it
+QUERIES = list(unique_queries(load_brands(), "twitter"))
 
-# Define your prioritized queries
-QUERIES = [
-    '"LeapScholar" lang:en -is:retweet',
-    '"LeapScholar" "IELTS" lang:en -is:retweet',
-    '"LeapScholar" "study abroad" lang:en -is:retweet',
-    '"LeapScholar" "review" lang:en -is:retweet',
-    '"LeapScholar" refund lang:en -is:retweet'
+# Recent search returns between 10 and 100 tweets per page
+TWEETS_PER_PAGE = 100
+MAX_PAGES_PER_QUERY = 10
+
+TWEETS_CSV = "data/raw/leapscholar_tweets.csv"
+STATE_PATH = "data/cache/twitter_state.json"
+FIELDNAMES = [
+    "id", "query", "author_id", "created_at", "text",
+    "like_count", "retweet_count", "reply_count", "quote_count"
 ]
 
-# Total max tweets to fetch (across all queries)
-MAX_TOTAL_TWEETS = 100
-TWEETS_PER_QUERY = MAX_TOTAL_TWEETS // len(QUERIES)
-
-# Store results
-all_tweets = []
-
-for query in QUERIES:
-    print(f"\nSearching for: {query}")
-    try:
-        tweets = client.search_recent_tweets(
-            query=query,
-            tweet_fields=["created_at", "author_id", "public_metrics", "text"],
-            max_results=TWEETS_PER_QUERY
-        )
-    except Exception as e:
-        print(f"Error fetching tweets for query: {query} → {e}")
-        continue
-
-    if tweets.data:
-        for tweet in tweets.data:
-            tweet_info = {
-                "query": query,
-                "author_id": tweet.author_id,
-                "created_at": tweet.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-                "text": tweet.text.replace("\n", " ").strip(),
-                "like_count": tweet.public_metrics["like_count"],
-                "retweet_count": tweet.public_metrics["retweet_count"],
-                "reply_count": tweet.public_metrics["reply_count"],
-                "quote_count": tweet.public_metrics["quote_count"]
-            }
-            all_tweets.append(tweet_info)
-    else:
-        print("No tweets found.")
-
-    time.sleep(900)  # Avoid hitting rate limit
-
-# ====== SAVE TO CSV ======
-
-filename = f"data/raw/leapscholar_tweets_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-
-with open(filename, mode="w", encoding="utf-8", newline="") as csv_file:
-    fieldnames = [
-        "query", "author_id", "created_at", "text",
-        "like_count", "retweet_count", "reply_count", "quote_count"
-    ]
-    writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-    writer.writeheader()
-    for tweet in all_tweets:
-        writer.writerow(tweet)
-
-print(f"\nSaved {len(all_tweets)} tweets to '{filename}'")
 
+def make_client(bearer_token=BEARER_TOKEN):
+    # Raw responses keep the x-rate-limit-* headers that tweepy.Response drops
+    return tweepy.Client(bearer_token=bearer_token, return_type=requests.Response)
+
+
+# Used when a 429 carries no usable reset time: doubles per consecutive 429, capped at the 15-minute window
+BACKOFF_START = 5
+RATE_LIMIT_WINDOW = 15 * 60
+
+
+class RateLimitScheduler:
+    def __init__(self, sleep=time.sleep, clock=time.time):
+        self.sleep = sleep
+        self.clock = clock
+        self.remaining = None
+        self.reset_at = None
+        self.backoff = 0
+
+    def update(self, headers):
+        remaining = headers.get("x-rate-limit-remaining")
+        reset_at = headers.get("x-rate-limit-reset")
+        if remaining is not None:
+            self.remaining = int(remaining)
+        if reset_at is not None:
+            self.reset_at = int(reset_at)
+
+    def exhaust(self, headers):
+        self.update(headers)
+        self.remaining = 0
+        if headers.get("x-rate-limit-reset") is None or self.reset_at <= self.clock():
+            # No reset time to wait for; back off instead of retrying at once
+            self.backoff = min(max(self.backoff * 2, BACKOFF_START), RATE_LIMIT_WINDOW)
+            self.reset_at = self.clock() + self.backoff
+
+    def wait(self):
+        # Only sleep when the window's budget is actually used up
+        if self.remaining is None or self.remaining > 0 or self.reset_at is None:
+            return
+        delay = self.reset_at - self.clock() + 1
+        if delay > 0:
+            print(f"Rate limit reached, sleeping {delay:.0f}s until window resets")
+            self.sleep(delay)
+        self.remaining = None
+
+
+def load_state(path=STATE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state, path=STATE_PATH):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+
+
+def parse_tweet(query, tweet):
+    created_at = datetime.strptime(tweet["created_at"][:19], "%Y-%m-%dT%H:%M:%S")
+    metrics = tweet.get("public_metrics", {})
+    return {
+        "id": tweet.get("id"),
+        "query": query,
+        "author_id": tweet.get("author_id"),
+        "created_at": created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        "text": tweet.get("text", "").replace("\n", " ").strip(),
+        "like_count": metrics.get("like_count", 0),
+        "retweet_count": metrics.get("retweet_count", 0),
+        "reply_count": metrics.get("reply_count", 0),
+        "quote_count": metrics.get("quote_count", 0)
+    }
+
+
+def search_page(client, scheduler, archive=None, **params):
+    while True:
+        with span("rate_limit_wait", source="twitter"):
+            scheduler.wait()
+        try:
+            with span("fetch", source="twitter"):
+                response = client.search_recent_tweets(**params)
+        except tweepy.TooManyRequests as e:
+            inc("fetch_responses_total", source="twitter", status=429)
+            scheduler.exhaust(e.response.headers)
+            continue
+        if getattr(response, "status_code", 200) == 429:
+            inc("fetch_responses_total", source="twitter", status=429)
+            scheduler.exhaust(response.headers)
+            continue
+        inc("fetch_responses_total", source="twitter", status=getattr(response, "status_code", 200))
+        scheduler.update(response.headers)
+        scheduler.backoff = 0
+        payload = response.json()
+        if archive is not None:
+            archive.put("twitter", params["query"], payload,
+                        meta={k: params[k] for k in ("since_id", "next_token") if k in params})
+        return payload
+
+
+def fetch_query(client, query, scheduler, since_id=None, per_page=TWEETS_PER_PAGE, max_pages=MAX_PAGES_PER_QUERY,
+                archive=None):
+    tweets = []
+    newest_id = since_id
+    next_token = None
+    for page in range(max_pages):
+        params = {
+            "query": query,
+            "tweet_fields": ["created_at", "author_id", "public_metrics", "text"],
+            "max_results": per_page,
+        }
+        if since_id:
+            params["since_id"] = since_id
+        if next_token:
+            params["next_token"] = next_token
+        payload = search_page(client, scheduler, archive=archive, **params)
+        meta = payload.get("meta", {})
+        # Results come newest first, so the first page carries the new high-water mark
+        if page == 0 and meta.get("newest_id"):
+            newest_id = meta["newest_id"]
+        tweets.extend(parse_tweet(query, tweet) for tweet in payload.get("data", []))
+        next_token = meta.get("next_token")
+        if not next_token:
+            break
+    return tweets, newest_id
+
+
+def upgrade_header(filename=TWEETS_CSV):
+    # Files written before tweet ids were kept get the current columns, old rows with a blank id
+    with open(filename, encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames is None or reader.fieldnames == FIELDNAMES:
+            return
+        rows = list(reader)
+    tmp_path = filename + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, filename)
+
+
+def append_tweets(tweets, filename=TWEETS_CSV):
+    write_header = not os.path.exists(filename) or os.path.getsize(filename) == 0
+    if not write_header:
+        upgrade_header(filename)
+    with span("file_write", items=len(tweets), stage="scrape_twitter"), \
+            open(filename, mode="a", encoding="utf-8", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
+        if write_header:
+            writer.writeheader()
+        for tweet in tweets:
+            writer.writerow(tweet)
+
+
+def content_key(tweet):
+    return tweet["author_id"], tweet["created_at"], tweet["text"]
+
+
+def tweet_key(tweet):
+    # Rows written before ids were kept fall back to what identified a tweet then
+    return tweet.get("id") or content_key(tweet)
+
+
+def is_known(tweet, keys):
+    return tweet_key(tweet) in keys or content_key(tweet) in keys
+
+
+def load_tweet_keys(filename=TWEETS_CSV):
+    """Key of every tweet already in the file: its id, or its content for rows that have none."""
+    if not os.path.exists(filename):
+        return set()
+    with open(filename, encoding="utf-8", newline="") as f:
+        return {tweet_key(row) for row in csv.DictReader(f)}
+
+
+def replay_tweets(archive, queries=QUERIES, filename=TWEETS_CSV, since=None, until=None):
+    # Rebuilds the tweets file from every archived search page, through the same parse_tweet
+    by_id = {}
+    for capture, payload in archive.replay("twitter", keys=list(queries), since=since, until=until):
+        for tweet in payload.get("data", []):
+            # Overlapping queries return the same tweet; it is kept once, listing every query
+            if tweet.get("id") in by_id:
+                by_id[tweet.get("id")]["query"] = add_query(by_id[tweet.get("id")]["query"], capture["key"])
+                continue
+            by_id[tweet.get("id")] = parse_tweet(capture["key"], tweet)
+    tweets = list(by_id.values())
+    # Tweets scraped before capture was enabled, or outside since/until, exist only in the file
+    replayed = {t["id"] for t in tweets} | {content_key(t) for t in tweets}
+    missing = load_tweet_keys(filename) - replayed
+    if missing:
+        raise RuntimeError(f"'{filename}' has {len(missing)} tweets the capture archive does not cover; "
+                           f"replay into another file instead of replacing it")
+    tmp_path = filename + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    append_tweets(tweets, tmp_path)
+    os.replace(tmp_path, filename)
+    print(f"Replayed {len(tweets)} tweets from the capture archive into '{filename}'")
+    return len(tweets)
+
+
+def scrape_twitter(client=None, queries=QUERIES, filename=TWEETS_CSV, state_path=STATE_PATH, scheduler=None,
+                   archive=None, replay=False):
+    own_archive = archive is None
+    if own_archive:
+        archive = CaptureArchive() if replay else open_archive()
+    if replay:
+        try:
+            return replay_tweets(archive, queries, filename)
+        finally:
+            if own_archive:
+                archive.close()
+    client = client or make_client()
+    scheduler = scheduler or RateLimitScheduler()
+    state = load_state(state_path)
+    # since_id is per query, so another query, or a reset state file, can fetch a tweet already written
+    seen = load_tweet_keys(filename)
+    fresh = {}
+    newest = {}
+    for query in queries:
+        print(f"\nSearching for: {query}")
+        try:
+            tweets, newest_id = fetch_query(client, query, scheduler, since_id=state.get(query), archive=archive)
+        except Exception as e:
+            inc("scrape_errors_total", source="twitter")
+            print(f"Error fetching tweets for query: {query} → {e}")
+            continue
+        found = 0
+        for tweet in tweets:
+            key = tweet_key(tweet)
+            if key in fresh:
+                # Matched by several queries this run: written once, listing every query for brand routing
+                fresh[key]["query"] = add_query(fresh[key]["query"], query)
+            elif not is_known(tweet, seen):
+                fresh[key] = tweet
+                found += 1
+        print(f"  {found} new tweets" if found else "No new tweets found.")
+        if newest_id:
+            newest[query] = newest_id
+    # Written once every query is in, so a row can list all its queries; since_ids only move
+    # after the write, so an interrupted run refetches rather than loses tweets
+    if fresh:
+        append_tweets(list(fresh.values()), filename)
+    if newest:
+        state.update(newest)
+        save_state(state, state_path)
+    if own_archive and archive is not None:
+        archive.close()
+    print(f"\nAppended {len(fresh)} tweets to '{filename}'")
+    return len(fresh)
+
+
+if __name__ == "__main__":
+    scrape_twitter()
+    export("scrape_twitter")
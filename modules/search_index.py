@@ -0,0 +1,272 @@
+"""
+Full-text search index over processed mentions.
+
+Tweets, news titles and Reddit posts/comments are upserted into SQLite next to
+their sentiment labels and indexed with FTS5, so the dashboard can answer
+keyword queries with platform, sentiment and date filters without loading the
+CSVs. Source files that have not changed since the last update are skipped and
+only new or changed rows are rewritten.
+"""
+
+import csv
+import hashlib
+import itertools
+import os
+import re
+import sqlite3
+import sys
+import threading
+from datetime import date, datetime, timezone
+
+from instrumentation import span
+
+SEARCH_INDEX_PATH = "data/warehouse/search.sqlite"
+PROCESSED_DIR = "data/processed"
+PAGE_SIZE = 20
+CHUNK_SIZE = 5000
+# Snippet markers the dashboard swaps for highlighting after escaping the text
+HIGHLIGHT_START, HIGHLIGHT_END = "\x02", "\x03"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    doc_key TEXT NOT NULL UNIQUE,
+    platform TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    title TEXT,
+    text TEXT,
+    url TEXT,
+    sentiment TEXT,
+    created_at TEXT,
+    date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS docs_date ON docs (date);
+CREATE INDEX IF NOT EXISTS docs_platform_sentiment ON docs (platform, sentiment, date);
+CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(
+    title, text, content='docs', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS docs_ai AFTER INSERT ON docs BEGIN
+    INSERT INTO docs_fts (rowid, title, text) VALUES (new.id, new.title, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS docs_ad AFTER DELETE ON docs BEGIN
+    INSERT INTO docs_fts (docs_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS docs_au AFTER UPDATE ON docs BEGIN
+    INSERT INTO docs_fts (docs_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+    INSERT INTO docs_fts (rowid, title, text) VALUES (new.id, new.title, new.text);
+END;
+CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL);
+"""
+
+# Only rows whose searchable fields or label changed are rewritten (and re-indexed)
+UPSERT = """
+INSERT INTO docs (doc_key, platform, kind, title, text, url, sentiment, created_at, date)
+VALUES (:doc_key, :platform, :kind, :title, :text, :url, :sentiment, :created_at, :date)
+ON CONFLICT (doc_key) DO UPDATE SET
+    title = excluded.title, text = excluded.text, url = excluded.url,
+    sentiment = excluded.sentiment, created_at = excluded.created_at
+WHERE docs.title IS NOT excluded.title OR docs.text IS NOT excluded.text
+    OR docs.url IS NOT excluded.url OR docs.sentiment IS NOT excluded.sentiment
+"""
+
+
+def _key(*parts):
+    return hashlib.sha1("\x1f".join(str(p or "") for p in parts).encode("utf-8")).hexdigest()
+
+
+def _from_unix(value):
+    try:
+        return datetime.fromtimestamp(float(value), tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        return None
+
+
+def _doc(platform, kind, doc_key, title, text, url, sentiment, created_at):
+    # Rows without a timestamp (news headlines) are dated by the day they were first indexed
+    return {
+        "doc_key": f"{platform}:{kind}:{doc_key}",
+        "platform": platform,
+        "kind": kind,
+        "title": title or None,
+        "text": text or None,
+        "url": url or None,
+        "sentiment": sentiment or None,
+        "created_at": created_at or None,
+        "date": (created_at or date.today().isoformat())[:10],
+    }
+
+
+def tweet_doc(row):
+    content_key = _key(row.get("author_id"), row.get("created_at"), row.get("text"))
+    if not row.get("id"):
+        # Rows scraped before tweet ids were kept
+        return _doc("Twitter", "tweet", content_key, None, row.get("text"), None, row.get("sentiment"),
+                    row.get("created_at"))
+    doc = _doc("Twitter", "tweet", row["id"], None, row.get("text"), None, row.get("sentiment"), row.get("created_at"))
+    # The doc this tweet had while it was keyed by content is dropped
+    doc["replaces"] = f"Twitter:tweet:{content_key}"
+    return doc
+
+
+def news_doc(row):
+    return _doc("News", "news", row.get("url") or _key(row.get("title")),
+                row.get("title"), None, row.get("url"), row.get("sentiment"), None)
+
+
+def reddit_post_doc(row):
+    post_id = row.get("post_id")
+    return _doc("Reddit", "post", post_id, row.get("title"), row.get("body"),
+                f"https://www.reddit.com/comments/{post_id}" if post_id else None,
+                row.get("sentiment"), _from_unix(row.get("created_utc")))
+
+
+def reddit_comment_doc(row):
+    # Post rows in the node file are already indexed from reddit_sentiment.csv
+    if not row.get("comment_id"):
+        return None
+    post_id, comment_id = row.get("post_id"), row.get("comment_id")
+    return _doc("Reddit", "comment", comment_id, None, row.get("text"),
+                f"https://www.reddit.com/comments/{post_id}/_/{comment_id}",
+                row.get("sentiment"), _from_unix(row.get("created_utc")))
+
+
+SOURCES = {
+    "twitter_sentiment.csv": tweet_doc,
+    "news_sentiment.csv": news_doc,
+    "reddit_sentiment.csv": reddit_post_doc,
+    "reddit_comment_sentiment.csv": reddit_comment_doc,
+}
+
+
+def _upsert(conn, docs):
+    replaced = [(doc["replaces"],) for doc in docs if doc.get("replaces")]
+    if replaced:
+        conn.executemany("DELETE FROM docs WHERE doc_key = ?", replaced)
+    return conn.executemany(UPSERT, docs).rowcount
+
+
+def match_query(text):
+    # Quote every term so punctuation in user input can't break FTS5 syntax;
+    # the last term is a prefix so partially typed words still match
+    terms = re.findall(r"\w+", text or "")
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+class SearchIndex:
+    def __init__(self, path=SEARCH_INDEX_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        # The dashboard reads while the pipeline writes; WAL keeps readers unblocked
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self._lock = threading.Lock()
+
+    def update_from_csv(self, csv_path, to_doc, force=False):
+        stat = os.stat(csv_path)
+        name = os.path.basename(csv_path)
+        with self._lock:
+            seen = self.conn.execute("SELECT mtime, size FROM sources WHERE name = ?", (name,)).fetchone()
+            if not force and seen and (seen["mtime"], seen["size"]) == (stat.st_mtime, stat.st_size):
+                return 0
+            changed = 0
+            with open(csv_path, encoding="utf-8", newline="") as f:
+                reader = csv.DictReader(f)
+                while True:
+                    chunk = list(itertools.islice(reader, CHUNK_SIZE))
+                    if not chunk:
+                        break
+                    docs = [doc for doc in map(to_doc, chunk) if doc]
+                    changed += _upsert(self.conn, docs)
+            self.conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)", (name, stat.st_mtime, stat.st_size))
+            self.conn.commit()
+        return changed
+
+    def add_docs(self, docs):
+        with self._lock:
+            changed = _upsert(self.conn, [doc for doc in docs if doc])
+            self.conn.commit()
+        return changed
+
+    def update(self, processed_dir=PROCESSED_DIR, force=False):
+        changed = {}
+        for name, to_doc in SOURCES.items():
+            path = os.path.join(processed_dir, name)
+            if os.path.exists(path):
+                changed[name] = self.update_from_csv(path, to_doc, force=force)
+        return changed
+
+    def search(self, query=None, platforms=None, sentiments=None, start=None, end=None,
+               page=0, page_size=PAGE_SIZE, order="relevance"):
+        """Returns one page of matching mentions and whether another page follows."""
+        where, params = [], []
+        match = match_query(query)
+        if match:
+            where.append("docs_fts MATCH ?")
+            params.append(match)
+        for column, values in (("d.platform", platforms), ("d.sentiment", sentiments)):
+            if values:
+                where.append(f"{column} IN ({','.join('?' * len(values))})")
+                params.extend(values)
+        if start:
+            where.append("d.date >= ?")
+            params.append(str(start))
+        if end:
+            where.append("d.date <= ?")
+            params.append(str(end))
+        if match:
+            source = "docs_fts JOIN docs d ON d.id = docs_fts.rowid"
+            snippet = (f"snippet(docs_fts, -1, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', 24)")
+            ordering = "rank" if order == "relevance" else "d.date DESC, d.id DESC"
+        else:
+            source = "docs d"
+            snippet = "substr(coalesce(d.text, d.title), 1, 200)"
+            ordering = "d.date DESC, d.id DESC"
+        sql = (f"SELECT d.platform, d.kind, d.title, d.text, d.url, d.sentiment, d.created_at, d.date, "
+               f"{snippet} AS snippet FROM {source}"
+               + (f" WHERE {' AND '.join(where)}" if where else "")
+               + f" ORDER BY {ordering} LIMIT ? OFFSET ?")
+        # Fetch one extra row instead of counting every match, which gets slow for common terms
+        params.extend([page_size + 1, page * page_size])
+        with self._lock, span("search_query", mode="match" if match else "filter"):
+            rows = [dict(row) for row in self.conn.execute(sql, params)]
+        return rows[:page_size], len(rows) > page_size
+
+    def count(self):
+        with self._lock:
+            return self.conn.execute("SELECT count(*) FROM docs").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def update_index(processed_dir=PROCESSED_DIR, path=SEARCH_INDEX_PATH, force=False):
+    index = SearchIndex(path)
+    try:
+        changed = index.update(processed_dir, force=force)
+        print(f"Search index: {sum(changed.values())} rows added or changed, {index.count()} indexed")
+        return changed
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    # Usage: python modules/search_index.py [rebuild | <query>]
+    if len(sys.argv) > 1 and sys.argv[1] != "rebuild":
+        index = SearchIndex()
+        rows, more = index.search(" ".join(sys.argv[1:]))
+        for row in rows:
+            snippet = row["snippet"].replace(HIGHLIGHT_START, "[").replace(HIGHLIGHT_END, "]")
+            print(f"{row['date']}  {row['platform']:<8} {row['sentiment'] or '':<9} {snippet}")
+        if more:
+            print("...")
+        index.close()
+    else:
+        update_index(force=len(sys.argv) > 1)
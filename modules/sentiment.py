@@ -1,14 +1,23 @@
-import json
-import pandas as pd
-
 import csv
+import itertools
 import re
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
+import numpy as np
+from aggregates import write_aggregates
+from brands import BrandRouter, write_brand_partitions
+from cascade import cascade_labels, tier_fractions
+from dedup import group_by_cluster, open_index
+from instrumentation import export, inc, span
+from models import get_model, model_version
+from reddit_stream import comment_text, iter_comments, iter_posts
+from search_index import update_index
+from sentiment_cache import SentimentCache
+from storage import import_csv
 
-transformer_model = "cardiffnlp/twitter-roberta-base-sentiment"
-transformer_tokenizer = AutoTokenizer.from_pretrained(transformer_model)
-transformer_pipeline = pipeline("sentiment-analysis", model=transformer_model, tokenizer=transformer_tokenizer)
+TWITTER_LABEL_MAP = {
+    'LABEL_0': 'Negative',
+    'LABEL_1': 'Positive',
+    'LABEL_2': 'Neutral'
+}
 
 # Minimal tweet preprocessing for transformer
 def preprocess_tweet(text):
@@ -33,7 +42,7 @@ def get_sentiment_label(score):
         return "Neutral"
 
 def analyze_sentiment(text):
-    analyzer = SentimentIntensityAnalyzer()
+    analyzer = get_model("vader")
     score = analyzer.polarity_scores(text)
     compound = score['compound']
     if compound >= 0.05:
@@ -42,112 +51,380 @@ def analyze_sentiment(text):
         return 'Negative'
     else:
         return 'Neutral'
-    
-
-def reddit_sentiment(input_json, output_csv):
-    model_name = "distilbert-base-uncased-finetuned-sst-2-english"
-    clf = pipeline("sentiment-analysis", model=model_name)
-    with open(input_json, encoding="utf-8") as f:
-        posts = json.load(f)
-
-    results = []
-    for post in posts:
-        post_id = post.get("post_id", "")
-        title = post.get("post_title", "")
-        body = post.get("post_text", "")
-        comments = post.get("comments", [])
-        # If comments are dicts, get comment body, else assume list of strings
-        if comments and isinstance(comments[0], dict):
-            comment_texts = [c.get("body", "") for c in comments[:5]]
-        else:
-            comment_texts = comments[:5]
-
-        post_text = (title or "") + "\n" + (body or "")
-        post_pred = clf(post_text[:512])[0]  # Truncate for model
-        post_score = score_label(post_pred["label"])
-
-        comment_scores = []
-        for c in comment_texts:
-            if c.strip():
-                pred = clf(c[:512])[0]
-                comment_scores.append(score_label(pred["label"]))
-        avg_comment_score = sum(comment_scores)/len(comment_scores) if comment_scores else 0
-
-        overall_score = 0.7 * post_score + 0.3 * avg_comment_score
-        sentiment = get_sentiment_label(overall_score)
-
-        results.append({
-            "post_id": post_id,
-            "title": title,
-            "body": body,
-            "post_score": post_score,
-            "avg_comment_score": avg_comment_score,
-            "overall_score": overall_score,
-            "sentiment": sentiment,
-            "platform": "Reddit"
-        })
-
-    df = pd.DataFrame(results)
-    df.to_csv(output_csv, index=False)
-
-
-def sentiment_twitter(input_csv, output_csv):
-    label_map = {
-        'LABEL_0': 'Negative',
-        'LABEL_1': 'Positive',
-        'LABEL_2': 'Neutral'
-    }
+
+
+def cached_labels(model_key, texts, predict_fn, cache=None):
+    if cache is None:
+        return predict_fn(texts)
+    model_name, revision = model_version(model_key)
+    labels = cache.get_many(model_name, revision, texts)
+    missing = [i for i, label in enumerate(labels) if label is None]
+    inc("sentiment_cache_hits_total", len(texts) - len(missing), model=model_key)
+    inc("sentiment_cache_misses_total", len(missing), model=model_key)
+    if missing:
+        predicted = predict_fn([texts[i] for i in missing])
+        for i, label in zip(missing, predicted):
+            labels[i] = label
+        # Failed predictions come back empty and are retried on the next run
+        cache.put_many(model_name, revision, [(texts[i], labels[i]) for i in missing if labels[i]])
+    return labels
+
+
+def reddit_sentiment(input_json, output_csv, cache=None, mode="top", router=None, **tree_options):
+    if mode == "tree":
+        return reddit_tree_sentiment(input_json, output_csv, cache=cache, router=router, **tree_options)
+    clf = get_model("reddit")
+    fieldnames = ["post_id", "title", "body", "post_score", "avg_comment_score",
+                  "overall_score", "sentiment", "platform"]
+    if router is not None:
+        fieldnames.append("brands")
+    with open(output_csv, 'w', encoding='utf-8', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
+        writer.writeheader()
+        for post in iter_posts(input_json):
+            post_id = post.get("post_id", "")
+            title = post.get("post_title", "")
+            body = post.get("post_text", "")
+            comments = post.get("comments", [])
+            comment_texts = [comment_text(c) for c in comments[:5]]
+
+            post_text = (title or "") + "\n" + (body or "")
+            texts = [post_text[:512]] + [c[:512] for c in comment_texts if c.strip()]  # Truncate for model
+            labels = cached_labels("reddit", texts, lambda batch: [clf(t)[0]["label"] for t in batch], cache)
+            post_score = score_label(labels[0])
+
+            comment_scores = [score_label(label) for label in labels[1:]]
+            avg_comment_score = sum(comment_scores)/len(comment_scores) if comment_scores else 0
+
+            overall_score = 0.7 * post_score + 0.3 * avg_comment_score
+            sentiment = get_sentiment_label(overall_score)
+
+            row = {
+                "post_id": post_id,
+                "title": title,
+                "body": body,
+                "post_score": post_score,
+                "avg_comment_score": avg_comment_score,
+                "overall_score": overall_score,
+                "sentiment": sentiment,
+                "platform": "Reddit"
+            }
+            if router is not None:
+                row["brands"] = router.tag(post_text, "reddit", post.get("query"))
+            writer.writerow(row)
+
+
+def predict_labels(clf, texts, batch_size=32, model_key="classifier"):
+    # Length-bucketed batches: sorting by token count keeps padding per batch small,
+    # the pipeline pads each batch dynamically to its longest member.
+    labels = [''] * len(texts)
+    if not texts:
+        return labels
+    if clf.tokenizer is not None:
+        with span("tokenize", items=len(texts), model=model_key):
+            lengths = [len(ids) for ids in clf.tokenizer(texts, truncation=True)['input_ids']]
+    else:
+        # Remote classifiers tokenize on the inference server; characters are a close enough proxy
+        lengths = [len(text) for text in texts]
+    order = sorted(range(len(texts)), key=lambda i: lengths[i])
+    failed, last_error = 0, None
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        batch = [texts[i] for i in idx]
+        try:
+            with span("inference", items=len(batch), model=model_key):
+                preds = clf(batch, batch_size=len(batch), truncation=True)
+            for i, pred in zip(idx, preds):
+                labels[i] = pred['label']
+        except Exception:
+            # Fall back to one call per text so a single bad row only loses its own label
+            for i in idx:
+                try:
+                    with span("inference", items=1, model=model_key):
+                        labels[i] = clf(texts[i], truncation=True)[0]['label']
+                except Exception as e:
+                    labels[i] = ''
+                    failed, last_error = failed + 1, e
+    if failed:
+        inc("inference_failed_items_total", failed, model=model_key)
+        print(f"  {model_key}: {failed} of {len(texts)} texts could not be scored (last error: {last_error})")
+    return labels
+
+
+def depth_score_weights(depths, scores):
+    # Deeper replies count less; upvoted comments count more, downvoted ones get the base weight
+    return (1.0 / depths) * (1.0 + np.log1p(np.clip(scores, 0, None)))
+
+
+def reddit_tree_sentiment(input_json, output_csv, cache=None, nodes_csv=None, batch_size=32, posts_per_batch=64,
+                          cascade_band=None, router=None):
+    clf = get_model("reddit")
+    fieldnames = ["post_id", "title", "body", "created_utc", "post_score", "avg_comment_score",
+                  "overall_score", "sentiment", "platform", "n_comments_scored"]
+    node_fieldnames = ["post_id", "comment_id", "parent_id", "depth", "score", "created_utc", "text", "sentiment"]
+    if cascade_band is not None:
+        fieldnames.append("sentiment_tier")
+        node_fieldnames.append("sentiment_tier")
+    if router is not None:
+        fieldnames.append("brands")
+    all_tiers = []
+    node_labels = {"POSITIVE": "Positive", "NEGATIVE": "Negative"}
+    posts = iter_posts(input_json)
+    with open(output_csv, 'w', encoding='utf-8', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
+        writer.writeheader()
+        node_file = open(nodes_csv, 'w', encoding='utf-8', newline='') if nodes_csv else None
+        node_writer = csv.DictWriter(node_file, fieldnames=node_fieldnames) if node_file else None
+        if node_writer:
+            node_writer.writeheader()
+        try:
+            while True:
+                with span("file_read", stage="sentiment_reddit"):
+                    chunk = list(itertools.islice(posts, posts_per_batch))
+                if not chunk:
+                    break
+                # Flatten every post and its whole reply tree into one list of nodes
+                nodes = []
+                for i, post in enumerate(chunk):
+                    title = post.get("post_title", "") or ""
+                    body = post.get("post_text", "") or ""
+                    nodes.append((i, 0, 0, title + "\n" + body, {
+                        "post_id": post.get("post_id", ""), "comment_id": "", "parent_id": "",
+                        "created_utc": post.get("created_utc"),
+                    }))
+                    for comment in iter_comments(post.get("comments"), post.get("post_id", "")):
+                        if comment["text"].strip():
+                            nodes.append((i, comment["depth"], comment["score"], comment["text"], comment))
+                texts = [node[3] for node in nodes]
+                transformer_fn = lambda batch: cached_labels(
+                    "reddit", batch,
+                    lambda texts: predict_labels(clf, texts, batch_size=batch_size, model_key="reddit"),
+                    cache,
+                )
+                if cascade_band is None:
+                    labels, tiers = transformer_fn(texts), None
+                else:
+                    labels, tiers = cascade_labels(texts, transformer_fn, band=cascade_band,
+                                                   positive="POSITIVE", negative="NEGATIVE")
+                    all_tiers.extend(tiers)
+
+                post_idx = np.array([node[0] for node in nodes])
+                depths = np.array([node[1] for node in nodes], dtype=float)
+                karma = np.array([node[2] for node in nodes], dtype=float)
+                values = np.array([score_label(label) for label in labels], dtype=float)
+
+                is_post = depths == 0
+                post_scores = np.zeros(len(chunk))
+                post_scores[post_idx[is_post]] = values[is_post]
+                is_comment = ~is_post
+                weights = depth_score_weights(depths[is_comment], karma[is_comment])
+                weight_sums = np.bincount(post_idx[is_comment], weights=weights, minlength=len(chunk))
+                weighted = np.bincount(post_idx[is_comment], weights=weights * values[is_comment], minlength=len(chunk))
+                avg_comment_scores = np.divide(weighted, weight_sums, out=np.zeros(len(chunk)), where=weight_sums > 0)
+                n_comments = np.bincount(post_idx[is_comment], minlength=len(chunk))
+                overall_scores = 0.7 * post_scores + 0.3 * avg_comment_scores
+
+                inc("items_processed_total", len(nodes), stage="sentiment_reddit")
+                with span("file_write", items=len(nodes), stage="sentiment_reddit"):
+                    post_tiers = {node[0]: tier for node, tier in zip(nodes, tiers or []) if node[1] == 0}
+                    post_nodes = {node[0]: j for j, node in enumerate(nodes) if node[1] == 0}
+                    for i, post in enumerate(chunk):
+                        row = {
+                            "post_id": post.get("post_id", ""),
+                            "title": post.get("post_title", ""),
+                            "body": post.get("post_text", ""),
+                            "created_utc": post.get("created_utc"),
+                            "post_score": int(post_scores[i]),
+                            "avg_comment_score": float(avg_comment_scores[i]),
+                            "overall_score": float(overall_scores[i]),
+                            "sentiment": get_sentiment_label(overall_scores[i]),
+                            "platform": "Reddit",
+                            "n_comments_scored": int(n_comments[i]),
+                        }
+                        if tiers:
+                            row["sentiment_tier"] = post_tiers[i]
+                        if router is not None:
+                            # Scored once above; routing only decides which brands' outputs share the row
+                            row["brands"] = router.tag(texts[post_nodes[i]], "reddit", post.get("query"))
+                        writer.writerow(row)
+                    if node_writer:
+                        for j, ((i, depth, score, text, meta), label) in enumerate(zip(nodes, labels)):
+                            node_row = {
+                                "post_id": meta.get("post_id", ""),
+                                "comment_id": meta.get("comment_id", ""),
+                                "parent_id": meta.get("parent_id", ""),
+                                "depth": depth,
+                                "score": score,
+                                "created_utc": meta.get("created_utc"),
+                                "text": text,
+                                "sentiment": node_labels.get(label, "Neutral" if label else ""),
+                            }
+                            if tiers:
+                                node_row["sentiment_tier"] = tiers[j]
+                            node_writer.writerow(node_row)
+        finally:
+            if node_file:
+                node_file.close()
+    if cascade_band is not None:
+        fractions = tier_fractions(all_tiers)
+        print(f"Reddit cascade: {fractions['vader']:.1%} VADER, {fractions['transformer']:.1%} transformer")
+
+
+def sentiment_twitter(input_csv, output_csv, batch_size=32, chunk_size=1024, cache=None, cascade_band=None,
+                      dedup=None, router=None):
+    label_map = TWITTER_LABEL_MAP
+    all_tiers = []
+    n_texts = n_scored = 0
     with open(input_csv, encoding='utf-8') as infile, open(output_csv, 'w', encoding='utf-8', newline='') as outfile:
         reader = csv.DictReader(infile)
         fieldnames = reader.fieldnames + ['sentiment', 'platform']
+        if cascade_band is not None:
+            fieldnames.append('sentiment_tier')
+        if dedup is not None:
+            fieldnames.append('cluster_id')
+        if router is not None:
+            fieldnames.append('brands')
         writer = csv.DictWriter(outfile, fieldnames=fieldnames)
         writer.writeheader()
-        for row in reader:
-            new_row = dict(row)
-            text = row.get('text', '')
-            pre_text = preprocess_tweet(text)
-            try:
-                hf_result = transformer_pipeline(pre_text)[0]['label']
-            except Exception:
-                hf_result = ''
-            new_row['sentiment'] = label_map.get(hf_result, hf_result)
-            new_row['platform'] = 'Twitter'
-            writer.writerow(new_row)
-
-def sentiment_news(input_csv, output_csv):
+
+        def transformer_fn(batch):
+            hf_results = cached_labels(
+                "twitter", batch,
+                lambda texts: predict_labels(get_model("twitter"), texts, batch_size=batch_size,
+                                             model_key="twitter"),
+                cache,
+            )
+            return [label_map.get(hf_result, hf_result) for hf_result in hf_results]
+
+        while True:
+            with span("file_read", stage="sentiment_twitter"):
+                chunk = list(itertools.islice(reader, chunk_size))
+            if not chunk:
+                break
+            pre_texts = [preprocess_tweet(row.get('text', '')) for row in chunk]
+            if dedup is not None:
+                # Score each near-duplicate cluster once, through its representative
+                cluster_ids, texts, members = group_by_cluster(dedup, pre_texts)
+            else:
+                cluster_ids, texts, members = None, pre_texts, range(len(pre_texts))
+            if cascade_band is None:
+                labels, tiers = transformer_fn(texts), None
+            else:
+                labels, tiers = cascade_labels(texts, transformer_fn, band=cascade_band)
+                all_tiers.extend(tiers[j] for j in members)
+            n_texts += len(chunk)
+            n_scored += len(texts)
+            inc("items_processed_total", len(chunk), stage="sentiment_twitter")
+            with span("file_write", items=len(chunk), stage="sentiment_twitter"):
+                for i, (row, j) in enumerate(zip(chunk, members)):
+                    new_row = dict(row)
+                    new_row['sentiment'] = labels[j]
+                    new_row['platform'] = 'Twitter'
+                    if tiers:
+                        new_row['sentiment_tier'] = tiers[j]
+                    if cluster_ids:
+                        new_row['cluster_id'] = cluster_ids[i]
+                    if router is not None:
+                        new_row['brands'] = router.tag(row.get('text', ''), 'twitter', row.get('query'))
+                    writer.writerow(new_row)
+    if cascade_band is not None:
+        fractions = tier_fractions(all_tiers)
+        print(f"Twitter cascade: {fractions['vader']:.1%} VADER, {fractions['transformer']:.1%} transformer")
+    if dedup is not None:
+        print(f"Twitter dedup: scored {n_scored} cluster representatives for {n_texts} tweets")
+
+def vader_labels(texts):
+    with span("inference", items=len(texts), model="vader"):
+        return [analyze_sentiment(t) for t in texts]
+
+def sentiment_news(input_csv, output_csv, chunk_size=1024, cache=None, dedup=None, router=None):
+    n_texts = n_scored = 0
     with open(input_csv, encoding='utf-8') as infile, open(output_csv, 'w', encoding='utf-8', newline='') as outfile:
         reader = csv.DictReader(infile)
         fieldnames = reader.fieldnames + ['sentiment', 'platform']
+        if dedup is not None:
+            fieldnames.append('cluster_id')
+        if router is not None:
+            fieldnames.append('brands')
         writer = csv.DictWriter(outfile, fieldnames=fieldnames)
         writer.writeheader()
-        for row in reader:
-            new_row = dict(row)
-            title = row.get('title', '')
-            new_row['sentiment'] = analyze_sentiment(title)
-            new_row['platform'] = 'News'
-            writer.writerow(new_row)
+        while True:
+            with span("file_read", stage="sentiment_news"):
+                chunk = list(itertools.islice(reader, chunk_size))
+            if not chunk:
+                break
+            titles = [row.get('title', '') for row in chunk]
+            if dedup is not None:
+                cluster_ids, texts, members = group_by_cluster(dedup, titles)
+            else:
+                cluster_ids, texts, members = None, titles, range(len(titles))
+            labels = cached_labels("vader", texts, vader_labels, cache)
+            n_texts += len(chunk)
+            n_scored += len(texts)
+            inc("items_processed_total", len(chunk), stage="sentiment_news")
+            with span("file_write", items=len(chunk), stage="sentiment_news"):
+                for i, (row, j) in enumerate(zip(chunk, members)):
+                    new_row = dict(row)
+                    new_row['sentiment'] = labels[j]
+                    new_row['platform'] = 'News'
+                    if cluster_ids:
+                        new_row['cluster_id'] = cluster_ids[i]
+                    if router is not None:
+                        new_row['brands'] = router.tag(row.get('title', ''), 'news', row.get('query'))
+                    writer.writerow(new_row)
+    if dedup is not None:
+        print(f"News dedup: scored {n_scored} cluster representatives for {n_texts} articles")
 
 def main():
+    cache = SentimentCache()
+    tweet_index = open_index("twitter")
+    news_index = open_index("news")
+    router = BrandRouter()
     print("Running sentiment analysis for Reddit JSON...")
     reddit_sentiment(
         "data/raw/reddit_leapscholar.json",
-        "data/processed/reddit_sentiment.csv"
+        "data/processed/reddit_sentiment.csv",
+        cache=cache,
+        mode="tree",
+        nodes_csv="data/processed/reddit_comment_sentiment.csv",
+        router=router
     )
+    import_csv("data/processed/reddit_sentiment.csv", "Reddit")
     print("Reddit sentiment saved to brand_monitor/data/processed/reddit_sentiment.csv")
 
     print("Running sentiment analysis for Twitter and News CSVs...")
     sentiment_twitter(
         "data/raw/leapscholar_tweets.csv",
-        "data/processed/twitter_sentiment.csv"
+        "data/processed/twitter_sentiment.csv",
+        cache=cache,
+        dedup=tweet_index,
+        router=router
     )
+    import_csv("data/processed/twitter_sentiment.csv", "Twitter")
     print("Twitter sentiment saved to brand_monitor/data/processed/twitter_sentiment.csv")
 
     print("Running sentiment analysis for News CSVs...")
     sentiment_news(
         "data/raw/leapscholar_news_leap.csv",
-        "data/processed/news_sentiment.csv"
+        "data/processed/news_sentiment.csv",
+        cache=cache,
+        dedup=news_index,
+        router=router
     )
+    import_csv("data/processed/news_sentiment.csv", "News")
     print("News sentiment saved to brand_monitor/data/processed/news_sentiment.csv")
 
+    write_aggregates("data/processed")
+    print("Dashboard aggregates saved to brand_monitor/data/processed/")
+    write_brand_partitions("data/processed", router.brands)
+    update_index("data/processed")
+
+    stats = cache.stats()
+    print(f"Sentiment cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)")
+    cache.close()
+    tweet_index.close()
+    news_index.close()
+    export("sentiment")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,97 @@
+"""
+Persistent SQLite cache of sentiment labels.
+
+Entries are keyed by model name, model revision and a hash of the preprocessed
+text, so re-runs only send new or changed texts to a model.
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+DEFAULT_CACHE_PATH = "data/cache/sentiment_cache.sqlite"
+
+
+def text_hash(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+class SentimentCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        # Backfill workers share the file across processes, so wait on locks instead of failing
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sentiment_cache ("
+            "model TEXT NOT NULL, revision TEXT NOT NULL, text_hash TEXT NOT NULL, "
+            "label TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (model, revision, text_hash)) WITHOUT ROWID"
+        )
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, model, revision, texts):
+        hashes = [text_hash(t) for t in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), 500):
+                part = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self.conn.execute(
+                    f"SELECT text_hash, label FROM sentiment_cache "
+                    f"WHERE model = ? AND revision = ? AND text_hash IN ({placeholders})",
+                    [model, revision] + part,
+                )
+                found.update(rows)
+            labels = [found.get(h) for h in hashes]
+            hits = sum(1 for label in labels if label is not None)
+            self.hits += hits
+            self.misses += len(labels) - hits
+        return labels
+
+    def put_many(self, model, revision, pairs):
+        now = time.time()
+        rows = [(model, revision, text_hash(text), label, now) for text, label in pairs]
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO sentiment_cache VALUES (?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def invalidate(self, model, revision=None):
+        with self._lock:
+            if revision is None:
+                cur = self.conn.execute("DELETE FROM sentiment_cache WHERE model = ?", (model,))
+            else:
+                cur = self.conn.execute(
+                    "DELETE FROM sentiment_cache WHERE model = ? AND revision = ?", (model, revision)
+                )
+            self.conn.commit()
+            return cur.rowcount
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    # Usage: python modules/sentiment_cache.py invalidate <model> [revision]
+    if len(sys.argv) >= 3 and sys.argv[1] == "invalidate":
+        cache = SentimentCache()
+        removed = cache.invalidate(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        print(f"Removed {removed} cached labels for '{sys.argv[2]}'")
+        cache.close()
+    else:
+        print("Usage: python modules/sentiment_cache.py invalidate <model> [revision]")
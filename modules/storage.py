@@ -0,0 +1,252 @@
+"""
+Partitioned Parquet storage for processed mentions.
+
+Mentions from every platform share one typed schema and are written as a
+zstd-compressed Parquet dataset partitioned by platform and date. Readers get
+column projection and date-range predicate pushdown; CSV export stays available
+for auditing.
+
+The batch pipeline owns the `mentions` dataset and replaces a platform at a
+time. The ingest service appends to a separate `mentions_live` dataset, so a
+pipeline run never deletes what ingest wrote. Readers merge the two and drop
+live rows the batch data already covers. `compact_mentions` folds the live
+service's many small files into one per partition.
+"""
+
+import glob
+import os
+import uuid
+from datetime import date, datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from instrumentation import span
+
+WAREHOUSE_DIR = "data/warehouse"
+MENTIONS = "mentions"
+LIVE_MENTIONS = "mentions_live"
+# Identifies a mention across the batch and live datasets; rows without an id fall back to text and time
+KEY_COLUMNS = ["platform", "id", "text", "created_at"]
+READ_RETRIES = 3
+
+MENTION_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("created_at", pa.timestamp("s")),
+    ("text", pa.string()),
+    ("title", pa.string()),
+    ("url", pa.string()),
+    ("source_name", pa.string()),
+    ("author_id", pa.string()),
+    ("query", pa.string()),
+    ("sentiment", pa.dictionary(pa.int8(), pa.string())),
+    ("like_count", pa.int32()),
+    ("retweet_count", pa.int32()),
+    ("reply_count", pa.int32()),
+    ("quote_count", pa.int32()),
+    ("score", pa.float32()),
+    ("platform", pa.dictionary(pa.int8(), pa.string())),
+    ("date", pa.date32()),
+])
+FILE_SCHEMA = pa.schema([field for field in MENTION_SCHEMA if field.name not in ("platform", "date")])
+PARTITIONING = ds.partitioning(
+    pa.schema([("platform", pa.string()), ("date", pa.date32())]), flavor="hive"
+)
+ENGAGEMENT_COLUMNS = ["like_count", "retweet_count", "reply_count", "quote_count"]
+
+
+def dataset_path(name=MENTIONS, root=WAREHOUSE_DIR):
+    return os.path.join(root, name)
+
+
+def to_mentions_frame(df, platform, ingested_on=None):
+    out = pd.DataFrame(index=df.index)
+    if platform == "Reddit":
+        out["id"] = df.get("post_id")
+        out["title"] = df.get("title")
+        out["text"] = (df.get("title", pd.Series("", index=df.index)).fillna("") + "\n"
+                       + df.get("body", pd.Series("", index=df.index)).fillna("")).str.strip()
+        out["score"] = df.get("overall_score")
+        created = pd.to_datetime(df.get("created_utc"), unit="s", errors="coerce") if "created_utc" in df else None
+    else:
+        out["id"] = df.get("id", df.get("url"))
+        out["title"] = df.get("title")
+        out["text"] = df["text"] if "text" in df else df.get("title")
+        out["score"] = None
+        created = pd.to_datetime(df["created_at"], errors="coerce") if "created_at" in df else None
+    for column in ["url", "source_name", "author_id", "query", "sentiment"]:
+        out[column] = df[column] if column in df else None
+    for column in ENGAGEMENT_COLUMNS:
+        out[column] = pd.to_numeric(df[column], errors="coerce").fillna(0).astype("int32") if column in df else 0
+    out["created_at"] = created if created is not None else pd.NaT
+    # Rows without a timestamp (news headlines) are partitioned by the day they were ingested
+    fallback = pd.Timestamp(ingested_on or date.today())
+    out["date"] = out["created_at"].fillna(fallback).dt.date
+    out["platform"] = platform
+    for column in ["id", "title", "text", "url", "source_name", "author_id", "query"]:
+        out[column] = out[column].astype("string")
+    out["sentiment"] = out["sentiment"].astype("category")
+    out["platform"] = out["platform"].astype("category")
+    return out[MENTION_SCHEMA.names]
+
+
+def dataset_version(root=WAREHOUSE_DIR):
+    markers = [os.path.join(dataset_path(name, root), "_version") for name in (MENTIONS, LIVE_MENTIONS)]
+    versions = [os.path.getmtime(m) for m in markers if os.path.exists(m)]
+    return max(versions) if versions else None
+
+
+def _touch_version(path):
+    # Underscore-prefixed files are skipped by dataset discovery
+    with open(os.path.join(path, "_version"), "w", encoding="utf-8") as f:
+        f.write(datetime.now().isoformat())
+
+
+def _platform_files(path, platform):
+    return glob.glob(os.path.join(path, f"platform={platform}", "*", "*.parquet"))
+
+
+def _remove_files(paths):
+    for file_path in paths:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        directory = os.path.dirname(file_path)
+        if os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+
+
+def write_mentions(df, platform, root=WAREHOUSE_DIR, mode="replace", name=MENTIONS):
+    path = dataset_path(name, root)
+    # New files land before the old ones go, so readers never see the platform empty
+    old_files = _platform_files(path, platform) if mode == "replace" else []
+    table = pa.Table.from_pandas(to_mentions_frame(df, platform), schema=MENTION_SCHEMA, preserve_index=False)
+    with span("file_write", items=len(table), stage="mentions_store"):
+        ds.write_dataset(
+            table, path, format="parquet", partitioning=PARTITIONING,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+        )
+    _remove_files(old_files)
+    _touch_version(path)
+    return len(table)
+
+
+def import_csv(csv_path, platform, root=WAREHOUSE_DIR):
+    return write_mentions(pd.read_csv(csv_path), platform, root=root)
+
+
+def _as_date(value):
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    return pd.Timestamp(value).date()
+
+
+def mention_filter(platforms=None, start=None, end=None):
+    expr = None
+    clauses = []
+    if platforms:
+        clauses.append(ds.field("platform").isin(list(platforms)))
+    if start is not None:
+        clauses.append(ds.field("date") >= pa.scalar(_as_date(start), pa.date32()))
+    if end is not None:
+        clauses.append(ds.field("date") <= pa.scalar(_as_date(end), pa.date32()))
+    for clause in clauses:
+        expr = clause if expr is None else expr & clause
+    return expr
+
+
+def mention_keys(df):
+    fallback = df["text"].astype("string").fillna("") + "\x1f" + df["created_at"].astype("string").fillna("")
+    return df["platform"].astype("string") + "\x1f" + df["id"].astype("string").fillna(fallback)
+
+
+def _read_dataset(path, columns=None, filter=None):
+    if not os.path.exists(path):
+        return None
+    # Compaction and batch replaces delete files; a read that loses the race lists them again
+    for attempt in range(READ_RETRIES):
+        try:
+            dataset = ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+            if not dataset.files:
+                return None
+            return dataset.to_table(columns=columns, filter=filter)
+        except (FileNotFoundError, OSError):
+            if attempt == READ_RETRIES - 1:
+                raise
+
+
+def read_mentions(columns=None, platforms=None, start=None, end=None, root=WAREHOUSE_DIR):
+    expr = mention_filter(platforms, start, end)
+    wanted = columns or MENTION_SCHEMA.names
+    with span("file_read", stage="mentions_store"):
+        live = _read_dataset(dataset_path(LIVE_MENTIONS, root), filter=expr)
+        if live is None or live.num_rows == 0:
+            batch = _read_dataset(dataset_path(MENTIONS, root), columns=columns, filter=expr)
+            return batch.to_pandas() if batch is not None else pd.DataFrame(columns=wanted)
+        read_columns = list(dict.fromkeys(list(wanted) + KEY_COLUMNS))
+        batch = _read_dataset(dataset_path(MENTIONS, root), columns=read_columns, filter=expr)
+        live = live.select(read_columns).to_pandas()
+        if batch is None:
+            merged = live
+        else:
+            batch = batch.to_pandas()
+            # The batch pipeline rescored these with full context; its copy wins
+            live = live[~mention_keys(live).isin(mention_keys(batch))]
+            merged = pd.concat([batch, live], ignore_index=True)
+        if "sentiment" in merged:
+            merged["sentiment"] = merged["sentiment"].astype("category")
+        return merged[list(wanted)]
+
+
+def compact_mentions(root=WAREHOUSE_DIR):
+    """Rewrites each live partition as one file, dropping rows the batch dataset now covers.
+
+    Only the ingest service writes the live dataset, and it compacts between flushes,
+    so no append can land in a partition while it is being rewritten.
+    """
+    live_path = dataset_path(LIVE_MENTIONS, root)
+    batch_path = dataset_path(MENTIONS, root)
+    partitions = {}
+    for file_path in glob.glob(os.path.join(live_path, "platform=*", "date=*", "*.parquet")):
+        partitions.setdefault(os.path.dirname(file_path), []).append(file_path)
+    before = after = 0
+    for directory, files in partitions.items():
+        platform = os.path.basename(os.path.dirname(directory)).split("=", 1)[1]
+        day = os.path.basename(directory).split("=", 1)[1]
+        expr = mention_filter([platform], day, day)
+        live = _read_dataset(live_path, filter=expr).to_pandas()
+        n_rows = len(live)
+        batch = _read_dataset(batch_path, columns=KEY_COLUMNS, filter=expr)
+        if batch is not None and batch.num_rows:
+            live = live[~mention_keys(live).isin(mention_keys(batch.to_pandas()))]
+        before += n_rows
+        after += len(live)
+        if len(files) == 1 and len(live) == n_rows:
+            continue
+        if len(live):
+            # Partition columns live in the directory names, not in the files
+            table = pa.Table.from_pandas(live.drop(columns=["platform", "date"]), schema=FILE_SCHEMA,
+                                         preserve_index=False)
+            tmp_path = os.path.join(directory, f"_compact-{uuid.uuid4().hex}.tmp")
+            pq.write_table(table, tmp_path, compression="zstd")
+            os.replace(tmp_path, os.path.join(directory, f"part-{uuid.uuid4().hex}-0.parquet"))
+        _remove_files(files)
+    if partitions:
+        _touch_version(live_path)
+    return before, after
+
+
+def export_csv(output_csv, columns=None, platforms=None, start=None, end=None, root=WAREHOUSE_DIR):
+    df = read_mentions(columns=columns, platforms=platforms, start=start, end=end, root=root)
+    df.to_csv(output_csv, index=False)
+    return len(df)
+
+
+if __name__ == "__main__":
+    export_csv("data/processed/mentions_export.csv")
+    print("Mentions exported to data/processed/mentions_export.csv")
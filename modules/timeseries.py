@@ -0,0 +1,178 @@
+"""
+Pre-aggregated time buckets of sentiment and engagement for the dashboard charts.
+
+Mentions from the Parquet store are counted per platform into minute, hour and
+day buckets, each tier saved as its own Parquet file. A chart reads the finest
+tier that keeps the visible range within a few thousand buckets, then
+Largest-Triangle-Three-Buckets (LTTB) downsampling trims every series to its
+point budget while keeping peaks and dips, so the browser payload stays small
+however long the history.
+"""
+
+import os
+import sys
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import storage
+from instrumentation import span
+
+TIMESERIES_DIR = "data/warehouse/timeseries"
+# Bucket width per tier, finest first
+RESOLUTIONS = {"minute": "1min", "hour": "1h", "day": "1D"}
+SENTIMENTS = ["Positive", "Neutral", "Negative"]
+METRICS = ["mentions"] + [s.lower() for s in SENTIMENTS] + storage.ENGAGEMENT_COLUMNS
+MAX_POINTS = 2000
+# A tier may hold this many times the point budget before a coarser one is used
+OVERSAMPLE = 4
+
+
+def tier_path(resolution, root=TIMESERIES_DIR):
+    return os.path.join(root, f"{resolution}.parquet")
+
+
+def timeseries_stale(root=TIMESERIES_DIR, warehouse_root=storage.WAREHOUSE_DIR):
+    paths = [tier_path(r, root) for r in RESOLUTIONS]
+    if not all(os.path.exists(p) for p in paths):
+        return True
+    version = storage.dataset_version(root=warehouse_root)
+    return version is not None and min(os.path.getmtime(p) for p in paths) < version
+
+
+def bucket_counts(df, freq):
+    """Counts mentions, labels and engagement per platform per bucket of width `freq`."""
+    if df.empty:
+        return pd.DataFrame(columns=["bucket", "platform"] + METRICS)
+    df = df.assign(bucket=df["created_at"].dt.floor(freq), mentions=1, platform=df["platform"].astype(str))
+    sentiment = df["sentiment"].astype(str)
+    for label in SENTIMENTS:
+        df[label.lower()] = (sentiment == label).astype("int32")
+    out = df.groupby(["bucket", "platform"], observed=True)[METRICS].sum().reset_index()
+    return out.sort_values(["platform", "bucket"], ignore_index=True)
+
+
+def build_timeseries(root=TIMESERIES_DIR, warehouse_root=storage.WAREHOUSE_DIR):
+    df = storage.read_mentions(columns=["created_at", "date", "platform", "sentiment"] + storage.ENGAGEMENT_COLUMNS,
+                               root=warehouse_root)
+    os.makedirs(root, exist_ok=True)
+    timed = df[df["created_at"].notna()]
+    sizes = {}
+    for resolution, freq in RESOLUTIONS.items():
+        if resolution == "day":
+            # Headlines carry no timestamp; their partition date is still right at day resolution
+            source = df.assign(created_at=df["created_at"].fillna(pd.to_datetime(df["date"])))
+        else:
+            source = timed
+        with span("timeseries_build", items=len(source), resolution=resolution):
+            buckets = bucket_counts(source, freq)
+        # The pipeline and the dashboard may rebuild at once, so each writer gets its own tmp file
+        tmp_path = f"{tier_path(resolution, root)}.{uuid.uuid4().hex}.tmp"
+        try:
+            buckets.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, tier_path(resolution, root))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        sizes[resolution] = len(buckets)
+    print(f"Time series: {len(df)} mentions into " + ", ".join(f"{n} {r} buckets" for r, n in sizes.items()))
+    return sizes
+
+
+def pick_resolution(start, end, max_points=MAX_POINTS):
+    """Finest tier whose bucket count over [start, end] stays within the oversampled budget."""
+    span_length = pd.Timestamp(end) - pd.Timestamp(start)
+    for resolution, freq in RESOLUTIONS.items():
+        if span_length / pd.Timedelta(freq) <= max_points * OVERSAMPLE:
+            return resolution
+    return "day"
+
+
+def read_tier(resolution, start=None, end=None, platforms=None, root=TIMESERIES_DIR):
+    """Buckets of one tier; `platforms` None means every platform, an empty list none."""
+    path = tier_path(resolution, root)
+    if not os.path.exists(path) or (platforms is not None and not platforms):
+        return pd.DataFrame(columns=["bucket", "platform"] + METRICS)
+    filters = []
+    if start is not None:
+        filters.append(("bucket", ">=", pd.Timestamp(start)))
+    if end is not None:
+        filters.append(("bucket", "<=", pd.Timestamp(end)))
+    if platforms is not None:
+        filters.append(("platform", "in", list(platforms)))
+    return pd.read_parquet(path, filters=filters or None)
+
+
+def lttb(x, y, threshold):
+    """Indices of the `threshold` points that best preserve the shape of (x, y)."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # First and last points are kept; the rest is split into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Average of the next bucket is the third triangle vertex
+        nlo, nhi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample(df, x, columns, threshold):
+    """Long-format frame of (x, series, value) with each column reduced to `threshold` points by LTTB."""
+    frames = []
+    xs = df[x].to_numpy()
+    numeric_x = xs.astype("datetime64[ns]").astype("int64") if np.issubdtype(xs.dtype, np.datetime64) else xs
+    for column in columns:
+        values = df[column].to_numpy(dtype=float)
+        keep = ~np.isnan(values)
+        idx = np.flatnonzero(keep)[lttb(numeric_x[keep], values[keep], threshold)]
+        frames.append(pd.DataFrame({x: xs[idx], "series": column, "value": values[idx]}))
+    if not frames:
+        return pd.DataFrame(columns=[x, "series", "value"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_series(start, end, platforms=None, resolution=None, max_points=MAX_POINTS, root=TIMESERIES_DIR):
+    """Buckets for the range at the chosen (or automatically picked) tier, summed across `platforms`."""
+    resolution = resolution or pick_resolution(start, end, max_points)
+    with span("timeseries_query", resolution=resolution):
+        df = read_tier(resolution, start, end, platforms, root)
+    grouped = df.groupby("bucket")[METRICS].sum().reset_index() if not df.empty else df
+    return grouped, resolution
+
+
+def sentiment_share(df):
+    shares = pd.DataFrame({"bucket": df["bucket"]})
+    total = df["mentions"].replace(0, np.nan)
+    for label in SENTIMENTS:
+        shares[label] = df[label.lower()] / total
+    return shares
+
+
+def history_range(root=TIMESERIES_DIR):
+    path = tier_path("day", root)
+    if not os.path.exists(path):
+        return None
+    buckets = pd.read_parquet(path, columns=["bucket"])["bucket"]
+    if buckets.empty:
+        return None
+    return buckets.min(), buckets.max() + pd.Timedelta(days=1)
+
+
+if __name__ == "__main__":
+    # Usage: python modules/timeseries.py [start end]  — rebuilds the tiers, optionally previews a range
+    build_timeseries()
+    if len(sys.argv) == 3:
+        series, resolution = load_series(sys.argv[1], sys.argv[2])
+        print(f"{len(series)} {resolution} buckets between {sys.argv[1]} and {sys.argv[2]}")
@@ -1,60 +1,139 @@
+import csv
+import itertools
+import time
+from collections import Counter
+from sklearn.feature_extraction.text import CountVectorizer
+from dedup import group_by_cluster, open_index
+from embedding_cache import open_cache
+from instrumentation import export, inc, span
+from models import get_model, model_version
+from reddit_stream import iter_posts
+from storage import read_mentions
+
+BATCH_SIZE = 512
+
+
+def extract_keywords_batched(kw_model, docs, top_n=3, cache=None):
+    if not docs:
+        return []
+    # Fit the candidate vocabulary the same way KeyBERT would, so cached phrase
+    # embeddings line up with the vectorizer's feature order
+    vectorizer = CountVectorizer(ngram_range=(1, 1), stop_words='english')
+    try:
+        with span("tokenize", items=len(docs), model="keybert"):
+            words = list(vectorizer.fit(docs).get_feature_names_out())
+    except ValueError:
+        # Every document was empty or stop words only
+        return [[] for _ in docs]
+    embed = kw_model.model.embed
+    with span("embed", items=len(docs) + len(words), model="keybert"):
+        doc_embeddings = cache.embed(docs, embed) if cache else embed(docs)
+        word_embeddings = cache.embed(words, embed) if cache else embed(words)
+    with span("inference", items=len(docs), model="keybert"):
+        keywords = kw_model.extract_keywords(
+            docs, top_n=top_n, vectorizer=vectorizer,
+            doc_embeddings=doc_embeddings, word_embeddings=word_embeddings,
+        )
+    # KeyBERT unwraps the result list when given a single document
+    if len(docs) == 1:
+        keywords = [keywords]
+    return keywords
+
 
-import json
-
-def extract_reddit_keywords(input_json, output_csv, top_n=15):
-    kw_model = KeyBERT()
-    with open(input_json, encoding='utf-8') as f:
-        posts = json.load(f)
-    texts = []
-    for post in posts:
-        title = post.get('post_title', '')
-        body = post.get('post_text', '')
-        combined = f"{title}\n{body}".strip()
-        if combined:
-            texts.append(combined)
-    all_keywords = []
-    for text in texts:
-        keywords = kw_model.extract_keywords(text, top_n=3, stop_words='english')
-        all_keywords.extend([kw[0].lower() for kw in keywords])
-    counter = Counter(all_keywords)
+def count_keywords(docs, batch_size=BATCH_SIZE, use_cache=True, dedup=None):
+    kw_model = get_model("keybert")
+    cache = open_cache("@".join(model_version("keybert"))) if use_cache else None
+    counter = Counter()
+    n_docs = n_extracted = 0
+    seen_clusters = set()
+    start = time.perf_counter()
+    docs = iter(docs)
+    while True:
+        batch = list(itertools.islice(docs, batch_size))
+        if not batch:
+            break
+        n_docs += len(batch)
+        if dedup is not None:
+            # Each near-duplicate cluster contributes its keywords once, via its representative
+            cluster_ids, representatives, members = group_by_cluster(dedup, batch)
+            fresh = {}
+            for cluster_id, j in zip(cluster_ids, members):
+                if cluster_id not in seen_clusters:
+                    seen_clusters.add(cluster_id)
+                    fresh[cluster_id] = representatives[j]
+            batch = list(fresh.values())
+        n_extracted += len(batch)
+        for keywords in extract_keywords_batched(kw_model, batch, top_n=3, cache=cache):
+            counter.update(kw[0].lower() for kw in keywords)
+    elapsed = time.perf_counter() - start
+    inc("items_processed_total", n_docs, stage="keywords")
+    if cache:
+        cache.save()
+        inc("embedding_cache_hits_total", cache.hits, model="keybert")
+        inc("embedding_cache_misses_total", cache.misses, model="keybert")
+        print(f"  Embedding cache hit rate: {cache.hit_rate():.1%} ({cache.hits} hits, {cache.misses} misses)")
+    if dedup is not None:
+        print(f"  Deduplicated {n_docs} documents into {n_extracted} clusters")
+    print(f"  Extracted keywords from {n_docs} documents ({n_docs / elapsed if elapsed else 0:.1f} docs/sec)")
+    return counter
+
+
+def document_keywords(docs, batch_size=BATCH_SIZE, use_cache=True, top_n=3):
+    # Per-document keywords, in input order, for consumers that need them with timestamps
+    kw_model = get_model("keybert")
+    cache = open_cache("@".join(model_version("keybert"))) if use_cache else None
+    results = []
+    for start in range(0, len(docs), batch_size):
+        batch = docs[start:start + batch_size]
+        results.extend([kw[0] for kw in keywords]
+                       for keywords in extract_keywords_batched(kw_model, batch, top_n=top_n, cache=cache))
+    if cache:
+        cache.save()
+    return results
+
+
+def write_top_keywords(counter, output_csv, top_n=15):
     top_keywords = counter.most_common(top_n)
     with open(output_csv, 'w', encoding='utf-8', newline='') as outfile:
         writer = csv.writer(outfile)
         writer.writerow(['keyword', 'frequency'])
         for keyword, freq in top_keywords:
             writer.writerow([keyword, freq])
-import csv
-from keybert import KeyBERT
-from collections import Counter
 
-def extract_top_keywords(input_csv, output_csv, top_n=15):
-    kw_model = KeyBERT()
-    titles = []
+
+def extract_top_keywords(input_csv, output_csv, top_n=15, dedup=None):
     with open(input_csv, encoding='utf-8') as infile:
         reader = csv.DictReader(infile)
-        for row in reader:
-            title = row.get('title', '')
-            if title:
-                titles.append(title)
-    all_keywords = []
-    for title in titles:
-        keywords = kw_model.extract_keywords(title, top_n=3, stop_words='english')
-        all_keywords.extend([kw[0].lower() for kw in keywords])
-    counter = Counter(all_keywords)
-    top_keywords = counter.most_common(top_n)
-    with open(output_csv, 'w', encoding='utf-8', newline='') as outfile:
-        writer = csv.writer(outfile)
-        writer.writerow(['keyword', 'frequency'])
-        for keyword, freq in top_keywords:
-            writer.writerow([keyword, freq])
+        titles = (row.get('title', '') for row in reader)
+        counter = count_keywords((title for title in titles if title), dedup=dedup)
+    write_top_keywords(counter, output_csv, top_n)
+
+
+def extract_reddit_keywords(input_json, output_csv, top_n=15, dedup=None):
+    texts = (
+        f"{post.get('post_title', '')}\n{post.get('post_text', '')}".strip()
+        for post in iter_posts(input_json)
+    )
+    counter = count_keywords((text for text in texts if text), dedup=dedup)
+    write_top_keywords(counter, output_csv, top_n)
+
+
+def extract_mention_keywords(output_csv, platforms=None, start=None, end=None, top_n=15, dedup=None):
+    # Only the text column of the requested date partitions is read from the store
+    df = read_mentions(columns=['text'], platforms=platforms, start=start, end=end)
+    counter = count_keywords((text for text in df['text'].dropna() if text), dedup=dedup)
+    write_top_keywords(counter, output_csv, top_n)
 
 
 if __name__ == "__main__":
     print("Extracting top keywords from news articles...")
+    news_index = open_index("news")
     extract_top_keywords(
         "data/raw/leapscholar_news_keywords.csv",
-        "data/processed/news_top_keywords.csv"
+        "data/processed/news_top_keywords.csv",
+        dedup=news_index
     )
+    news_index.close()
     print("Top keywords saved to brand_monitor/data/processed/news_top_keywords.csv")
 
     print("Extracting top keywords from reddit posts...")
@@ -62,4 +141,5 @@ if __name__ == "__main__":
         "data/raw/reddit_leapscholar.json",
         "data/processed/reddit_top_keywords.csv"
     )
-    print("Top keywords saved to brand_monitor/data/processed/reddit_top_keywords.csv")
\ No newline at end of file
+    print("Top keywords saved to brand_monitor/data/processed/reddit_top_keywords.csv")
+    export("topics")
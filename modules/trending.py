@@ -0,0 +1,370 @@
+"""
+Sliding-window trending keywords with heavy-hitter sketches.
+
+Keywords extracted from each new document are added, with the document's
+timestamp, to time-bucketed sketches: a Count-Min sketch for counts and a
+Space-Saving summary for candidate heavy hitters. Hourly buckets cover the
+last two days and daily buckets the last quarter, so "top in the last N hours
+or days" and "rising versus the previous window" are answered in bounded
+memory without re-running KeyBERT over history. Documents already counted are
+remembered in daily Bloom filters that expire with the coarsest level, so the
+dedupe state is bounded too. A compact JSON snapshot is written for the
+dashboard.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from reddit_stream import iter_posts
+
+STATE_DIR = "data/cache/trending"
+SNAPSHOT_PATH = "data/processed/trending_keywords.json"
+# (bucket width in seconds, buckets kept)
+LEVELS = [(3600, 48), (86400, 90)]
+SKETCH_DEPTH = 4
+SKETCH_WIDTH = 1024
+CAPACITY = 256
+# Bits and hash functions per daily filter of ingested documents: about 1% false positives
+# (a new document skipped) at 100k documents a day
+SEEN_BITS = 1 << 20
+SEEN_HASHES = 7
+SNAPSHOT_WINDOWS = {"24h": 24 * 3600, "7d": 7 * 86400, "30d": 30 * 86400}
+MIN_RISING_COUNT = 3
+
+
+def _hash_pair(key):
+    h = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+    return h & 0xFFFFFFFF, (h >> 32) | 1
+
+
+class CountMinSketch:
+    def __init__(self, depth=SKETCH_DEPTH, width=SKETCH_WIDTH, table=None):
+        self.depth = depth
+        self.width = width
+        self.table = table if table is not None else np.zeros((depth, width), dtype=np.int32)
+
+    def _cells(self, key):
+        h1, h2 = _hash_pair(key)
+        return np.arange(self.depth), (h1 + np.arange(self.depth) * h2) % self.width
+
+    def add(self, key, count=1):
+        self.table[self._cells(key)] += count
+
+    def estimate(self, key):
+        return int(self.table[self._cells(key)].min())
+
+
+class SpaceSaving:
+    def __init__(self, capacity=CAPACITY, counts=None, errors=None):
+        self.capacity = capacity
+        self.counts = dict(counts or {})
+        self.errors = dict(errors or {})
+
+    def add(self, key, count=1):
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+        else:
+            # Replace the smallest counter; its count becomes the newcomer's error bound
+            victim = min(self.counts, key=self.counts.get)
+            floor = self.counts.pop(victim)
+            self.errors.pop(victim, None)
+            self.counts[key] = floor + count
+            self.errors[key] = floor
+
+    def to_dict(self):
+        return {"counts": self.counts, "errors": self.errors}
+
+
+class SeenFilter:
+    """Document keys already ingested, as one Bloom filter per time bucket.
+
+    Keys are added to the bucket of their timestamp and looked up in every bucket,
+    so a headline re-fetched on a later day still counts once; whole buckets are
+    dropped as they leave the horizon.
+    """
+
+    def __init__(self, size, bits=SEEN_BITS, hashes=SEEN_HASHES, starts=(), table=None):
+        self.size = size
+        self.bits = bits
+        self.hashes = hashes
+        self.starts = list(starts)
+        # One row of packed bits per bucket, so a lookup checks every bucket at once
+        self.table = table if table is not None else np.zeros((0, bits // 8), dtype=np.uint8)
+
+    def _positions(self, key):
+        h1, h2 = _hash_pair(key)
+        bits = (h1 + np.arange(self.hashes, dtype=np.int64) * h2) % self.bits
+        return bits >> 3, (1 << (bits & 7)).astype(np.uint8)
+
+    def __contains__(self, key):
+        if not self.starts:
+            return False
+        index, mask = self._positions(key)
+        return bool(np.any(np.all(self.table[:, index] & mask, axis=1)))
+
+    def add(self, key, timestamp):
+        start = int(timestamp // self.size * self.size)
+        if start not in self.starts:
+            self.starts.append(start)
+            self.table = np.vstack([self.table, np.zeros((1, self.table.shape[1]), dtype=np.uint8)])
+        index, mask = self._positions(key)
+        self.table[self.starts.index(start), index] |= mask
+
+    def expire(self, horizon):
+        keep = [i for i, start in enumerate(self.starts) if start + self.size > horizon]
+        self.starts = [self.starts[i] for i in keep]
+        self.table = self.table[keep]
+
+
+class TrendingEngine:
+    def __init__(self, levels=LEVELS, depth=SKETCH_DEPTH, width=SKETCH_WIDTH, capacity=CAPACITY):
+        self.levels = list(levels)
+        self.depth = depth
+        self.width = width
+        self.capacity = capacity
+        # {bucket width: {bucket start: (CountMinSketch, SpaceSaving)}}
+        self.buckets = {size: {} for size, _ in self.levels}
+        # Document keys already ingested, expired with the coarsest level
+        self.seen = SeenFilter(self.levels[-1][0])
+
+    def _bucket(self, size, start):
+        buckets = self.buckets[size]
+        if start not in buckets:
+            buckets[start] = (CountMinSketch(self.depth, self.width), SpaceSaving(self.capacity))
+        return buckets[start]
+
+    def add(self, doc_key, timestamp, keywords, now=None):
+        now = now or time.time()
+        horizon = max(size * keep for size, keep in self.levels)
+        if doc_key in self.seen or timestamp < now - horizon:
+            return False
+        self.seen.add(doc_key, timestamp)
+        for size, keep in self.levels:
+            if timestamp < now - size * keep:
+                continue
+            sketch, heavy = self._bucket(size, int(timestamp // size * size))
+            for keyword in keywords:
+                sketch.add(keyword)
+                heavy.add(keyword)
+        return True
+
+    def expire(self, now=None):
+        now = now or time.time()
+        for size, keep in self.levels:
+            oldest = (now // size - keep + 1) * size
+            for start in [s for s in self.buckets[size] if s < oldest]:
+                del self.buckets[size][start]
+        self.seen.expire(now - max(size * keep for size, keep in self.levels))
+
+    def _level_for(self, window):
+        # Finest level that still holds this window and the one before it
+        for size, keep in self.levels:
+            if 2 * window <= size * keep:
+                return size
+        return self.levels[-1][0]
+
+    def _window(self, size, start, end):
+        table = np.zeros((self.depth, self.width), dtype=np.int64)
+        candidates = set()
+        for bucket_start, (sketch, heavy) in self.buckets[size].items():
+            if start <= bucket_start < end:
+                table += sketch.table
+                candidates.update(heavy.counts)
+        return CountMinSketch(self.depth, self.width, table), candidates
+
+    def window_counts(self, window, now=None):
+        now = now or time.time()
+        size = self._level_for(window)
+        end = (now // size + 1) * size
+        current, candidates = self._window(size, end - window, end)
+        previous, _ = self._window(size, end - 2 * window, end - window)
+        return {key: (current.estimate(key), previous.estimate(key)) for key in candidates}
+
+    def top(self, window, n=15, now=None):
+        counts = self.window_counts(window, now)
+        ranked = sorted(((current, key) for key, (current, _) in counts.items() if current > 0), reverse=True)
+        return [{"keyword": key, "count": count} for count, key in ranked[:n]]
+
+    def rising(self, window, n=10, now=None, min_count=MIN_RISING_COUNT):
+        counts = self.window_counts(window, now)
+        scored = []
+        for key, (current, previous) in counts.items():
+            if current < min_count or current <= previous:
+                continue
+            # Smoothed ratio, so a jump from 0 to 3 does not outrank 40 to 120
+            growth = (current + 1) / (previous + 1)
+            scored.append((growth * np.log1p(current), key, current, previous, growth))
+        scored.sort(reverse=True)
+        return [{"keyword": key, "count": current, "previous": previous, "growth": round(growth, 2)}
+                for _, key, current, previous, growth in scored[:n]]
+
+    def save(self, state_dir=STATE_DIR):
+        os.makedirs(state_dir, exist_ok=True)
+        arrays = {"seen": self.seen.table}
+        meta = {"levels": self.levels, "depth": self.depth, "width": self.width, "capacity": self.capacity,
+                "seen_filter": {"bits": self.seen.bits, "hashes": self.seen.hashes, "starts": self.seen.starts},
+                "buckets": {}}
+        for size, buckets in self.buckets.items():
+            meta["buckets"][str(size)] = {}
+            for start, (sketch, heavy) in buckets.items():
+                arrays[f"{size}_{start}"] = sketch.table
+                meta["buckets"][str(size)][str(start)] = heavy.to_dict()
+        tmp_npz = os.path.join(state_dir, "sketches.tmp.npz")
+        np.savez_compressed(tmp_npz, **arrays)
+        os.replace(tmp_npz, os.path.join(state_dir, "sketches.npz"))
+        tmp_json = os.path.join(state_dir, "state.json.tmp")
+        with open(tmp_json, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_json, os.path.join(state_dir, "state.json"))
+
+    @classmethod
+    def load(cls, state_dir=STATE_DIR):
+        meta_path = os.path.join(state_dir, "state.json")
+        if not os.path.exists(meta_path):
+            return cls()
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        engine = cls([tuple(level) for level in meta["levels"]], meta["depth"], meta["width"], meta["capacity"])
+        with np.load(os.path.join(state_dir, "sketches.npz")) as arrays:
+            if "seen_filter" in meta:
+                seen = meta["seen_filter"]
+                engine.seen = SeenFilter(engine.levels[-1][0], seen["bits"], seen["hashes"], seen["starts"],
+                                         arrays["seen"])
+            else:
+                # State from before the filters kept every key with its timestamp
+                for key, ts in meta.get("seen", {}).items():
+                    engine.seen.add(key, ts)
+            for size, buckets in meta["buckets"].items():
+                for start, heavy in buckets.items():
+                    sketch = CountMinSketch(engine.depth, engine.width, arrays[f"{size}_{start}"])
+                    engine.buckets[int(size)][int(start)] = (
+                        sketch, SpaceSaving(engine.capacity, heavy["counts"], heavy["errors"])
+                    )
+        return engine
+
+
+def _timestamp(value):
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def iter_documents(tweets_csv=None, news_csvs=(), reddit_json=None, now=None):
+    # Yields (doc_key, timestamp, text); headlines carry no date and count from when they were first seen
+    now = now or time.time()
+    if tweets_csv and os.path.exists(tweets_csv):
+        with open(tweets_csv, encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                text = row.get("text", "")
+                key = hashlib.sha1(f"{row.get('author_id')}|{row.get('created_at')}|{text}".encode("utf-8")).hexdigest()
+                yield f"tweet:{key}", _timestamp(row.get("created_at")) or now, text
+    for news_csv in news_csvs:
+        if os.path.exists(news_csv):
+            with open(news_csv, encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    title = row.get("title", "")
+                    yield f"news:{row.get('url') or title}", now, title
+    if reddit_json and os.path.exists(reddit_json):
+        for post in iter_posts(reddit_json):
+            text = f"{post.get('post_title', '')}\n{post.get('post_text', '')}".strip()
+            yield f"reddit:{post.get('post_id')}", _timestamp(post.get("created_utc")) or now, text
+
+
+def ingest(engine, documents, extract_fn, batch_size=512, now=None):
+    """Runs keyword extraction on unseen documents only and adds them to the engine."""
+    now = now or time.time()
+    horizon = now - max(size * keep for size, keep in engine.levels)
+    added = 0
+    batch, queued = [], set()
+
+    def flush():
+        nonlocal added
+        for (key, ts, _), keywords in zip(batch, extract_fn([text for _, _, text in batch])):
+            engine.add(key, ts, keywords, now=now)
+        added += len(batch)
+        # Once added, the engine's filter remembers these keys
+        batch.clear()
+        queued.clear()
+
+    # Documents stream through in batches, so memory holds one batch however large the sources
+    for key, ts, text in documents:
+        if text and key not in engine.seen and key not in queued and ts >= horizon:
+            queued.add(key)
+            batch.append((key, ts, text))
+            if len(batch) >= batch_size:
+                flush()
+    if batch:
+        flush()
+    engine.expire(now)
+    return added
+
+
+def write_snapshot(engine, path=SNAPSHOT_PATH, windows=SNAPSHOT_WINDOWS, top_n=15, now=None):
+    now = now or time.time()
+    snapshot = {
+        "as_of": datetime.fromtimestamp(now, tz=timezone.utc).isoformat(timespec="seconds"),
+        "windows": {
+            name: {"top": engine.top(seconds, top_n, now), "rising": engine.rising(seconds, 10, now)}
+            for name, seconds in windows.items()
+        },
+    }
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+    return snapshot
+
+
+def update_trending(tweets_csv=None, news_csvs=(), reddit_json=None, state_dir=STATE_DIR,
+                    snapshot_path=SNAPSHOT_PATH, use_cache=True):
+    from topics import document_keywords
+    engine = TrendingEngine.load(state_dir)
+    now = time.time()
+    extract_fn = lambda texts: [[kw.lower() for kw in keywords]
+                                for keywords in document_keywords(texts, use_cache=use_cache)]
+    added = ingest(engine, iter_documents(tweets_csv, news_csvs, reddit_json, now), extract_fn, now=now)
+    engine.save(state_dir)
+    write_snapshot(engine, snapshot_path, now=now)
+    print(f"Trending: extracted keywords for {added} new documents, snapshot saved to '{snapshot_path}'")
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the trending keyword sketches")
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args(argv)
+    engine = TrendingEngine.load()
+    window = int(args.hours * 3600)
+    print(f"Top keywords in the last {args.hours:g}h:")
+    for row in engine.top(window, args.top):
+        print(f"  {row['keyword']:<24} {row['count']}")
+    print("Rising versus the previous window:")
+    for row in engine.rising(window):
+        print(f"  {row['keyword']:<24} {row['previous']} -> {row['count']} (x{row['growth']})")
+
+
+if __name__ == "__main__":
+    main()